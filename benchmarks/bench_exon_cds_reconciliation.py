@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the exon/CDS reconciliation in add_mRNA_line.py.
+
+Builds transcripts with many exons (a CDS segment per exon, with UTR parts in
+the first and last exons) and times reconcile_exons_with_cds() against the
+former per-exon linear scan over all CDS with adjust_exon_to_cds() (copied
+below from the original add_mRNA_line.py), checking that both agree.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'postprocessing_scripts'))
+from add_mRNA_line import reconcile_exons_with_cds
+
+# The former adjust_exon_to_cds(), unchanged
+def adjust_exon_to_cds(exon_start, exon_end, cds_regions):
+    """
+    Adjust exon coordinates to match the CDS coordinates. 
+    Return the adjusted exon coordinates and any leftover regions as introns.
+    """
+    for cds_start, cds_end in cds_regions:
+        # Exon completely overlaps with CDS
+        if exon_start >= cds_start and exon_end <= cds_end:
+            return (exon_start, exon_end, None, None)  # No intron part
+
+        # Exon partially overlaps with CDS on the left side
+        elif exon_start < cds_start and exon_end <= cds_end and exon_end > cds_start:
+            return (cds_start, exon_end, exon_start, cds_start - 1)  # Intron on the left
+
+        # Exon partially overlaps with CDS on the right side
+        elif exon_start >= cds_start and exon_start < cds_end and exon_end > cds_end:
+            return (exon_start, cds_end, cds_end + 1, exon_end)  # Intron on the right
+
+        # Exon surrounds the CDS completely (creates two introns)
+        elif exon_start < cds_start and exon_end > cds_end:
+            return (cds_start, cds_end, exon_start, cds_start - 1)  # Intron left, and exon_end -> intron
+
+    # If no match with CDS, return exon as intron
+    return (None, None, exon_start, exon_end)
+
+def linear_scan(exons, cds_regions):
+    """The former loop of flush_transcript_features(): rebuild the CDS list for every exon and scan it from the start."""
+    adjusted = []
+    for exon_start, exon_end in exons:
+        regions = [(cds_start, cds_end) for cds_start, cds_end in cds_regions]
+        adjusted.append(adjust_exon_to_cds(exon_start, exon_end, regions))
+    return adjusted
+
+def agrees(swept, scanned):
+    """
+    True if the sweep gives the same exon coordinates and the same (first) intron as the former scan.
+
+    The former function returned only the left part of an exon surrounding its CDS;
+    the sweep also returns the right part as a second intron.
+    """
+    start, end, introns = swept
+    scanned_start, scanned_end, intron_start, intron_end = scanned
+    if (start, end) != (scanned_start, scanned_end):
+        return False
+    if intron_start is None:
+        return introns == []
+    return introns[0] == (intron_start, intron_end)
+
+def make_transcript(rng, exon_count):
+    exons = []
+    cds_regions = []
+    position = rng.randint(1, 1000)
+    for i in range(exon_count):
+        length = rng.randint(50, 400)
+        exons.append((position, position + length))
+        cds_start = position + (rng.randint(1, length // 2) if i == 0 else 0)
+        cds_end = position + length - (rng.randint(1, length // 2) if i == exon_count - 1 else 0)
+        cds_regions.append((cds_start, cds_end))
+        position += length + rng.randint(60, 2000)
+    if rng.random() < 0.5:
+        # minus strand genes list their features from the 3' end
+        exons.reverse()
+        cds_regions.reverse()
+    return exons, cds_regions
+
+def time_function(function, transcripts, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for exons, cds_regions in transcripts:
+            function(exons, cds_regions)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the exon/CDS reconciliation of add_mRNA_line.py on transcripts with many exons.')
+    parser.add_argument('-e', '--exons', type=int, nargs='+', default=[10, 100, 300, 1000], help='Exon counts per transcript to test')
+    parser.add_argument('-t', '--transcripts', type=int, default=50, help='Number of transcripts per exon count')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Repetitions; the best time is reported')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print("exons\tlinear_scan_s\tsweep_s\tspeedup")
+    for exon_count in args.exons:
+        transcripts = [make_transcript(rng, exon_count) for _ in range(args.transcripts)]
+        for exons, cds_regions in transcripts:
+            swept = reconcile_exons_with_cds(exons, cds_regions)
+            scanned = linear_scan(exons, cds_regions)
+            assert len(swept) == len(scanned) and all(map(agrees, swept, scanned))
+        linear = time_function(linear_scan, transcripts, args.repeats)
+        sweep = time_function(reconcile_exons_with_cds, transcripts, args.repeats)
+        print(f"{exon_count}\t{linear:.4f}\t{sweep:.4f}\t{linear / sweep:.1f}x")
+
+if __name__ == "__main__":
+    main()
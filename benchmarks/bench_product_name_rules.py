@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the product name rules in fix_product_names_ncbi.py.
+
+Runs the former chain of re.sub() calls per name (copied below from the
+original fix_product_names_ncbi.py) and the compiled rule table on the same
+product names, checks that both give the same result and times them.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'postprocessing_scripts'))
+import fix_product_names_ncbi
+from compressed_io import xopen
+from synthetic_data import PRODUCTS, BAD_PRODUCTS
+
+# The former fix_product_name(), unchanged
+def fix_product_name(product_name):
+    # Fix uncharacterized protein
+    if product_name.startswith("uncharacterized protein"):
+        product_name = "putative protein"
+    import re
+
+    # Check if 'putative' is the last word
+    if re.search(r'\bputative\b\s*$', product_name, flags=re.IGNORECASE):
+        #print("Trying to move putative in ", product_name)
+        # Remove 'putative' from the end and strip any extra spaces
+        product_name = re.sub(r'\bputative\b\s*$', '', product_name, flags=re.IGNORECASE).strip()
+        # Add 'putative' to the front
+        product_name = 'putative ' + product_name
+        #print(product_name)
+
+    
+    # if a product name ends in uncharacterised, remove that
+    product_name = re.sub(r'\buncharacterised\b\s*$', '', product_name, flags=re.IGNORECASE)
+    # remove trailing whitespace
+    product_name = product_name.strip()
+
+    # Fix hypothetical protein only if followed by additional text, keeping the rest of the text
+    if product_name.startswith("hypothetical protein\s"):
+        product_name = product_name.replace("hypothetical protein", "putative protein", 1)
+    
+    # Fix proteins protein
+    product_name = re.sub(r'proteins protein', 'protein', product_name)
+
+    # Fix plural forms (simple heuristic)
+    product_name = re.sub(r'proteins', 'protein', product_name)
+
+    # Remove suspicious phrases
+    product_name = re.sub(r'truncat(ed|ion)?', '', product_name)
+    product_name = re.sub(r'Truncated ', r'Nonfunctional ', product_name)
+    product_name = re.sub(r'Fragment', r'', product_name, flags=re.IGNORECASE)
+    product_name = re.sub(r'partial', r'', product_name, flags=re.IGNORECASE)
+
+    # Remove strings containing three or more consecutive digits (may be part of a larger string)
+    product_name = re.sub(r'\S*\d{3,}\S*', r'', product_name)
+
+    product_name = product_name.replace('_', ' ')  # Replace underscores with spaces
+
+    # Change homologs/paralogs to '-like protein'
+    if not(re.search(r'-like', product_name)):
+        product_name = re.sub(r'\b(Homolog|paralog)\b', r'-like protein', product_name)
+        product_name = re.sub(r'\shomolog', r'-like protein', product_name)
+    else:
+        product_name = re.sub(r'\b(Homolog|paralog)\b', r'', product_name)
+        product_name = re.sub(r'\shomolog', r'', product_name)
+    # also remove like from chloroplastic-like and mitochondrial-like
+    product_name = re.sub(r'chloroplastic-like', r'chloroplastic', product_name)
+    product_name = re.sub(r'mitochondrial-like', r'mitochondrial', product_name)
+    product_name = re.sub(r'chloroplasticchromoplastic-like', r'chloroplasticchromoplastic', product_name)
+
+    # remove -like proteins from protein -like protein
+    product_name = re.sub(r'protein -like protein', r'protein', product_name)
+
+    # if a product name contains --, make it one -
+    product_name = re.sub(r'--', '-', product_name)
+
+    # someone seriously submitted a homeolog, replace by nothing
+    product_name = re.sub(r'homeolog', '', product_name)
+
+    # make forms singular
+    product_name = re.sub(r'forms', 'form', product_name)
+
+    # if a product name contains two times -like, remove the last -like
+    product_name = re.sub(r'-like(.*)-like', r'\1-like', product_name)
+
+    # if a product name contains -like putative, remove putative
+    if re.search(r'-like', product_name) and re.search(r'putative', product_name):
+        product_name = re.sub(r'putative', r'', product_name)
+
+    # make yippee-like uniformal, if there is no dash, introduce it
+    product_name = re.sub(r'yippee like', r'yippee-like', product_name)
+
+    # if a product name ends in like \d+, remove the digits
+    product_name = re.sub(r'like \d+$', r'like', product_name)
+    # if a product name ends in containing \d+ remove digits
+    product_name = re.sub(r'containing \d+$', r'containing', product_name)
+
+    # Shorten long product names to 100 characters
+    if len(product_name) > 100:
+        # Find the last space before the 100th character
+        last_space = product_name[:100].rfind(' ')
+        # replace product_name with the first 100 characters up to the last space
+        product_name = product_name[:last_space].rstrip()
+
+    # Replace 'gene' with 'protein'
+    product_name = re.sub(r'\bgene\b', r'protein', product_name)
+
+    # Fix product names starting with "and"
+    if re.match(r'\s?and\s', product_name):
+        product_name = product_name[4:].strip()
+
+    # Fix product names starting with "a"
+    if re.match(r'\s?a\s', product_name):
+        product_name = product_name[2:].strip()
+
+    # Remove "FOG" from product names
+    product_name = product_name.replace("FOG", "")
+
+    # If a product name contains gp, replace the entire product name with "Hypothetical protein"
+    if re.search(r'gp', product_name):
+        product_name = "hypothetical protein"
+
+    # Replace "possibly", "residue", and "unnamed" with empty strings or replacements
+    product_name = re.sub(r'\bpossibly\b', r'', product_name, flags=re.IGNORECASE)
+    product_name = re.sub(r'\bresidue\b', r'', product_name, flags=re.IGNORECASE)
+    product_name = re.sub(r'\bunnamed\b', r'putative protein', product_name, flags=re.IGNORECASE)
+
+    # if product ends in family, replace with family member
+    product_name = re.sub(r'family$', r'family member', product_name, flags=re.IGNORECASE)
+
+    # fix plurals
+    product_name = re.sub(r'ases', r'ase', product_name)
+    product_name = re.sub(r'proteins', r'protein', product_name)
+    product_name = re.sub(r'units', r'unit', product_name)
+    product_name = re.sub(r'ac-diamides', r'ac-diamide', product_name)
+    product_name = re.sub(r'chaperonins', r'chaperonin', product_name)
+    product_name = re.sub(r'complexes', r'complex', product_name)
+    product_name = re.sub(r'condensins', r'condensin', product_name)
+    product_name = re.sub(r'copines', r'copine', product_name)
+    product_name = re.sub(r'biotransformers', r'biotransformer', product_name)
+    product_name = re.sub(r'enzymes', r'enzyme', product_name)
+    product_name = re.sub(r'cyclins', r'cyclin', product_name)
+    product_name = re.sub(r'cylophilins', r'cylophilin', product_name)
+    product_name = re.sub(r'channels', r'channel', product_name)
+    product_name = re.sub(r'mutants', r'mutant', product_name)
+    product_name = re.sub(r'receptors', r'receptor', product_name)
+    product_name = re.sub(r'retroposons', r'retroposon', product_name)
+    product_name = re.sub(r'factors', r'factor', product_name)
+    product_name = re.sub(r'members', r'member', product_name)
+    product_name = re.sub(r'antigens', r'antigen', product_name)
+
+    # if something comes afte -like, move the -like to the end of the string
+    product_name = re.sub(r'(.*)-like(.*)', r'\1\2-like', product_name)
+
+    # if manganese-dependent
+    product_name = re.sub(r'manganese-dependent', r'manganese dependent', product_name)
+    # if it contains dependent but neither protein nor enzyme nor complex, append protein
+    if re.search(r'dependent', product_name) and not re.search(r'protein|enzyme|complex', product_name):
+        product_name = product_name + ' protein'
+
+    if re.search(r'^\s*1-like$', product_name) or re.search(r'^\s*1 protein-like$', product_name):
+        product_name = re.sub(r'^\s*1-like$', r'hypothetical protein', product_name)
+        product_name = re.sub(r'^\s*1 protein-like$', r'hypothetical protein', product_name)
+
+    # residue Fragilaria_radians.dr # this should be ignored, it's valuable information
+    # conserved protein Thalassiosira_delicatula.dr I think this should also be ignored
+
+    # Convert all-caps product names to title case
+    if product_name.isupper():
+        product_name = product_name.title()
+
+    # Collapse multiple spaces into a single space and strip leading/trailing whitespace
+    product_name = re.sub(r'\s+', ' ', product_name).strip()
+
+    return product_name.strip()
+
+# Words and affixes combined with the synthetic product names, so that every rule has names to act on
+PREFIXES = ['', '', '', 'and ', 'a ', ' and ', 'Putative ', 'Probable ', 'Similar to ', 'Homologous to ', 'unnamed ',
+            'Conserved ', 'Predicted ', 'possibly ', '1 ', 'FOG: ']
+SUFFIXES = ['', '', '', ' putative', ' partial', ' fragment', ' family', ' like 12', ' containing 3', '-like',
+            '-like protein', ' proteins', ' gene', ' kinases', ' subunits', ' complexes', ' receptors', ' factors',
+            ' residue', ' gp41', ' NAD-dependent', ' manganese-dependent enzyme', ', putative', '  ', ' (Fragment)',
+            ' yippee like', ' homolog', ' domain-containing protein 2']
+
+def make_names(rng, count):
+    """Return count product names built from the synthetic names with random prefixes and suffixes."""
+    names = []
+    for _ in range(count):
+        name = rng.choice(PREFIXES) + rng.choice(PRODUCTS + BAD_PRODUCTS) + rng.choice(SUFFIXES)
+        if rng.random() < 0.1:
+            name += rng.choice(SUFFIXES)
+        if rng.random() < 0.05:
+            name = name.upper()
+        if rng.random() < 0.02:
+            name = ' '.join([name] * 5)
+        names.append(name)
+    return names
+
+def read_names(file):
+    with xopen(file) as infile:
+        return [line.rstrip('\n') for line in infile if line.strip()]
+
+def time_function(function, names, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for name in names:
+            function(name)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the product name rules of fix_product_names_ncbi.py against the former re.sub() chain.')
+    parser.add_argument('-n', '--names', type=int, default=100000, help='Number of synthetic product names')
+    parser.add_argument('-i', '--input', help='Text file with one product name per line, used instead of synthetic names')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Repetitions; the best time is reported')
+    args = parser.parse_args()
+
+    names = read_names(args.input) if args.input else make_names(random.Random(42), args.names)
+    for name in names:
+        expected = fix_product_name(name)
+        fixed = fix_product_names_ncbi.fix_product_name(name)
+        assert fixed == expected, f"{name!r}: rule table gives {fixed!r}, former chain gives {expected!r}"
+    former = time_function(fix_product_name, names, args.repeats)
+    rules = time_function(fix_product_names_ncbi.fix_product_name, names, args.repeats)
+    print("names\tdistinct\tre_sub_chain_s\trule_table_s\tspeedup")
+    print(f"{len(names)}\t{len(set(names))}\t{former:.4f}\t{rules:.4f}\t{former / rules:.1f}x")
+
+if __name__ == "__main__":
+    main()
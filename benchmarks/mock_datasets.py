@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `datasets summary gene accession --report gene --as-json-lines --inputfile FILE`.
+
+Answers from the gene report written by synthetic_data.py instead of
+querying NCBI, so ncbi_gff.py can be benchmarked offline:
+
+    ncbi_gff.py --datasets "python3 mock_datasets.py --gene-report datasets_report.jsonl" ...
+"""
+
+import sys
+import json
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer datasets gene summary requests from a local gene report.')
+    parser.add_argument('--gene-report', required=True, help='Gene report, one JSON line per gene (datasets_report.jsonl)')
+    parser.add_argument('--inputfile', required=True, help='File with one accession per line')
+    args, _ = parser.parse_known_args()
+
+    with open(args.inputfile, 'r') as accession_file:
+        accessions = set(line.strip() for line in accession_file if line.strip())
+
+    with open(args.gene_report, 'r') as report_file:
+        for line in report_file:
+            report = json.loads(line)
+            queries = [query for query in report['query'] if query in accessions]
+            if queries:
+                report['query'] = queries
+                sys.stdout.write(json.dumps(report) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmark the annotation scripts on synthetic data and compare with stored baselines.
+
+Every stage of the pipeline runs as its own process on the data written by
+synthetic_data.py (generated on first use). For each stage the wall time,
+the throughput (MB of the main input per second) and the peak RSS of the
+largest process are recorded. The results are compared with the baselines in
+baselines.json (same scale and number of jobs); a stage that got slower or
+bigger than the tolerance allows is reported as a regression and the exit
+status is 1. --update-baseline stores the current results instead.
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from synthetic_data import SCALES
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+POSTPROCESSING_DIR = os.path.join(REPO_DIR, 'postprocessing_scripts')
+ENTAP_DIR = os.path.join(REPO_DIR, 'entap_related_scripts')
+DEFAULT_BASELINES = os.path.join(BENCHMARK_DIR, 'baselines.json')
+
+# Differences in wall time below this many seconds are never reported as regressions
+NOISE_FLOOR = 0.05
+
+class Stage:
+    """
+    One script run: name, command, main input (for the throughput), the
+    stages whose output it reads and files (caches) removed before every run.
+    """
+
+    def __init__(self, name, command, main_input, requires=(), fresh=()):
+        self.name = name
+        self.command = command
+        self.main_input = main_input
+        self.requires = requires
+        self.fresh = fresh
+
+def pipeline_stages(data_dir, work_dir, species, jobs):
+    """The benchmarked stages for one species, in pipeline order, plus ncbi_gff_all.py for all species."""
+    python = sys.executable
+    braker = os.path.join(data_dir, 'braker', species)
+    gtf = os.path.join(braker, 'braker.gtf')
+    keep_list = os.path.join(braker, 'good_tx.lst')
+    gff = os.path.join(data_dir, 'gff', f"{species}.gff")
+    tsv = os.path.join(data_dir, 'tsv', f"{species}.tsv")
+    pfam = os.path.join(data_dir, 'pdb_pfam_mapping.txt')
+    datasets = f"{shlex.quote(python)} {shlex.quote(os.path.join(BENCHMARK_DIR, 'mock_datasets.py'))} " \
+               f"--gene-report {shlex.quote(os.path.join(data_dir, 'datasets_report.jsonl'))}"
+
+    def work(name):
+        return os.path.join(work_dir, name)
+
+    def script(directory, name):
+        return [python, os.path.join(directory, name)]
+
+    job_args = ['-j', str(jobs)] if jobs > 1 else []
+    decorated = work('decorated.gff3')
+    return [
+        Stage('filter_gtf_sets', script(POSTPROCESSING_DIR, 'filter_genes_from_uconn_gff3.py') +
+              ['-g', gtf, '-s', f"keep={keep_list}", '-k', 'keep', '-o', work('filtered.gtf'), '-c', work('counts.tsv')], gtf),
+        Stage('longest_isoform', script(POSTPROCESSING_DIR, 'get_longest_isoform_from_braker_aa.py') +
+              ['-i', os.path.join(braker, 'braker.aa'), '-o', work('longest.aa')], os.path.join(braker, 'braker.aa')),
+        Stage('ncbi_gff', script(ENTAP_DIR, 'ncbi_gff.py') + job_args +
+              ['--datasets', datasets, '-r', work('refseq_cache.sqlite'), '--aux-prefix', work('ncbi_gff.'),
+               tsv, gff, pfam, decorated], gff, fresh=(work('refseq_cache.sqlite'),)),
+        Stage('filter_gff3', script(POSTPROCESSING_DIR, 'filter_genes_from_uconn_gff3.py') +
+              ['-g', decorated, '-l', keep_list, '-o', work('filtered.gff3')], decorated, ('ncbi_gff',)),
+        Stage('add_mRNA_line', script(POSTPROCESSING_DIR, 'add_mRNA_line.py') + job_args +
+              ['-i', work('filtered.gff3'), '-o', work('mRNA.gff3')], work('filtered.gff3'), ('filter_gff3',)),
+        Stage('fix_product_names', script(POSTPROCESSING_DIR, 'fix_product_names_ncbi.py') + job_args +
+              ['-i', work('mRNA.gff3'), '-o', work('fixed_names.gff3')], work('mRNA.gff3'), ('add_mRNA_line',)),
+        Stage('fix_dbxref', script(POSTPROCESSING_DIR, 'fix_Dbxref_attributes_in_genes.py') + job_args +
+              ['-i', work('fixed_names.gff3'), '-o', work('fixed_dbxref.gff3')], work('fixed_names.gff3'), ('fix_product_names',)),
+        Stage('postprocess', script(POSTPROCESSING_DIR, 'postprocess.py') +
+              ['-i', decorated, '-l', keep_list, '-o', work('postprocessed.gff3')], decorated, ('ncbi_gff',)),
+        Stage('gene_index', script(POSTPROCESSING_DIR, 'extract_genes_from_gff3.py') +
+              ['-g', work('fixed_dbxref.gff3'), '--index-only'], work('fixed_dbxref.gff3'), ('fix_dbxref',)),
+        Stage('ncbi_gff_all', script(ENTAP_DIR, 'ncbi_gff_all.py') +
+              ['--datasets', datasets, '-r', work('refseq_cache_all.sqlite'), '--aux-prefix', work('all_species.'),
+               '-o', work('ncbi_gff_all'), '-s', work('ncbi_gff_summary.tsv'),
+               os.path.join(data_dir, 'gff'), os.path.join(data_dir, 'tsv'), pfam], os.path.join(data_dir, 'gff'),
+              fresh=(work('refseq_cache_all.sqlite'),)),
+    ]
+
+def input_size(path):
+    """Size of a file, or of all files in a directory, in bytes."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+def measure(command, log_path):
+    """Run command; returns (exit status, wall seconds, peak RSS in MB of the largest process)."""
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(log_path))
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS. Linux keeps the
+    # peak of the forking process across exec, so the size of this process
+    # (about 15 MB) is the smallest value that can be measured.
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return process.returncode, wall, peak_rss
+
+def run_stages(stages, work_dir, repeats, selected=None):
+    """Run the stages (best wall time of repeats); returns a dict stage name -> result."""
+    results = {}
+    failed = set()
+    for stage in stages:
+        if selected and stage.name not in selected:
+            continue
+        if any(required in failed for required in stage.requires):
+            failed.add(stage.name)
+            results[stage.name] = {'status': 'skipped'}
+            continue
+        log_path = os.path.join(work_dir, f"{stage.name}.log")
+        best = None
+        for _ in range(repeats):
+            for path in stage.fresh:
+                if os.path.exists(path):
+                    os.remove(path)
+            status, wall, peak_rss = measure(stage.command, log_path)
+            if status != 0:
+                break
+            if best is None or wall < best[0]:
+                best = (wall, peak_rss)
+        if status != 0:
+            failed.add(stage.name)
+            results[stage.name] = {'status': 'failed'}
+            print(f"{stage.name} failed with exit status {status}, see {log_path}", file=sys.stderr)
+            continue
+        size_mb = input_size(stage.main_input) / (1024 * 1024)
+        results[stage.name] = {
+            'status': 'ok',
+            'wall_s': round(best[0], 4),
+            'peak_rss_mb': round(best[1], 1),
+            'input_mb': round(size_mb, 2),
+            'mb_per_s': round(size_mb / best[0], 2) if best[0] > 0 else None,
+        }
+    return results
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    """Return the rows of the comparison table and the names of the regressed stages."""
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if result['status'] != 'ok':
+            rows.append((name, result['status'], '', '', '', '', ''))
+            regressions.append(name)
+            continue
+        if not base:
+            rows.append((name, f"{result['wall_s']:.3f}", '-', '', f"{result['peak_rss_mb']:.1f}", '-', 'new'))
+            continue
+        time_change = result['wall_s'] / base['wall_s'] - 1 if base['wall_s'] else 0.0
+        rss_change = result['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base['peak_rss_mb'] else 0.0
+        status = 'ok'
+        if time_change > tolerance and result['wall_s'] - base['wall_s'] > NOISE_FLOOR:
+            status = 'SLOWER'
+        if rss_change > rss_tolerance:
+            status = 'BIGGER' if status == 'ok' else 'SLOWER+BIGGER'
+        if status != 'ok':
+            regressions.append(name)
+        rows.append((name, f"{result['wall_s']:.3f}", f"{base['wall_s']:.3f}", f"{time_change:+.0%}",
+                     f"{result['peak_rss_mb']:.1f}", f"{base['peak_rss_mb']:.1f}", status))
+    return rows, regressions
+
+def print_table(rows):
+    header = ('stage', 'wall_s', 'base_wall_s', 'change', 'rss_mb', 'base_rss_mb', 'status')
+    widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip())
+
+def host_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%d')}
+
+def prepare_data(data_dir, species_count, gene_count, seed):
+    """Generate the synthetic data set unless data_dir already holds one of the same size."""
+    info_path = os.path.join(data_dir, 'dataset.json')
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as info_file:
+            info = json.load(info_file)
+        if (info.get('species'), info.get('genes'), info.get('seed')) == (species_count, gene_count, seed):
+            return
+        shutil.rmtree(data_dir)
+    print(f"Generating {species_count} species with {gene_count} genes each in {data_dir}")
+    # In a separate process, so the benchmark process (which the stages are forked from) stays small
+    subprocess.run([sys.executable, os.path.join(BENCHMARK_DIR, 'synthetic_data.py'), '-o', data_dir,
+                    '-n', str(species_count), '-g', str(gene_count), '--seed', str(seed)], check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the annotation scripts on synthetic data and compare with stored baselines.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Predefined data set size, see synthetic_data.py (default: small)')
+    parser.add_argument('-n', '--species', type=int, help='Number of species (overrides --scale)')
+    parser.add_argument('-g', '--genes', type=int, help='Number of genes per species (overrides --scale)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the synthetic data (default: 1)')
+    parser.add_argument('-d', '--data-dir', help='Directory of the synthetic data, generated if needed (default: bench_data/<scale>)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes for the scripts that accept -j (default: 1)')
+    parser.add_argument('-r', '--repeats', type=int, default=1, help='Runs per stage; the fastest run is reported (default: 1)')
+    parser.add_argument('-s', '--stage', action='append', help='Only run this stage (can be given several times); stages need the output of the stages before them')
+    parser.add_argument('-b', '--baselines', default=DEFAULT_BASELINES, help='Baseline file (default: baselines.json next to this script)')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative increase of the wall time (default: 0.25)')
+    parser.add_argument('--rss-tolerance', type=float, default=0.15, help='Allowed relative increase of the peak RSS (default: 0.15)')
+    parser.add_argument('-o', '--output', help='Also write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='Keep the output files of the stages (the directory is printed)')
+    args = parser.parse_args()
+
+    species_count, gene_count = SCALES[args.scale]
+    if args.species or args.genes:
+        species_count = args.species or species_count
+        gene_count = args.genes or gene_count
+        key = f"custom-{species_count}x{gene_count}"
+    else:
+        key = args.scale
+    if args.jobs > 1:
+        key += f"-j{args.jobs}"
+    data_dir = os.path.abspath(args.data_dir or os.path.join('bench_data', key.split('-j')[0]))
+    prepare_data(data_dir, species_count, gene_count, args.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='annotation_bench_')
+    try:
+        stages = pipeline_stages(data_dir, work_dir, 'species_01', args.jobs)
+        results = run_stages(stages, work_dir, max(1, args.repeats), args.stage)
+    finally:
+        if args.keep:
+            print(f"Output files kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, 'r') as baseline_file:
+            baselines = json.load(baseline_file)
+    entry = {'host': host_info(), 'species': species_count, 'genes': gene_count, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(entry, output_file, indent=2)
+
+    if args.update_baseline:
+        if any(result['status'] != 'ok' for result in results.values()):
+            print("Not updating the baseline, some stages failed")
+            sys.exit(1)
+        if args.stage and key in baselines:
+            # Only replace the stages that were run
+            baselines[key]['results'].update(results)
+            baselines[key]['host'] = entry['host']
+        else:
+            baselines[key] = entry
+        with open(args.baselines, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Baseline '{key}' written to {args.baselines}")
+
+    rows, regressions = compare(results, baselines.get(key, {}).get('results', {}), args.tolerance, args.rss_tolerance)
+    print_table(rows)
+    if key not in baselines:
+        print(f"No baseline for '{key}' yet, store one with --update-baseline")
+    elif regressions and not args.update_baseline:
+        print(f"Regressions in: {', '.join(regressions)} (baseline from {baselines[key]['host']['date']} on {baselines[key]['host']['platform']})")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
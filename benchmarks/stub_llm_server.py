@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI-compatible chat completions server.
+
+Used to test and time find_bad_product_names_with_LLM.py without an API key:
+
+    stub_llm_server.py --port 8765 --fail-rate 0.2 &
+    find_bad_product_names_with_LLM.py -i names.txt --url http://127.0.0.1:8765/v1/chat/completions
+
+The reply flags the product names of the request that contain a word ending
+in "s". For a numbered list ("1. name" per line), it is a JSON object
+{"suspicious": [...]} with their numbers; otherwise (names separated by
+', ') it lists the names, one per line. With "stream": true in the request,
+the reply is sent as server-sent events in small pieces. A share of the
+requests (--fail-rate) is answered with 429 or 503 instead, and every reply
+can be delayed (--delay) to simulate the latency of a real model. GET /stats
+returns the number of requests, failures and connections seen so far.
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NUMBERED_ITEM = re.compile(r'^(\d+)\. (.*)$', re.MULTILINE)
+
+# Characters of the content per streamed event
+STREAM_PIECE = 8
+
+def is_suspicious(name):
+    return any(word.endswith('s') for word in name.lower().split())
+
+def suspicious_names(message):
+    return [name for name in message.split(', ') if is_suspicious(name)]
+
+def reply_content(message):
+    items = NUMBERED_ITEM.findall(message)
+    if items:
+        return json.dumps({'suspicious': [int(number) for number, name in items if is_suspicious(name)]})
+    return '\n'.join(suspicious_names(message))
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_stream(self, completion_id, model, content):
+        """Send the content as server-sent events with chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [content[i:i + STREAM_PIECE] for i in range(0, len(content), STREAM_PIECE)]
+        for piece in pieces:
+            event = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+            }
+            self.send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        with self.server.lock:
+            self.send_json(200, dict(self.server.stats))
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+            fail = self.server.rng.random() < self.server.fail_rate
+            if fail:
+                self.server.stats['failures'] += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if fail:
+            if self.server.rng.random() < 0.5:
+                self.send_json(429, {'error': {'message': 'Rate limit reached'}}, [('Retry-After', '0.1')])
+            else:
+                self.send_json(503, {'error': {'message': 'Service unavailable'}})
+            return
+        content = reply_content(request['messages'][-1]['content'])
+        completion_id = f"chatcmpl-{self.server.stats['requests']}"
+        if request.get('stream'):
+            self.send_stream(completion_id, request.get('model', ''), content)
+            return
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'model': request.get('model', ''),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        })
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a stub OpenAI-compatible chat completions endpoint for testing.')
+    parser.add_argument('--port', type=int, default=8765, help='Port (default: 8765)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of requests answered with 429 or 503 (default: 0)')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds every reply is delayed (default: 0)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the failures (default: 1)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    server.fail_rate = args.fail_rate
+    server.delay = args.delay
+    server.rng = random.Random(args.seed)
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'failures': 0, 'connections': 0}
+    print(f"Stub LLM server listening on http://127.0.0.1:{args.port}/v1/chat/completions", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
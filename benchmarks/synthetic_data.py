@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic inputs for benchmarking the annotation scripts.
+
+For every species, the gene models are drawn once and written in all the
+formats the pipeline sees: the BRAKER GTF (braker.gtf), its AGAT conversion
+to GFF3 (<species>.gff), the EnTAP results (<species>.tsv), the protein
+FASTA (braker.aa) and a list of transcripts to keep. Genes have one to
+several isoforms, and some transcripts are partial (no start or stop codon).
+Shared by all species are a PFAM mapping (pdb_pfam_mapping.txt) and the
+NCBI gene report for the RefSeq accessions used in the EnTAP results
+(datasets_report.jsonl), which mock_datasets.py serves in place of the
+NCBI datasets tool.
+
+The layout of the output directory matches what ncbi_gff_all.py expects:
+
+    gff/<species>.gff  tsv/<species>.tsv  braker/<species>/braker.gtf ...
+"""
+
+import os
+import json
+import random
+import argparse
+
+# (species, genes per species) of the predefined scales
+SCALES = {
+    'tiny': (1, 300),
+    'small': (1, 2000),
+    'diatom': (1, 15000),
+    'cohort': (49, 15000),
+}
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+PRODUCTS = [
+    'ABC transporter', 'Heat shock protein 70', 'Serine/threonine-protein kinase', 'WD repeat-containing protein',
+    'Ankyrin repeat-containing protein', 'Zinc finger protein', 'Fucoxanthin chlorophyll a/c-binding protein',
+    'Ribosomal protein L3', 'DNA repair protein', 'Glycosyl hydrolase family protein', 'Silicon transporter',
+    'Photosystem II reaction center protein', 'Mitochondrial carrier protein', 'Cyclin-dependent kinase',
+    'ATP-dependent RNA helicase', 'Superoxide dismutase [Mn]', 'Glutathione S-transferase', 'Nitrate reductase',
+]
+# Product names that fix_product_names_ncbi.py has to rewrite
+BAD_PRODUCTS = [
+    'uncharacterized protein', 'hypothetical protein', 'Conserved hypothetical protein', 'Predicted protein',
+    'ABC transporter proteins putative', 'Truncated kinase fragment', 'Protein kinase C_like 12345',
+    'MITOCHONDRIAL CARRIER PROTEIN', 'Homologous to NADH dehydrogenase', 'Zinc finger proteins family',
+    'chaperonins chloroplastic-like', 'ribosomal protein L3 partial', 'WD40 repeat-like protein-like putative',
+]
+EGGNOG_DESCRIPTIONS = ['Radical SAM superfamily', 'Protein kinase domain', 'Belongs to the heat shock protein 70 family',
+                       'WD domain, G-beta repeat', 'Ankyrin repeats (3 copies)', 'Iron-sulfur cluster binding']
+PFAM_NAMES = ['Radical_SAM', 'Fer4', 'Pkinase', 'WD40', 'ABC_tran', 'zf-C2H2', 'Ank', 'HSP70', 'Mito_carr',
+              'Glyco_hydro_16', 'Sod_Fe_C', 'GST_N', 'Cyclin_N', 'DEAD', 'Helicase_C', 'Ribosomal_L3']
+GO_TERMS = ['GO:0005524-ATP binding(L=3)', 'GO:0016020-membrane(L=2)', 'GO:0006468-protein phosphorylation(L=4)',
+            'GO:0005737-cytoplasm(L=2)', 'GO:0003676-nucleic acid binding(L=3)', 'GO:0009765-photosynthesis(L=3)']
+ENTAP_COLUMNS = [
+    'Query Sequence', 'Subject Sequence', 'Percent Identical', 'Alignment Length', 'Mismatches', 'Gap Openings',
+    'Query Start', 'Query End', 'Subject Start', 'Subject End', 'E Value', 'Coverage', 'Description', 'Species',
+    'Taxonomic Lineage', 'Origin Database', 'Contaminant', 'Informative', 'UniProt Database Cross Reference',
+    'UniProt Additional Information', 'UniProt KEGG Terms', 'UniProt GO Biological', 'UniProt GO Cellular',
+    'UniProt GO Molecular', 'EggNOG Seed Ortholog', 'EggNOG Seed E-Value', 'EggNOG Seed Score',
+    'EggNOG Tax Scope Max', 'EggNOG Member OGs', 'EggNOG Description', 'EggNOG COG Abbreviation',
+    'EggNOG COG Description', 'EggNOG KEGG KO', 'EggNOG KEGG Pathway', 'EggNOG GO Biological',
+    'EggNOG GO Cellular', 'EggNOG GO Molecular', 'EggNOG Protein Domains',
+]
+# Number of RefSeq accessions shared by all species; most of them are found in the gene report
+REFSEQ_ACCESSIONS = 20000
+
+class Transcript:
+    """One isoform: exons in genomic order, the CDS span and whether it has start and stop codon."""
+
+    def __init__(self, transcript_id, exons, cds_start, cds_end, partial):
+        self.id = transcript_id
+        self.exons = exons
+        self.cds_start = cds_start
+        self.cds_end = cds_end
+        self.partial = partial
+
+    def cds_segments(self):
+        return [(max(start, self.cds_start), min(end, self.cds_end)) for start, end in self.exons
+                if start <= self.cds_end and end >= self.cds_start]
+
+    def cds_length(self):
+        return sum(end - start + 1 for start, end in self.cds_segments())
+
+class Gene:
+    def __init__(self, gene_id, seqid, strand, transcripts):
+        self.id = gene_id
+        self.seqid = seqid
+        self.strand = strand
+        self.transcripts = transcripts
+        self.start = min(t.exons[0][0] for t in transcripts)
+        self.end = max(t.exons[-1][1] for t in transcripts)
+
+def make_gene(rng, gene_number, seqid, position):
+    """Draw a gene with one to four isoforms that share most of their exons."""
+    gene_id = f"g{gene_number}"
+    exon_count = rng.choice([1, 1, 2, 3, 4, 5, 6, 8, 12])
+    exons = []
+    start = position
+    for _ in range(exon_count):
+        length = rng.randint(60, 900)
+        exons.append((start, start + length - 1))
+        start += length + rng.randint(60, 400)
+
+    transcripts = []
+    for isoform in range(1, rng.choice([1, 1, 1, 1, 2, 2, 3, 4]) + 1):
+        isoform_exons = list(exons)
+        if isoform > 1 and len(isoform_exons) > 2:
+            # Alternative isoforms skip an inner exon
+            del isoform_exons[rng.randrange(1, len(isoform_exons) - 1)]
+        cds_start = isoform_exons[0][0] + (rng.randint(1, 50) if rng.random() < 0.6 else 0)
+        cds_end = isoform_exons[-1][1] - (rng.randint(1, 50) if rng.random() < 0.6 else 0)
+        partial = rng.random() < 0.1
+        transcripts.append(Transcript(f"{gene_id}.t{isoform}", isoform_exons, cds_start, cds_end, partial))
+    return Gene(gene_id, seqid, rng.choice('+-'), transcripts)
+
+def make_genes(rng, gene_count, sequences):
+    genes = []
+    per_sequence = max(1, gene_count // sequences)
+    for number in range(1, gene_count + 1):
+        if (number - 1) % per_sequence == 0:
+            position = rng.randint(500, 5000)
+        seqid = f"scaffold_{min(sequences, (number - 1) // per_sequence + 1)}"
+        gene = make_gene(rng, number, seqid, position)
+        genes.append(gene)
+        position = gene.end + rng.randint(200, 8000)
+    return genes
+
+def transcript_features(gene, transcript):
+    """The (type, start, end, phase) rows BRAKER writes for a transcript, in genomic order."""
+    rows = []
+    cds = transcript.cds_segments()
+    codons = []
+    if not transcript.partial:
+        first = ('start_codon' if gene.strand == '+' else 'stop_codon', transcript.cds_start, transcript.cds_start + 2)
+        last = ('stop_codon' if gene.strand == '+' else 'start_codon', transcript.cds_end - 2, transcript.cds_end)
+        codons = [first, last]
+    if codons:
+        rows.append((codons[0][0], codons[0][1], codons[0][2], '0'))
+    for index, (start, end) in enumerate(transcript.exons):
+        if index > 0 and not transcript.partial:
+            rows.append(('intron', transcript.exons[index - 1][1] + 1, start - 1, '.'))
+        for cds_start, cds_end in cds:
+            if cds_start >= start and cds_end <= end:
+                rows.append(('CDS', cds_start, cds_end, '0'))
+        rows.append(('exon', start, end, '.'))
+    if codons:
+        rows.append((codons[1][0], codons[1][1], codons[1][2], '0'))
+    return rows
+
+def write_gtf(path, genes):
+    """Write the gene models like braker.gtf."""
+    with open(path, 'w') as gtf:
+        for gene in genes:
+            gtf.write(f"{gene.seqid}\tAUGUSTUS\tgene\t{gene.start}\t{gene.end}\t.\t{gene.strand}\t.\t{gene.id}\n")
+            for transcript in gene.transcripts:
+                gtf.write(f"{gene.seqid}\tAUGUSTUS\ttranscript\t{transcript.exons[0][0]}\t{transcript.exons[-1][1]}\t.\t{gene.strand}\t.\t{transcript.id}\n")
+                for feature, start, end, phase in transcript_features(gene, transcript):
+                    gtf.write(f'{gene.seqid}\tAUGUSTUS\t{feature}\t{start}\t{end}\t.\t{gene.strand}\t{phase}\t'
+                              f'transcript_id "{transcript.id}"; gene_id "{gene.id}";\n')
+
+def write_agat_gff3(path, genes, rng):
+    """Write the gene models like the AGAT conversion of braker.gtf, including some AGAT UTR lines."""
+    with open(path, 'w') as gff:
+        gff.write("##gff-version 3\n")
+        for gene in genes:
+            gff.write(f"{gene.seqid}\tAUGUSTUS\tgene\t{gene.start}\t{gene.end}\t.\t{gene.strand}\t.\tID={gene.id}\n")
+            for transcript in gene.transcripts:
+                tid = transcript.id
+                gff.write(f"{gene.seqid}\tAUGUSTUS\tmRNA\t{transcript.exons[0][0]}\t{transcript.exons[-1][1]}\t.\t{gene.strand}\t.\tID={tid};Parent={gene.id}\n")
+                counters = {}
+                for feature, start, end, phase in transcript_features(gene, transcript):
+                    counters[feature] = counters.get(feature, 0) + 1
+                    feature_id = f"ID=agat-{feature.lower()}-{tid}-{counters[feature]};" if feature in ('exon', 'CDS') else ''
+                    gff.write(f"{gene.seqid}\tAUGUSTUS\t{feature}\t{start}\t{end}\t.\t{gene.strand}\t{phase}\t"
+                              f"{feature_id}Parent={tid};gene_id={gene.id};transcript_id={tid}\n")
+                if rng.random() < 0.03 and transcript.cds_start > transcript.exons[0][0]:
+                    gff.write(f"{gene.seqid}\tAGAT\tfive_prime_UTR\t{transcript.exons[0][0]}\t{transcript.cds_start - 1}\t.\t"
+                              f"{gene.strand}\t.\tID=agat-utr-{tid};Parent={tid}\n")
+
+def write_proteins(path, genes, rng):
+    """Write the translated CDS of every transcript like braker.aa, wrapped at 60 residues."""
+    with open(path, 'w') as fasta:
+        for gene in genes:
+            for transcript in gene.transcripts:
+                length = max(10, transcript.cds_length() // 3)
+                sequence = ''.join(rng.choice(AMINO_ACIDS) for _ in range(length))
+                fasta.write(f">{transcript.id}\n")
+                for i in range(0, length, 60):
+                    fasta.write(sequence[i:i + 60] + "\n")
+
+def refseq_accession(number):
+    return f"XP_{10000000 + number:09d}.1"
+
+def entap_row(rng, transcript_id):
+    """One row of entap_results.tsv (empty columns are written as NaN); about a fifth of the transcripts have no hit."""
+    row = dict.fromkeys(ENTAP_COLUMNS, '')
+    row['Query Sequence'] = transcript_id
+    hit = rng.random()
+    product = rng.choice(BAD_PRODUCTS if rng.random() < 0.3 else PRODUCTS)
+    if hit < 0.5:
+        subject = refseq_accession(rng.randrange(REFSEQ_ACCESSIONS))
+        description = f"{subject} {product} [Phaeodactylum tricornutum]"
+        database = 'RefSeq'
+    elif hit < 0.7:
+        subject = f"sp|Q{rng.randint(10000, 99999)}|{product.split()[0].upper()[:6]}_ARATH"
+        description = f"{subject} {product} OS=Arabidopsis thaliana OX=3702 GN=X PE=1 SV=1"
+        database = 'UniProt'
+    elif hit < 0.8:
+        subject = f"tr|A0A{rng.randint(100000, 999999)}|A0A_THAPS"
+        description = f"{subject} {product} OS=Thalassiosira pseudonana OX=35128"
+        database = 'UniProt'
+    else:
+        return row
+    row.update({
+        'Subject Sequence': subject, 'Description': description, 'Origin Database': database,
+        'Percent Identical': f"{rng.uniform(25, 99):.1f}", 'Alignment Length': str(rng.randint(50, 900)),
+        'E Value': f"{rng.uniform(1, 9):.1f}e-{rng.randint(6, 180)}", 'Coverage': f"{rng.uniform(50, 100):.1f}",
+        'Species': 'Phaeodactylum tricornutum', 'Taxonomic Lineage': 'Eukaryota;Stramenopiles;Bacillariophyta',
+        'Contaminant': 'Yes' if rng.random() < 0.02 else 'No', 'Informative': 'Yes',
+    })
+    if rng.random() < 0.7:
+        row['EggNOG Description'] = rng.choice(EGGNOG_DESCRIPTIONS)
+        row['EggNOG Protein Domains'] = ','.join(rng.sample(PFAM_NAMES, rng.randint(1, 3)))
+        row['EggNOG Seed Ortholog'] = f"2850.Phatr{rng.randint(1, 50000)}"
+    if rng.random() < 0.5:
+        row['UniProt GO Biological'] = ','.join(rng.sample(GO_TERMS, 2))
+        row['UniProt GO Molecular'] = rng.choice(GO_TERMS)
+    return row
+
+def write_entap(path, genes, rng):
+    with open(path, 'w') as tsv:
+        tsv.write('\t'.join(ENTAP_COLUMNS) + '\n')
+        for gene in genes:
+            for transcript in gene.transcripts:
+                row = entap_row(rng, transcript.id)
+                tsv.write('\t'.join(row[column] or 'NaN' for column in ENTAP_COLUMNS) + '\n')
+
+def write_keep_list(path, genes, rng):
+    """Transcript IDs to keep (as from grep ">" braker_filtered.aa); about 95 % of them."""
+    with open(path, 'w') as keep:
+        for gene in genes:
+            for transcript in gene.transcripts:
+                if rng.random() < 0.95:
+                    keep.write(transcript.id + '\n')
+
+def write_pfam_mapping(path):
+    with open(path, 'w') as pfam:
+        pfam.write("PDB_ID\tCHAIN_ID\tPDB_START\tPDB_END\tPFAM_ACC\tPFAM_NAME\tPFAM_DESC\teValue\n")
+        for index, name in enumerate(PFAM_NAMES):
+            for chain in 'ABCD':
+                pfam.write(f"{index + 1}XY{chain}\t{chain}\t1\t120\tPF{index + 100:05d}.{chain}\t{name}\t{name} domain\t1.2e-30\n")
+
+def write_datasets_report(path, rng):
+    """Gene report (as datasets --as-json-lines) for the shared RefSeq accessions; 5 % of them are not found."""
+    reports = {}
+    for number in range(REFSEQ_ACCESSIONS):
+        if rng.random() < 0.05:
+            continue
+        gene_id = str(100000 + number // 3)
+        report = reports.setdefault(gene_id, {'gene': {'gene_id': gene_id, 'description': f"{rng.choice(PRODUCTS)} {number // 3}"}, 'query': []})
+        report['query'].append(refseq_accession(number))
+    with open(path, 'w') as jsonl:
+        for report in reports.values():
+            jsonl.write(json.dumps(report) + '\n')
+
+def species_name(index):
+    return f"species_{index + 1:02d}"
+
+def generate(outdir, species_count, gene_count, seed=1, sequences=20):
+    """Write the synthetic data set to outdir; returns the species names."""
+    for subdir in ('gff', 'tsv', 'braker'):
+        os.makedirs(os.path.join(outdir, subdir), exist_ok=True)
+    write_pfam_mapping(os.path.join(outdir, 'pdb_pfam_mapping.txt'))
+    write_datasets_report(os.path.join(outdir, 'datasets_report.jsonl'), random.Random(seed))
+    names = []
+    for index in range(species_count):
+        name = species_name(index)
+        rng = random.Random(f"{seed}-{name}")
+        genes = make_genes(rng, gene_count, sequences)
+        braker_dir = os.path.join(outdir, 'braker', name)
+        os.makedirs(braker_dir, exist_ok=True)
+        write_gtf(os.path.join(braker_dir, 'braker.gtf'), genes)
+        write_proteins(os.path.join(braker_dir, 'braker.aa'), genes, rng)
+        write_keep_list(os.path.join(braker_dir, 'good_tx.lst'), genes, rng)
+        write_agat_gff3(os.path.join(outdir, 'gff', f"{name}.gff"), genes, rng)
+        write_entap(os.path.join(outdir, 'tsv', f"{name}.tsv"), genes, rng)
+        names.append(name)
+    with open(os.path.join(outdir, 'dataset.json'), 'w') as info:
+        json.dump({'species': species_count, 'genes': gene_count, 'seed': seed, 'sequences': sequences}, info)
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic BRAKER/AGAT/EnTAP inputs for benchmarking: ' +
+                                     ', '.join(f"{scale} = {species} species x {genes} genes" for scale, (species, genes) in SCALES.items()))
+    parser.add_argument('-o', '--outdir', required=True, help='Output directory')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Predefined data set size (default: small)')
+    parser.add_argument('-n', '--species', type=int, help='Number of species (overrides --scale)')
+    parser.add_argument('-g', '--genes', type=int, help='Number of genes per species (overrides --scale)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    species_count, gene_count = SCALES[args.scale]
+    species_count = args.species or species_count
+    gene_count = args.genes or gene_count
+    generate(args.outdir, species_count, gene_count, args.seed)
+    print(f"Wrote {species_count} species with {gene_count} genes each to {args.outdir}")
+
+if __name__ == "__main__":
+    main()
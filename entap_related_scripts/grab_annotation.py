@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Collect the statistics of the EnTAP runs of all species into one table.
+
+For every species directory in shared_with_uconn/, the most recent EnTAP log
+(braker/entap_outfiles/log*.txt) is read once, and every line is matched
+against all statistic labels at the same time. The species are processed
+concurrently. The table is the same as the one grab_annotation.sh wrote
+(including the underscores replaced by spaces); the same data is written as
+JSON, with the numbers as numbers.
+"""
+
+import os
+import re
+import glob
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Column, label in the EnTAP log and whether only the first word of the value is kept (e.g. "1234" of "1234 (45.6%)")
+STATISTICS = [
+    ('Total_Input_Sequences', 'Total Input Sequences:', False),
+    ('Unique_with_Alignment', 'Total unique sequences with an alignment:', True),
+    ('Flagged_Sim_Search_Contaminant', 'Total alignments flagged as a Similarity Search contaminant:', True),
+    ('Not_Flagged_Sim_Search_Contaminant', 'Total alignments NOT flagged as a Similarity Search contaminant:', True),
+    ('Unique_without_Alignment', 'Total unique sequences without an alignment:', True),
+    ('Unique_with_Family_Assignment', 'Total unique sequences with family assignment:', True),
+    ('Unique_without_Family_Assignment', 'Total unique sequences without family assignment:', True),
+    ('Unique_with_GO_Term', 'Total unique sequences with at least one GO term:', True),
+    ('Unique_with_Pathway_Assignment', 'Total unique sequences with at least one pathway (KEGG) assignment:', True),
+    ('Flagged_EggNOG_Contaminant', 'Total unique sequences flagged as an EggNOG contaminant:', True),
+    ('Not_Flagged_EggNOG_Contaminant', 'Total unique sequences NOT flagged as an EggNOG contaminant:', True),
+    ('Annotated_Similarity_Search_Only', 'Total unique sequences annotated (similarity search alignments only):', True),
+    ('Annotated_Gene_Family_Only', 'Total unique sequences annotated (gene family assignment only):', True),
+    ('Annotated_Gene_Family_and/or_Similarity_Search', 'Total unique sequences annotated (gene family and/or similarity search):', True),
+    ('Annotated_Contaminant_Gene_Family_and/or_Similarity_Search', 'Total annotated sequences flagged as a contaminant from either Similarity Search or EggNOG:', True),
+    ('Annotated_Without_Contaminant_Gene_Family_and/or_Similarity_Search', 'Total annotated sequences NOT flagged as a contaminant:', True),
+    ('Unique_Unannotated', 'Total unique sequences unannotated (gene family and/or similarity search):', True),
+    ('Total_Runtime_Minutes', 'Total runtime (minutes):', False),
+]
+COLUMNS = ['Species'] + [column for column, _, _ in STATISTICS]
+
+# All labels in one pattern; the matched label selects the column
+LABEL_PATTERN = re.compile('|'.join(re.escape(label) for _, label, _ in STATISTICS))
+STATISTIC_BY_LABEL = {label: (column, first_word) for column, label, first_word in STATISTICS}
+
+def statistic_value(line, first_word):
+    """The value as grep | awk -F': ' '{print $2}' [| awk '{print $1}'] gives it."""
+    fields = line.rstrip('\n').split(': ')
+    value = fields[1] if len(fields) > 1 else ''
+    if first_word:
+        words = value.split()
+        value = words[0] if words else ''
+    return value
+
+def read_log(log_file):
+    """Read an EnTAP log once; returns a dict column -> value (as text) of the first line with each label."""
+    stats = {}
+    with open(log_file, 'r', errors='replace') as log:
+        for line in log:
+            for label in LABEL_PATTERN.findall(line):
+                column, first_word = STATISTIC_BY_LABEL[label]
+                if column not in stats:
+                    stats[column] = statistic_value(line, first_word)
+            if len(stats) == len(STATISTICS):
+                break
+    return stats
+
+def latest_log(species_dir):
+    """The most recently modified braker/entap_outfiles/log*.txt of a species, or None."""
+    logs = glob.glob(os.path.join(species_dir, 'braker', 'entap_outfiles', 'log*.txt'))
+    logs = [log for log in logs if os.path.isfile(log)]
+    return max(logs, key=os.path.getmtime) if logs else None
+
+def collect_species(species_dir):
+    """Return (species, log file, stats); log file and stats are None if the species has no log."""
+    species = os.path.basename(species_dir)
+    log_file = latest_log(species_dir)
+    if log_file is None:
+        return species, None, None
+    return species, log_file, read_log(log_file)
+
+def number(value):
+    """The value as int or float if it is one, else as text (None if empty)."""
+    if value == '':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect the statistics of the most recent EnTAP log of every species (<species_root>/<species>/braker/entap_outfiles/log*.txt) into a TSV and a JSON file.')
+    parser.add_argument('species_root', nargs='?', default='shared_with_uconn', help='Directory with one directory per species (default: shared_with_uconn)')
+    parser.add_argument('-o', '--output', default='aggregated_stats.tsv', help='Output TSV file (default: aggregated_stats.tsv)')
+    parser.add_argument('--json', help='Output JSON file (default: output file with .json extension)')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Number of species read at the same time (default: 8)')
+    args = parser.parse_args()
+
+    json_file = args.json or os.path.splitext(args.output)[0] + '.json'
+    # Same order as ls -dr: species in reverse alphabetical order
+    species_dirs = sorted((path.rstrip('/') for path in glob.glob(os.path.join(args.species_root, '*/'))), reverse=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        results = list(executor.map(collect_species, species_dirs))
+
+    records = []
+    with open(args.output, 'w') as output:
+        output.write('\t'.join(COLUMNS).replace('_', ' ') + '\n')
+        for species_dir, (species, log_file, stats) in zip(species_dirs, results):
+            if log_file is None:
+                print(f"No .txt log file found in {species_dir}")
+                continue
+            row = [species] + [stats.get(column, '') for column in COLUMNS[1:]]
+            output.write('\t'.join(row).replace('_', ' ') + '\n')
+            records.append({'species': species, 'log_file': log_file,
+                            'statistics': {column: number(stats.get(column, '')) for column in COLUMNS[1:]}})
+
+    with open(json_file, 'w') as output:
+        json.dump(records, output, indent=2)
+        output.write('\n')
+    print(f"Statistics of {len(records)} species written to {args.output} and {json_file}")
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,7 @@ for gff_file in "$dir1"/*.gff; do
     echo "Found matching files: $gff_file and $tsv_file"
 
     # Run the Python script with the gff and tsv file as arguments
-    python ncbi_gff.py "$tsv_file" "$gff_file" pdb_pfam_mapping.txt "$basename"_ncbi.gff
+    python ncbi_gff.py -r refseq_cache.sqlite -p pdb_pfam_mapping.pickle "$tsv_file" "$gff_file" pdb_pfam_mapping.txt "$basename"_ncbi.gff
   else
     echo "No matching .tsv file found for $gff_file"
   fi
@@ -1,110 +1,56 @@
 import subprocess
+import argparse
+import tempfile
+import sqlite3
+import hashlib
+import pickle
+import shlex
+import time
 import csv
 import re
 import json
 import sys
-
-# Define inputs
-annotation_file = sys.argv[1]
-gff_file = sys.argv[2]
-pfam_file = sys.argv[3]
-
-# Define outputs
-output_file = sys.argv[4]
-accessions_file = 'accessions.txt'
-refseq_json = 'refseq.json'
-refseq_file = 'refseq.tsv'
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The GFF3 record engine lives next to the postprocessing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'postprocessing_scripts'))
+from gff3_records import GFF3Record, read_gff3, iter_gene_blocks, read_shard, map_shards
+from run_metrics import RunMetrics, add_metrics_arguments
+from compressed_io import xopen, strip_compressed_suffix
+
+HYPOTHETICAL_TERMS = ["uncharacterized", "unknown", "low quality protein","predicted protein", "pseudo", "clone"]
+TRAILING_DASH_PATTERN = re.compile(r'-$')
+DOT_SPACE_PATTERN = re.compile(r'\. ')
+UNBALANCED_PATTERN = re.compile(r'[^\w\s-]')
+LEADING_DASH_PATTERN = re.compile(r'^-+')
+REFSEQ_PREFIX_PATTERN = re.compile(r'^(AC_|NC_|NG_|NT_|NW_|NZ_|NM_|NR_|XM_|XR_|AP_|NP_|YP_|XP_|WP_)')
+REPEATED_COMMA_PATTERN = re.compile(r',,+')
 
 # Define cleaning function for product descriptions
 def clean_product_description(description):
     # Convert specific descriptions to 'hypothetical protein'
-    if any(term in description.lower() for term in ["uncharacterized", "unknown", "low quality protein","predicted protein", "pseudo", "clone"]):
+    if any(term in description.lower() for term in HYPOTHETICAL_TERMS):
         return "hypothetical protein"
-    
+
     # Remove trailing dashes
-    description = re.sub(r'-$', '', description)
-    
+    description = TRAILING_DASH_PATTERN.sub('', description)
+
     # Remove occurrences of '. '
-    description = re.sub(r'\. ', ' ', description)
-    
-    # Remove unbalanced brackets  
-    description = re.sub(r'[^\w\s-]', '', description)
-    description = re.sub(r'^-+', '', description).strip()
-    
+    description = DOT_SPACE_PATTERN.sub(' ', description)
+
+    # Remove unbalanced brackets
+    description = UNBALANCED_PATTERN.sub('', description)
+    description = LEADING_DASH_PATTERN.sub('', description).strip()
+
     # Convert descriptions that are all numbers to 'hypothetical protein'
     if description.isdigit():
         return "hypothetical protein"
-    
+
     return description
 
-# Step 1: Extract unique accession IDs and save to accessions.txt
-accessions = set()
-try:
-    with open(annotation_file, 'r') as file:
-        reader = csv.DictReader(file, delimiter='\t')
-        for row in reader:
-            accession = row.get('Subject Sequence', '').strip()
-            if accession and accession != 'Subject Sequence':
-                accessions.add(accession)
-except FileNotFoundError:
-    print(f"Error: The file {annotation_file} was not found.")
-    exit(1)
-
-with open(accessions_file, 'w') as file:
-    for accession in sorted(accessions):
-        file.write(f"{accession}\n")
-
-# Step 2: Process accessions in chunks
-command = f"datasets summary gene accession --report gene --inputfile {accessions_file} > {refseq_json}"
-subprocess.run(command, shell=True)
-
-with open(refseq_json, 'r') as file:
-    data = json.load(file)
-
-# Step 3: Write gene_id, query, and description to refseq.tsv
-with open(refseq_file, 'w') as outfile:
-    gene_id_to_info = {}
-    for report in data.get("reports", []):
-        gene_id = report["gene"]["gene_id"]
-        description = report["gene"]["description"]
-        queries = report.get("query", [])
-        if gene_id not in gene_id_to_info:
-            gene_id_to_info[gene_id] = {'description': description, 'queries': set()}
-        for query in queries:
-            gene_id_to_info[gene_id]['queries'].add(query)
-    
-    for gene_id, info in gene_id_to_info.items():
-        description = info['description']
-        for query in info['queries']:
-            outfile.write(f"{query}\t{gene_id}\t{description}\n")
-
-# Step 4: Load refseq.tsv into a dictionary for lookup
-refseq_dict = {}
-try:
-    with open(refseq_file, 'r') as refseq:
-        for line in refseq:
-            cols = line.strip().split('\t')
-            if len(cols) == 3:
-                refseq_dict[cols[0]] = {'gene_id': cols[1], 'description': cols[2]}
-except FileNotFoundError:
-    print(f"Error: The file {refseq_file} was not found.")
-    exit(1)
-
-# Step 5: Load PFAM mappings into a dictionary
-pfam_dict = {}
-try:
-    with open(pfam_file, 'r') as pfam:
-        for line in pfam:
-            cols = line.strip().split('\t')
-            if len(cols) >= 6:
-                pfam_dict[cols[5]] = cols[4]
-except FileNotFoundError:
-    print(f"Error: The file {pfam_file} was not found.")
-    exit(1)
-
-# Step 6: Process the GFF file
 def get_dbxref_prefix(subject_sequence):
-    if re.match(r'^(AC_|NC_|NG_|NT_|NW_|NZ_|NM_|NR_|XM_|XR_|AP_|NP_|YP_|XP_|WP_)', subject_sequence):
+    if REFSEQ_PREFIX_PATTERN.match(subject_sequence):
         return 'GeneID'
     elif subject_sequence.startswith('sp|') and '|' in subject_sequence:
         return 'UniProtKB/Swiss-Prot'
@@ -119,222 +65,700 @@ def extract_uniprot_id(subject_sequence):
             return parts[1]
     return subject_sequence
 
-annotations, subject_sequences, go_terms, contaminants, eggnog, pfam = {}, {}, {}, {}, {}, {}
-
-try:
-    with open(annotation_file, 'r') as file:
-        reader = csv.DictReader(file, delimiter='\t')
-        entry_count = 0
-        for row in reader:
-            gene_id = row['Query Sequence'].strip()
-            subject_sequence = row['Subject Sequence'].strip()
-            eggnog_domain = row['EggNOG Protein Domains'].strip()
-
-            if eggnog_domain.startswith('PFAM'):
-                pfam_ids = eggnog_domain.split('(')[1].split(')')[0].split(', ')
-                pfam[gene_id] = pfam_ids
-            else:
-                pfam_ids = eggnog_domain.split(', ')
-                pfam[gene_id] = pfam_ids 
-            
-            contam = row.get('Contaminant', '').strip()
-            eggnog_description = row.get('EggNOG Description', '').strip()
-            eggnog[gene_id] = eggnog_description
-            annotation = ' '.join(row['Description'].split()[1:]).strip()
-            # Find the position of 'OS=' in the string (UniProt)
-            os_index = annotation.find('OS=')
-            # If 'OS=' is found, truncate the string to that point
-            if os_index != -1:
-                annotation = annotation[:os_index].strip()
-
-            annotations[gene_id] = annotation
-            subject_sequences[gene_id] = subject_sequence
-            contaminants[gene_id] = contam
-
-            go_term_values = [row.get('UniProt GO Biological', '').strip(),
-                              row.get('UniProt GO Cellular', '').strip(),
-                              row.get('UniProt GO Molecular', '').strip()]
-            go_term_values = [value for value in go_term_values if value != 'NaN']
-            go_terms[gene_id] = ','.join(go_term_values).rstrip(',')
-
-            entry_count += 1
-
-except FileNotFoundError:
-    print(f"Error: The file {annotation_file} was not found.")
-    exit(1)
-except KeyError as e:
-    print(f"Error: Missing expected header in {annotation_file}: {e}")
-    exit(1)
-except Exception as e:
-    print(f"An error occurred while reading {annotation_file}: {e}")
-    exit(1)
-
-# Step 7: Count the number of transcripts and store start and end positions
-transcript_count = 0
-transcript_to_gene_map = {}
-gene_to_transcript_map = {}
-transcript_positions = {}  # Dictionary to store transcript positions
-
-try:
-    with open(gff_file, 'r') as infile:
-        for line in infile:
-            if line.startswith('#'):
-                continue
-            fields = line.strip().split('\t')
-            if len(fields) > 2 and fields[2] in ('transcript', 'mRNA'):
-                transcript_count += 1
-                feature_type = fields[2]
-                attributes = fields[8]
-
-                id_match = re.search(r'ID=([^;]+)', attributes)
-                parent_match = re.search(r'Parent=([^;]+)', attributes)
-
-                if id_match and parent_match:
-                    transcript_id = id_match.group(1)
-                    gene_id = parent_match.group(1)
-                    transcript_to_gene_map[transcript_id] = gene_id
-                    if gene_id not in gene_to_transcript_map:
-                        gene_to_transcript_map[gene_id] = []
-                    gene_to_transcript_map[gene_id].append(transcript_id)
-
-                    # Store the start and end positions of the transcript
-                    start_pos = int(fields[3])
-                    end_pos = int(fields[4])
-                    transcript_positions[transcript_id] = (start_pos, end_pos)
-                
-except FileNotFoundError:
-    print(f"Error: The file {gff_file} was not found.")
-    exit(1)
-except Exception as e:
-    print(f"An error occurred while reading {gff_file}: {e}")
-    exit(1)
-
-# Step 8: Process the GFF file and add new attributes
-try:
-    with open(gff_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            if line.startswith('#'):
-                outfile.write(line)
-                continue
-
-            fields = line.strip().split('\t')
-            feature_type = fields[2]
-            attributes = fields[8]
-
-            # Extract ID and Parent from attributes
-            id_match = re.search(r'ID=([^;]+)', attributes)
-            parent_match = re.search(r'Parent=([^;]+)', attributes)
-
-            if feature_type in ['mRNA', 'transcript']:
-                if id_match:
-                    gene_id = id_match.group(1)
-                    fields[2] = 'mRNA' # Change transcript to mRNA because NCBI seems to like that better
-                    new_attributes = re.sub(r'ID=[^;]+', f'ID={gene_id}', attributes)
-                    fields[8] = new_attributes
-                else:
-                    outfile.write(line)
+ENTAP_REQUIRED_COLUMNS = ['Query Sequence', 'Subject Sequence', 'EggNOG Protein Domains', 'Description']
+ENTAP_OPTIONAL_COLUMNS = ['Contaminant', 'EggNOG Description', 'UniProt GO Biological', 'UniProt GO Cellular', 'UniProt GO Molecular']
+
+class EntapRecord:
+    """The annotation of one query sequence of the EnTAP results table."""
+
+    __slots__ = ('subject_sequence', 'annotation', 'go_terms', 'contaminant', 'eggnog', 'pfam')
+
+    def __init__(self, subject_sequence, annotation, go_terms, contaminant, eggnog, pfam):
+        self.subject_sequence = subject_sequence
+        self.annotation = annotation
+        self.go_terms = go_terms
+        self.contaminant = contaminant
+        self.eggnog = eggnog
+        self.pfam = pfam
+
+class EntapColumn:
+    """Read-only dict-like view of one EntapRecord attribute by query sequence."""
+
+    __slots__ = ('records', 'attribute')
+
+    def __init__(self, records, attribute):
+        self.records = records
+        self.attribute = attribute
+
+    def __contains__(self, gene_id):
+        return gene_id in self.records
+
+    def __getitem__(self, gene_id):
+        return getattr(self.records[gene_id], self.attribute)
+
+    def get(self, gene_id, default=None):
+        record = self.records.get(gene_id)
+        return default if record is None else getattr(record, self.attribute)
+
+    def __len__(self):
+        return len(self.records)
+
+class EntapResults:
+    """
+    Lookup tables built from one read of the EnTAP results table (Steps 1 and 6).
+
+    records maps every query sequence to one EntapRecord. annotations,
+    subject_sequences, go_terms, contaminants, eggnog and pfam give dict-like
+    access to the single columns.
+    """
+
+    def __init__(self):
+        self.accessions = set()
+        self.records = {}
+        self.entry_count = 0
+        self.annotations = EntapColumn(self.records, 'annotation')
+        self.subject_sequences = EntapColumn(self.records, 'subject_sequence')
+        self.go_terms = EntapColumn(self.records, 'go_terms')
+        self.contaminants = EntapColumn(self.records, 'contaminant')
+        self.eggnog = EntapColumn(self.records, 'eggnog')
+        self.pfam = EntapColumn(self.records, 'pfam')
+
+def entap_column_indices(header):
+    """Return the positions of the needed columns; optional columns that are missing get None."""
+    positions = {name: i for i, name in enumerate(header)}
+    return [positions[name] for name in ENTAP_REQUIRED_COLUMNS] + [positions.get(name) for name in ENTAP_OPTIONAL_COLUMNS]
+
+def load_entap_results(annotation_file):
+    entap = EntapResults()
+    intern = sys.intern
+    try:
+        with xopen(annotation_file, 'r') as file:
+            reader = csv.reader(file, delimiter='\t')
+            header = next(reader, None)
+            indices = None
+            for row in reader:
+                if not row:
                     continue
-
-            elif feature_type in ['exon', 'CDS']:
-                if parent_match:
-                    parent_id = parent_match.group(1)
-                    new_attributes = re.sub(r'Parent=[^;]+', f'Parent={parent_id}', attributes)
-                    fields[8] = new_attributes
+                if indices is None:
+                    # Only the columns used below are looked up, by their position in the header
+                    indices = entap_column_indices(header)
+                (query, subject, domains, description,
+                 contaminant, eggnog, go_biological, go_cellular, go_molecular) = [
+                    row[i].strip() if i is not None else '' for i in indices]
+
+                # Step 1: Extract unique accession IDs
+                if subject and subject != 'Subject Sequence':
+                    entap.accessions.add(subject)
+
+                # Step 6: Collect the annotations per query sequence
+                if domains.startswith('PFAM'):
+                    pfam_ids = domains.split('(')[1].split(')')[0].split(', ')
                 else:
-                    outfile.write(line)
+                    pfam_ids = domains.split(', ')
+
+                annotation = ' '.join(description.split()[1:]).strip()
+                # Find the position of 'OS=' in the string (UniProt)
+                os_index = annotation.find('OS=')
+                # If 'OS=' is found, truncate the string to that point
+                if os_index != -1:
+                    annotation = annotation[:os_index].strip()
+
+                go_term_values = [value for value in (go_biological, go_cellular, go_molecular) if value != 'NaN']
+                go_terms = ','.join(go_term_values).rstrip(',')
+
+                # Subjects, descriptions and domains repeat a lot between queries, so only one copy of each is kept
+                entap.records[query] = EntapRecord(intern(subject), intern(annotation), intern(go_terms),
+                                                   intern(contaminant), intern(eggnog),
+                                                   tuple(intern(pfam_id) for pfam_id in pfam_ids))
+                entap.entry_count += 1
+
+    except FileNotFoundError:
+        print(f"Error: The file {annotation_file} was not found.")
+        exit(1)
+    except KeyError as e:
+        print(f"Error: Missing expected header in {annotation_file}: {e}")
+        exit(1)
+    except Exception as e:
+        print(f"An error occurred while reading {annotation_file}: {e}")
+        exit(1)
+    return entap
+
+class DatasetsResolver:
+    """
+    Look up RefSeq accessions with `datasets summary gene accession` (Steps 2 and 3).
+
+    The accessions are sent in chunks of chunk_size, with up to jobs datasets
+    processes running at the same time. A chunk that fails is retried up to
+    retries times; accessions of chunks that still fail are kept in
+    self.failed, so they are not remembered as not found.
+    """
+
+    def __init__(self, executable='datasets', chunk_size=1000, jobs=4, retries=3, aux_prefix=''):
+        self.command = shlex.split(executable) + ['summary', 'gene', 'accession', '--report', 'gene', '--as-json-lines', '--inputfile']
+        self.chunk_size = chunk_size
+        self.jobs = jobs
+        self.retries = retries
+        self.accessions_file = aux_prefix + 'accessions.txt'
+        self.refseq_file = aux_prefix + 'refseq.tsv'
+        self.failed = set()
+
+    def resolve_chunk(self, chunk, chunk_file):
+        """Run datasets on one chunk and return a dict accession -> (gene_id, description)."""
+        with open(chunk_file, 'w') as file:
+            for accession in chunk:
+                file.write(f"{accession}\n")
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self.read_report(chunk_file)
+            except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Warning: datasets failed on {chunk_file} ({e}), retrying")
+                time.sleep(2 ** attempt)
+
+    def read_report(self, chunk_file):
+        """Parse the gene report of datasets one JSON line (one gene) at a time while it is written."""
+        found = {}
+        with subprocess.Popen(self.command + [chunk_file], stdout=subprocess.PIPE, universal_newlines=True) as process:
+            try:
+                for line in process.stdout:
+                    if not line.strip():
+                        continue
+                    report = json.loads(line)
+                    gene = report["gene"]
+                    for query in report.get("query", []):
+                        found[query] = (gene["gene_id"], gene["description"])
+            except (ValueError, KeyError):
+                process.kill()
+                raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        return found
+
+    def resolve(self, accessions):
+        """Return a dict accession -> {'gene_id': ..., 'description': ...} of the accessions found."""
+        accessions = sorted(accessions)
+        self.failed = set()
+
+        # Save the accessions to <prefix>accessions.txt
+        with open(self.accessions_file, 'w') as file:
+            for accession in accessions:
+                file.write(f"{accession}\n")
+
+        # Step 2: Process accessions in chunks
+        chunks = [accessions[i:i + self.chunk_size] for i in range(0, len(accessions), self.chunk_size)]
+        refseq_dict = {}
+        with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(max_workers=self.jobs) as pool, open(self.refseq_file, 'w') as outfile:
+            futures = {pool.submit(self.resolve_chunk, chunk, os.path.join(tmpdir, f"chunk_{i}.txt")): chunk
+                       for i, chunk in enumerate(chunks)}
+            # Step 3: Merge gene_id, query, and description of every chunk as soon as it is done
+            for future in as_completed(futures):
+                try:
+                    found = future.result()
+                except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+                    print(f"Warning: giving up on {len(futures[future])} accessions after {self.retries} retries: {e}")
+                    self.failed.update(futures[future])
                     continue
+                for query, (gene_id, description) in found.items():
+                    refseq_dict[query] = {'gene_id': gene_id, 'description': description}
+                    outfile.write(f"{query}\t{gene_id}\t{description}\n")
+        return refseq_dict
+
+class TableResolver:
+    """Look up RefSeq accessions in a local table in refseq.tsv format (accession, GeneID, description)."""
+
+    def __init__(self, path):
+        self.table = load_refseq_table(path)
+        self.failed = set()
+
+    def resolve(self, accessions):
+        return {accession: self.table[accession] for accession in accessions if accession in self.table}
+
+def load_refseq_table(path):
+    refseq_dict = {}
+    try:
+        with xopen(path, 'r') as refseq:
+            for line in refseq:
+                cols = line.strip().split('\t')
+                if len(cols) == 3:
+                    refseq_dict[cols[0]] = {'gene_id': cols[1], 'description': cols[2]}
+    except FileNotFoundError:
+        print(f"Error: The file {path} was not found.")
+        exit(1)
+    return refseq_dict
+
+class RefSeqCache:
+    """
+    Remembers which GeneID and description every accession resolved to.
+
+    Many RefSeq accessions are hit by several species. If a path is given,
+    the results (including accessions that were not found) are kept in an
+    SQLite file that can be shared by all species, so only accessions that
+    were never seen before are passed to the resolver. With refresh_not_found,
+    accessions that were not found before are passed to the resolver again.
+    """
+
+    def __init__(self, path=None, refresh_not_found=False):
+        self.refresh_not_found = refresh_not_found
+        self.cached = 0
+        self.resolved = 0
+        self.not_found = 0
+        self.failed = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.execute("CREATE TABLE IF NOT EXISTS refseq (accession TEXT PRIMARY KEY, gene_id TEXT, description TEXT)")
+            self.db.commit()
+
+    def lookup(self, accessions, resolver):
+        """Return a dict accession -> {'gene_id': ..., 'description': ...} of the accessions found."""
+        refseq_dict = {}
+        missing = set(accessions)
+        if self.db is not None:
+            for accession in sorted(accessions):
+                row = self.db.execute("SELECT gene_id, description FROM refseq WHERE accession = ?", (accession,)).fetchone()
+                if row is not None and not (row[0] is None and self.refresh_not_found):
+                    missing.discard(accession)
+                    self.cached += 1
+                    if row[0] is not None:
+                        refseq_dict[accession] = {'gene_id': row[0], 'description': row[1]}
+
+        if missing:
+            found = resolver.resolve(missing)
+            refseq_dict.update(found)
+            self.resolved += len(found)
+            self.failed += len(resolver.failed)
+            self.not_found += len(missing) - len(found) - len(resolver.failed)
+            if self.db is not None:
+                # Accessions that could not be looked up at all are asked for again next time
+                rows = [(accession, found[accession]['gene_id'], found[accession]['description']) if accession in found
+                        else (accession, None, None) for accession in sorted(missing) if accession not in resolver.failed]
+                self.db.executemany("INSERT OR REPLACE INTO refseq VALUES (?, ?, ?)", rows)
+                self.db.commit()
+        return refseq_dict
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def report(self):
+        return f"RefSeq cache: {self.cached} cached, {self.resolved} resolved, {self.not_found} not found, {self.failed} failed"
+
+def load_pfam_mapping(pfam_file):
+    # Step 5: Load PFAM mappings into a dictionary
+    pfam_dict = {}
+    try:
+        with xopen(pfam_file, 'r') as pfam:
+            for line in pfam:
+                cols = line.strip().split('\t')
+                if len(cols) >= 6:
+                    pfam_dict[cols[5]] = cols[4]
+    except FileNotFoundError:
+        print(f"Error: The file {pfam_file} was not found.")
+        exit(1)
+    return pfam_dict
+
+def file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_pfam_index(pfam_file, index_file):
+    """
+    Step 5 with a precompiled index: load the PFAM name -> accession mapping from index_file.
+
+    The index is a pickle of the mapping together with the checksum of the
+    PFAM mapping file it was built from. If it is missing or belongs to
+    another version of the mapping file, it is rebuilt from pfam_file.
+    """
+    try:
+        checksum = file_checksum(pfam_file)
+    except FileNotFoundError:
+        print(f"Error: The file {pfam_file} was not found.")
+        exit(1)
+
+    try:
+        with open(index_file, 'rb') as index:
+            loaded = pickle.load(index)
+        # Anything other than a (checksum, mapping) pair is not an index written by this script
+        if isinstance(loaded, tuple) and len(loaded) == 2 and loaded[0] == checksum and isinstance(loaded[1], dict):
+            return loaded[1]
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+
+    pfam_dict = load_pfam_mapping(pfam_file)
+    # Write to a temporary file first, so runs in parallel never read a partial index
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as index:
+        pickle.dump((checksum, pfam_dict), index, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, index_file)
+    print(f"PFAM index written to {index_file}")
+    return pfam_dict
+
+def find_longest_transcripts(records):
+    """
+    Step 7: Count the transcripts and find the longest transcript of every gene.
+
+    Returns a dict gene ID -> longest transcript ID (the first one in case of
+    ties) and the number of transcript/mRNA lines.
+    """
+    longest_transcripts, longest_lengths, transcript_count = find_longest_transcript_lengths(records)
+    return longest_transcripts, transcript_count
+
+def find_longest_transcript_lengths(records):
+    """Like find_longest_transcripts(), but also returns the dict gene ID -> length of the longest transcript."""
+    transcript_count = 0
+    longest_transcripts = {}
+    longest_lengths = {}
+    for record in records:
+        if record.is_comment:
+            continue
+        if len(record.fields) > 2 and record.type in ('transcript', 'mRNA'):
+            transcript_count += 1
+
+            transcript_id = record.get('ID')
+            gene_id = record.get('Parent')
+
+            if transcript_id and gene_id:
+                length = record.end - record.start
+                if gene_id not in longest_lengths or length > longest_lengths[gene_id]:
+                    longest_transcripts[gene_id] = transcript_id
+                    longest_lengths[gene_id] = length
+    return longest_transcripts, longest_lengths, transcript_count
+
+class GffDecorator:
+    """
+    Step 8: Add Dbxref, product, note and gene_biotype attributes to GFF lines.
+
+    Exons, CDS and all other features below a transcript are decorated with
+    the annotation of the most recent transcript line, genes with the
+    annotation of their longest transcript.
+    """
+
+    def __init__(self, entap, refseq_dict, pfam_dict):
+        self.entap = entap
+        self.refseq_dict = refseq_dict
+        self.pfam_dict = pfam_dict
+        self.gene_id = None
+        self.suffix_gene_id = None
+        self.suffixes = {}
+
+    def decorate(self, record, longest_transcripts):
+        """Return the decorated line of a GFF3 record."""
+        if record.is_comment:
+            return record.raw
+
+        feature_type = record.type
+        attributes = record.attributes_text
+
+        # Extract ID and Parent from attributes
+        record_id = record.get('ID')
+        parent_id = record.get('Parent')
+
+        if feature_type in ['mRNA', 'transcript']:
+            if record_id:
+                self.gene_id = record_id
+                record.type = 'mRNA' # Change transcript to mRNA because NCBI seems to like that better
+            else:
+                return record.raw
 
-            elif feature_type == 'gene':
-                if id_match:
-                    gene_id = id_match.group(1)
-                    
-                    # Retrieve associated transcript_ids
-                    transcripts = gene_to_transcript_map.get(gene_id, [])
-                    
-                    # Find the longest transcript
-                    if transcripts:
-                        longest_transcript = max(transcripts, key=lambda x: transcript_positions[x][1] - transcript_positions[x][0])
-                        gene_id = longest_transcript
-                else:
-                    outfile.write(line)
-                    continue
+        elif feature_type in ['exon', 'CDS']:
+            if not parent_id:
+                return record.raw
 
-            dbxrefs = []
-            if gene_id in subject_sequences:
-                subject_sequence = subject_sequences[gene_id]
-                dbxref_prefix = get_dbxref_prefix(subject_sequence)
+        elif feature_type == 'gene':
+            if record_id:
+                self.gene_id = record_id
 
+                # Use the longest associated transcript
+                if record_id in longest_transcripts:
+                    self.gene_id = longest_transcripts[record_id]
+            else:
+                return record.raw
+
+        if feature_type == 'gene':
+            kind = 'gene'
+        elif feature_type in ['mRNA', 'transcript', 'CDS']:
+            kind = 'product'
+        else:
+            kind = 'other'
+
+        # The suffix only depends on the transcript, so it is computed once for all of its lines
+        if self.gene_id != self.suffix_gene_id:
+            self.suffix_gene_id = self.gene_id
+            self.suffixes = {}
+        suffix = self.suffixes.get(kind)
+        if suffix is None:
+            suffix = self.attribute_suffix(self.gene_id, kind)
+            self.suffixes[kind] = suffix
+
+        record.attributes_text = attributes + suffix
+        return record.line()
+
+    def attribute_suffix(self, gene_id, kind):
+        """
+        Return the attributes appended to a line of transcript gene_id.
+
+        kind is 'gene' for gene lines, 'product' for mRNA, transcript and CDS
+        lines (which get product and note) and 'other' for all other lines.
+        """
+        refseq_dict = self.refseq_dict
+        record = self.entap.records.get(gene_id)
+        attributes = ''
+        dbxrefs = []
+        if record is not None:
+            subject_sequence = record.subject_sequence
+            dbxref_prefix = get_dbxref_prefix(subject_sequence)
+
+            if dbxref_prefix == 'GeneID':
+                gene_id_value = refseq_dict.get(subject_sequence, {}).get('gene_id')
+                if gene_id_value:
+                    dbxrefs.append(f"{dbxref_prefix}:{gene_id_value}")
+            elif dbxref_prefix in ['UniProtKB/Swiss-Prot', 'UniProtKB/TrEMBL']:
+                uniprot_id = extract_uniprot_id(subject_sequence)
+                if uniprot_id:
+                    dbxrefs.append(f"{dbxref_prefix}:{uniprot_id}")
+
+            if kind != 'gene':
+                pfam_entries = [f"PFAM:{self.pfam_dict.get(pfam_id, '')}" for pfam_id in record.pfam if self.pfam_dict.get(pfam_id)]
+                if pfam_entries:
+                    dbxrefs.append(','.join(pfam_entries))
+
+                go_value = record.go_terms
+                if go_value:
+                    go_value = REPEATED_COMMA_PATTERN.sub(',', go_value)
+                    dbxrefs.append(go_value)
+
+        if dbxrefs:
+            attributes += f";Dbxref={','.join(dbxrefs)}"
+
+        # Determine product description based on dbxref_prefix
+        if kind == 'product':
+            annotation_description = 'hypothetical protein'
+            if record is not None:
                 if dbxref_prefix == 'GeneID':
-                    gene_id_value = refseq_dict.get(subject_sequence, {}).get('gene_id')
-                    if gene_id_value:
-                        dbxrefs.append(f"{dbxref_prefix}:{gene_id_value}")
-                elif dbxref_prefix in ['UniProtKB/Swiss-Prot', 'UniProtKB/TrEMBL']:
-                    uniprot_id = extract_uniprot_id(subject_sequence)
-                    if uniprot_id:
-                        dbxrefs.append(f"{dbxref_prefix}:{uniprot_id}")
-            
-            if fields[2] != 'gene':
-                if gene_id in pfam:
-                    pfam_ids = pfam.get(gene_id, [])
-                    pfam_entries = [f"PFAM:{pfam_dict.get(pfam_id, '')}" for pfam_id in pfam_ids if pfam_dict.get(pfam_id)]
-                    if pfam_entries:
-                        dbxrefs.append(','.join(pfam_entries))
-
-                if gene_id in go_terms:
-                    go_value = go_terms[gene_id]
-                    if go_value:
-                        go_value = re.sub(r',,+', ',', go_value)
-                        dbxrefs.append(go_value)
-
-            if dbxrefs:
-                attributes += f";Dbxref={','.join(dbxrefs)}"
-
-            # Determine product description based on dbxref_prefix
-            if feature_type in ['mRNA', 'transcript','CDS']:
-                annotation_description = 'hypothetical protein'
-                if gene_id in subject_sequences:
-                    subject_sequence = subject_sequences[gene_id]
-                    dbxref_prefix = get_dbxref_prefix(subject_sequence)
-
-                    if dbxref_prefix == 'GeneID':
-                        annotation_description = refseq_dict.get(subject_sequence, {}).get('description', 'hypothetical protein')
-                    else:
-                        annotation_description = annotations.get(gene_id, 'hypothetical protein')
-
-                description = clean_product_description(annotation_description)
-                if description:
-                    attributes += f";product={description}"
+                    annotation_description = refseq_dict.get(subject_sequence, {}).get('description', 'hypothetical protein')
                 else:
-                    attributes += f";product=hypothetical protein"
-
-                if gene_id in eggnog:
-                    eggnog_description = eggnog[gene_id]
-                    if eggnog_description != 'NaN':
-                        attributes += f";note=EggNOG:{eggnog_description}"
-
-            if feature_type == 'gene':
-                attributes += ";gene_biotype=protein_coding"
-
-            # if gene_id in contaminants and contaminants[gene_id] == 'Yes':
-            #     attributes += ";note=Contaminant"
-
-            fields[8] = attributes
-            outfile.write('\t'.join(fields) + '\n')
-
-except FileNotFoundError:
-    print(f"Error: The file {gff_file} or {output_file} was not found.")
-    exit(1)
-except Exception as e:
-    print(f"An error occurred while processing files: {e}")
-    exit(1)
-
-# Step 9: Output counts and check for consistency
-print(f"Number of entries in {annotation_file}: {entry_count}")
-print(f"Number of transcripts and mRNA in {gff_file}: {transcript_count}")
-
-if entry_count == transcript_count:
-    print("The number of entries in the annotation file matches the number of transcripts in the GFF file.")
-else:
-    print("Warning: The number of entries in the annotation file does not match the number of transcripts in the GFF file.")
-print(f"Updated GFF file written to {output_file}")
+                    annotation_description = record.annotation
 
+            description = clean_product_description(annotation_description)
+            if description:
+                attributes += f";product={description}"
+            else:
+                attributes += f";product=hypothetical protein"
+
+            if record is not None and record.eggnog != 'NaN':
+                attributes += f";note=EggNOG:{record.eggnog}"
+
+        if kind == 'gene':
+            attributes += ";gene_biotype=protein_coding"
+
+        # if record is not None and record.contaminant == 'Yes':
+        #     attributes += ";note=Contaminant"
+
+        return attributes
+
+# Decorator and longest transcripts of the running file, set before the worker processes are forked
+shared_decorator = None
+shared_longest_transcripts = {}
+
+def starts_with_gene_id(previous_block, gene_line):
+    """
+    True if the GFF file can be split at this gene line (see shard_ranges()).
+
+    A gene line with an ID resets the transcript that GffDecorator carries
+    over from line to line, so the lines after it are decorated the same
+    way no matter what came before.
+    """
+    record = GFF3Record(gene_line.decode())
+    return record.is_feature and bool(record.get('ID'))
+
+def longest_transcripts_shard(path, start, end):
+    return find_longest_transcript_lengths(read_shard(path, start, end))
+
+def decorate_shard(path, start, end, single_pass):
+    """Step 8 (and Step 7 with single_pass) on one shard in a worker process; returns the output text and transcript count."""
+    output = []
+    transcript_count = 0
+    records = read_shard(path, start, end)
+    if single_pass:
+        for block in iter_gene_blocks(records):
+            longest_transcripts, block_transcripts = find_longest_transcripts(block.records)
+            transcript_count += block_transcripts
+            for record in block.records:
+                output.append(shared_decorator.decorate(record, longest_transcripts))
+    else:
+        for record in records:
+            output.append(shared_decorator.decorate(record, shared_longest_transcripts))
+    return ''.join(output), transcript_count
+
+def decorate_gff_sharded(gff_file, output_file, decorator, jobs, single_pass):
+    """Steps 7 and 8 with jobs worker processes, each decorating a part of the GFF file; returns the transcript count."""
+    global shared_decorator
+    shared_decorator = decorator
+    shared_longest_transcripts.clear()
+    transcript_count = 0
+    try:
+        if not single_pass:
+            # Step 7: merge in file order, so that the first of equally long transcripts still wins
+            longest_lengths = {}
+            for shard_transcripts, shard_lengths, shard_count in map_shards(longest_transcripts_shard, gff_file, jobs, starts_with_gene_id):
+                transcript_count += shard_count
+                for gene_id, transcript_id in shard_transcripts.items():
+                    if gene_id not in longest_lengths or shard_lengths[gene_id] > longest_lengths[gene_id]:
+                        shared_longest_transcripts[gene_id] = transcript_id
+                        longest_lengths[gene_id] = shard_lengths[gene_id]
+
+        with xopen(output_file, 'w') as outfile:
+            for text, shard_count in map_shards(decorate_shard, gff_file, jobs, starts_with_gene_id, (single_pass,)):
+                outfile.write(text)
+                transcript_count += shard_count
+    except FileNotFoundError:
+        print(f"Error: The file {gff_file} or {output_file} was not found.")
+        exit(1)
+    except Exception as e:
+        print(f"An error occurred while processing files: {e}")
+        exit(1)
+    return transcript_count
+
+def decorate_gff(gff_file, output_file, decorator):
+    """Steps 7 and 8 in two passes over the GFF file; returns the transcript count."""
+    try:
+        with xopen(gff_file, 'r') as infile:
+            longest_transcripts, transcript_count = find_longest_transcripts(read_gff3(infile))
+    except FileNotFoundError:
+        print(f"Error: The file {gff_file} was not found.")
+        exit(1)
+    except Exception as e:
+        print(f"An error occurred while reading {gff_file}: {e}")
+        exit(1)
+
+    try:
+        with xopen(gff_file, 'r') as infile, xopen(output_file, 'w') as outfile:
+            for record in read_gff3(infile):
+                outfile.write(decorator.decorate(record, longest_transcripts))
+    except FileNotFoundError:
+        print(f"Error: The file {gff_file} or {output_file} was not found.")
+        exit(1)
+    except Exception as e:
+        print(f"An error occurred while processing files: {e}")
+        exit(1)
+    return transcript_count
+
+def decorate_gff_single_pass(gff_file, output_file, decorator):
+    """
+    Steps 7 and 8 in one pass, holding only one gene block in memory.
+
+    The longest transcript of a gene is chosen among the transcripts in its
+    gene block, so all features of a gene have to follow its gene line.
+    Returns the transcript count.
+    """
+    transcript_count = 0
+    try:
+        with xopen(gff_file, 'r') as infile, xopen(output_file, 'w') as outfile:
+            for block in iter_gene_blocks(read_gff3(infile)):
+                longest_transcripts, block_transcripts = find_longest_transcripts(block.records)
+                transcript_count += block_transcripts
+                for record in block.records:
+                    outfile.write(decorator.decorate(record, longest_transcripts))
+    except FileNotFoundError:
+        print(f"Error: The file {gff_file} or {output_file} was not found.")
+        exit(1)
+    except Exception as e:
+        print(f"An error occurred while processing files: {e}")
+        exit(1)
+    return transcript_count
+
+def add_lookup_arguments(parser):
+    """Add the options for the RefSeq and PFAM lookups and the GFF pass mode (shared with ncbi_gff_all.py)."""
+    parser.add_argument('--single-pass', action='store_true', help='Read the GFF file only once and keep only one gene block in memory. Requires all features of a gene to follow its gene line, as in AGAT output.')
+    parser.add_argument('-r', '--refseq-cache', help='SQLite file to keep resolved RefSeq accessions across runs and species (created if missing)')
+    parser.add_argument('--refresh-not-found', action='store_true', help='Look up the accessions that the RefSeq cache holds as not found again, e.g. after an update of the NCBI databases')
+    parser.add_argument('--refseq-table', help='Resolve accessions from a local table in refseq.tsv format (accession, GeneID, description) instead of running datasets')
+    parser.add_argument('--datasets', default='datasets', help='datasets executable used to resolve accessions (default: datasets)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of accessions per datasets call (default: 1000)')
+    parser.add_argument('--datasets-jobs', type=int, default=4, help='Number of datasets calls running at the same time (default: 4)')
+    parser.add_argument('--retries', type=int, default=3, help='Number of retries of a failed datasets call (default: 3)')
+    parser.add_argument('-p', '--pfam-index', help='Precompiled PFAM mapping index (pickle), built from pfam_file on the first run and rebuilt when pfam_file changes')
+    add_metrics_arguments(parser)
+
+def record_refseq_cache(metrics, refseq_cache):
+    metrics.cache('refseq', refseq_cache.cached, refseq_cache.resolved + refseq_cache.not_found + refseq_cache.failed,
+                  resolved=refseq_cache.resolved, not_found=refseq_cache.not_found, failed=refseq_cache.failed)
+
+def make_resolver(args, aux_prefix):
+    if args.refseq_table:
+        return TableResolver(args.refseq_table)
+    return DatasetsResolver(args.datasets, args.chunk_size, args.datasets_jobs, args.retries, aux_prefix)
+
+def load_pfam(args):
+    # Step 5: Load PFAM mappings
+    if args.pfam_index:
+        return load_pfam_index(args.pfam_file, args.pfam_index)
+    return load_pfam_mapping(args.pfam_file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Decorate a GFF file with functional annotation from EnTAP, RefSeq GeneIDs (via NCBI datasets) and PFAM accessions.')
+    parser.add_argument('annotation_file', help='EnTAP results table (entap_results.tsv)')
+    parser.add_argument('gff_file', help='GFF file of the species')
+    parser.add_argument('pfam_file', help='PFAM mapping (pdb_pfam_mapping.txt)')
+    parser.add_argument('output_file', help='Decorated output GFF file')
+    add_lookup_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes decorating the GFF file; it is split at gene lines and the output is the same as with one process (default: 1)')
+    parser.add_argument('--aux-prefix', help='Prefix of the auxiliary files accessions.txt and refseq.tsv (default: output file name without extension (and .gz) and a dot, so species can run in the same directory)')
+    args = parser.parse_args()
+    metrics = RunMetrics.from_args('ncbi_gff.py', args)
+
+    annotation_file = args.annotation_file
+    gff_file = args.gff_file
+    output_file = args.output_file
+
+    # Steps 1 and 6: Read the EnTAP results once
+    with metrics.stage('load_entap', annotation_file):
+        entap = load_entap_results(annotation_file)
+
+    # Steps 2 to 4: Look up RefSeq GeneIDs and descriptions, consulting the cache first
+    aux_prefix = args.aux_prefix if args.aux_prefix is not None else os.path.splitext(strip_compressed_suffix(output_file))[0] + '.'
+    resolver = make_resolver(args, aux_prefix)
+    with metrics.stage('refseq_lookup') as stage:
+        refseq_cache = RefSeqCache(args.refseq_cache, args.refresh_not_found)
+        refseq_dict = refseq_cache.lookup(entap.accessions, resolver)
+        refseq_cache.close()
+        stage['records'] = len(entap.accessions)
+    record_refseq_cache(metrics, refseq_cache)
+
+    # Step 5: Load PFAM mappings
+    with metrics.stage('load_pfam') as stage:
+        pfam_dict = load_pfam(args)
+        stage['records'] = len(pfam_dict)
+
+    # Steps 7 and 8: Process the GFF file and add new attributes
+    decorator = GffDecorator(entap, refseq_dict, pfam_dict)
+    with metrics.stage('decorate_gff', gff_file, hot=True):
+        if args.jobs > 1:
+            transcript_count = decorate_gff_sharded(gff_file, output_file, decorator, args.jobs, args.single_pass)
+        elif args.single_pass:
+            transcript_count = decorate_gff_single_pass(gff_file, output_file, decorator)
+        else:
+            transcript_count = decorate_gff(gff_file, output_file, decorator)
+    metrics.count('entap_entries', entap.entry_count)
+    metrics.count('transcripts', transcript_count)
+
+    # Step 9: Output counts and check for consistency
+    print(f"Number of entries in {annotation_file}: {entap.entry_count}")
+    print(f"Number of transcripts and mRNA in {gff_file}: {transcript_count}")
+
+    if entap.entry_count == transcript_count:
+        print("The number of entries in the annotation file matches the number of transcripts in the GFF file.")
+    else:
+        print("Warning: The number of entries in the annotation file does not match the number of transcripts in the GFF file.")
+    print(f"Updated GFF file written to {output_file}")
+    print(refseq_cache.report())
+    metrics.write()
+
+if __name__ == "__main__":
+    main()
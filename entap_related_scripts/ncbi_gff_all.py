@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import glob
+import json
+import argparse
+import multiprocessing
+from ncbi_gff import (RefSeqCache, GffDecorator, add_lookup_arguments, make_resolver, load_pfam,
+                      load_entap_results, decorate_gff, decorate_gff_single_pass, record_refseq_cache)
+from run_metrics import RunMetrics
+
+SUMMARY_COLUMNS = ['species', 'entap_entries', 'transcripts', 'counts_match', 'output_file', 'status']
+
+# Lookup tables shared by all species. They are filled before the worker
+# processes are forked, so the workers use them copy-on-write.
+refseq_dict = {}
+pfam_dict = {}
+# EnTAP results per species, read once for both the accessions (Step 1) and the annotations (Step 6)
+entap_results = {}
+
+def find_species(gff_dir, tsv_dir):
+    """
+    Return (species, tsv_file, gff_file) for every *.gff file that has a matching <species>.tsv, like loop.sh.
+    Both files may also be gzip/bgzip-compressed (<species>.gff.gz, <species>.tsv.gz).
+    """
+    species = []
+    gff_files = glob.glob(os.path.join(gff_dir, '*.gff')) + glob.glob(os.path.join(gff_dir, '*.gff.gz'))
+    for gff_file in sorted(gff_files):
+        basename = os.path.basename(gff_file).removesuffix('.gz').removesuffix('.gff')
+        tsv_file = os.path.join(tsv_dir, basename + '.tsv')
+        if not os.path.isfile(tsv_file) and os.path.isfile(tsv_file + '.gz'):
+            tsv_file += '.gz'
+        if os.path.isfile(tsv_file):
+            print(f"Found matching files: {gff_file} and {tsv_file}")
+            species.append((basename, tsv_file, gff_file))
+        else:
+            print(f"No matching .tsv file found for {gff_file}")
+    return species
+
+def load_species_entap(tsv_file):
+    """Steps 1 and 6 for one species; None if the EnTAP results cannot be read."""
+    try:
+        return load_entap_results(tsv_file)
+    except SystemExit:
+        # ncbi_gff.py exits on unreadable input, which must not stop the other species
+        return None
+
+def decorate_species(species, gff_file, output_file, single_pass, collect_metrics=False, profile_file=None):
+    """
+    Steps 7 to 9 of ncbi_gff.py for one species, with its EnTAP results from
+    entap_results; returns its row of the summary table and, with
+    collect_metrics, the metrics of the species (else None).
+    """
+    row = {'species': species, 'entap_entries': '', 'transcripts': '', 'counts_match': '', 'output_file': output_file, 'status': 'ok'}
+    metrics = RunMetrics('ncbi_gff.py', profile_file=profile_file)
+    metrics.enabled = collect_metrics
+    entap = entap_results.get(species)
+    if entap is None:
+        row['status'] = 'failed'
+        return row, None
+    try:
+        decorator = GffDecorator(entap, refseq_dict, pfam_dict)
+        with metrics.stage('decorate_gff', gff_file, hot=True):
+            if single_pass:
+                transcript_count = decorate_gff_single_pass(gff_file, output_file, decorator)
+            else:
+                transcript_count = decorate_gff(gff_file, output_file, decorator)
+    except SystemExit:
+        # ncbi_gff.py exits on unreadable input, which must not take down the worker
+        row['status'] = 'failed'
+        return row, None
+    row['entap_entries'] = entap.entry_count
+    row['transcripts'] = transcript_count
+    row['counts_match'] = 'yes' if entap.entry_count == transcript_count else 'no'
+    print(f"Updated GFF file written to {output_file}")
+    if not collect_metrics:
+        return row, None
+    metrics.count('entap_entries', entap.entry_count)
+    metrics.count('transcripts', transcript_count)
+    return row, dict(metrics.as_dict(), species=species)
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Run ncbi_gff.py on all species: every <species>.gff in the GFF directory with a <species>.tsv (EnTAP results) in the EnTAP directory is decorated in a pool of worker processes. The RefSeq accessions of all species are resolved and the PFAM mapping is loaded once, before the workers start.')
+    parser.add_argument('gff_dir', help='Directory with the GFF files (<species>.gff)')
+    parser.add_argument('tsv_dir', help='Directory with the EnTAP results, renamed to <species>.tsv')
+    parser.add_argument('pfam_file', help='PFAM mapping (pdb_pfam_mapping.txt)')
+    parser.add_argument('-o', '--outdir', default='.', help='Output directory for <species>_ncbi.gff (default: current directory)')
+    parser.add_argument('--bgzip', action='store_true', help='Write bgzip-compressed output files (<species>_ncbi.gff.gz)')
+    parser.add_argument('-s', '--summary', default='ncbi_gff_summary.tsv', help='Per-species summary table (default: ncbi_gff_summary.tsv)')
+    parser.add_argument('-n', '--processes', type=int, default=available_cores(), help='Number of species decorated at the same time (default: available cores)')
+    add_lookup_arguments(parser)
+    parser.add_argument('--aux-prefix', default='all_species.', help='Prefix of the auxiliary files accessions.txt and refseq.tsv (default: all_species.)')
+    args = parser.parse_args()
+    metrics = RunMetrics.from_args('ncbi_gff_all.py', args)
+
+    species = find_species(args.gff_dir, args.tsv_dir)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # Steps 1 and 6 for all species: every EnTAP results table is read once, before the workers are forked,
+    # and kept for decorating. The accessions of all species are then looked up at once (Steps 2 to 4).
+    accessions = set()
+    with metrics.stage('load_entap') as stage:
+        for name, tsv_file, _ in species:
+            entap = load_species_entap(tsv_file)
+            if entap is not None:
+                entap_results[name] = entap
+                accessions.update(entap.accessions)
+        stage['records'] = sum(entap.entry_count for entap in entap_results.values())
+    with metrics.stage('refseq_lookup') as stage:
+        refseq_cache = RefSeqCache(args.refseq_cache, args.refresh_not_found)
+        refseq_dict.update(refseq_cache.lookup(accessions, make_resolver(args, args.aux_prefix)))
+        refseq_cache.close()
+        stage['records'] = len(accessions)
+    record_refseq_cache(metrics, refseq_cache)
+    print(refseq_cache.report())
+
+    # Step 5 once for all species
+    with metrics.stage('load_pfam') as stage:
+        pfam_dict.update(load_pfam(args))
+        stage['records'] = len(pfam_dict)
+
+    # With --profile, every species is profiled into <profile>.<species>
+    tasks = [(name, gff_file, os.path.join(args.outdir, f"{name}_ncbi.gff" + ('.gz' if args.bgzip else '')), args.single_pass,
+              bool(args.metrics_json), f"{args.profile}.{name}" if args.profile else None)
+             for name, _, gff_file in species]
+    with metrics.stage('decorate_species') as stage:
+        with multiprocessing.get_context('fork').Pool(max(1, args.processes)) as pool:
+            results = pool.starmap(decorate_species, tasks, chunksize=1)
+        stage['records'] = len(tasks)
+    rows = [row for row, _ in results]
+
+    with open(args.summary, 'w', newline='') as summary:
+        writer = csv.DictWriter(summary, fieldnames=SUMMARY_COLUMNS, delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    mismatches = [row['species'] for row in rows if row['counts_match'] != 'yes']
+    if mismatches:
+        print(f"Warning: the number of EnTAP entries does not match the number of transcripts (or the run failed) for: {', '.join(mismatches)}")
+    print(f"Summary of {len(rows)} species written to {args.summary}")
+
+    if args.metrics_json:
+        # The metrics of all species go into the same file, so they can be aggregated with run_metrics.py
+        with open(args.metrics_json, 'w') as metrics_file:
+            json.dump(dict(metrics.as_dict(), runs=[species_metrics for _, species_metrics in results if species_metrics]), metrics_file, indent=2)
+            metrics_file.write('\n')
+
+if __name__ == "__main__":
+    main()
@@ -2,66 +2,114 @@
 
 import os
 import argparse
+from gff3_records import GFF3Record, read_gff3, read_shard, map_shards
+from compressed_io import xopen
+from run_metrics import RunMetrics, add_metrics_arguments
 
 # Initialize a global counter for introns
 intron_counter = 1
 
-def add_mrna_lines(input_gff, output_gff):
-    global intron_counter  # Ensure we can access the global counter
-    with open(input_gff, 'r') as infile, open(output_gff, 'w') as outfile:
-        gene_info = {}
-        transcript_info = {}
-        transcript_features = []
-        exon_features = {}
-        cds_features = {}
-
-        for line in infile:
-            if line.startswith("#"):
-                outfile.write(line)
-                continue
-
-            fields = line.strip().split('\t')
-            if len(fields) != 9:
-                continue  # Skip malformed lines
-
-            seqid, source, feature_type, start, end, score, strand, phase, attributes = fields
-            start, end = int(start), int(end)
-            attributes_dict = {attr.split('=')[0]: attr.split('=')[1] for attr in attributes.split(';') if '=' in attr}
-
-            if feature_type == "gene":
-                # Before writing a new gene, flush any collected transcript features
-                if transcript_features:
-                    flush_transcript_features(outfile, transcript_info, transcript_features, exon_features, cds_features)
-                    transcript_features = []
-                    transcript_info = {}
-                    exon_features = {}
-                    cds_features = {}
-
-                # Write the gene line immediately
-                outfile.write(line)
-
-            elif feature_type == "exon":
-                parent_transcript = attributes_dict.get('Parent')
-                if parent_transcript:
-                    if parent_transcript not in exon_features:
-                        exon_features[parent_transcript] = []
-                    exon_features[parent_transcript].append((start, end, line))
-
-            elif feature_type == "CDS":
-                parent_transcript = attributes_dict.get('Parent')
-                if parent_transcript:
-                    if parent_transcript not in cds_features:
-                        cds_features[parent_transcript] = []
-                    cds_features[parent_transcript].append((start, end, line))  # Store the CDS feature line
-
-            elif feature_type in ["start_codon", "stop_codon", "intron"]:
-                transcript_features.append(line)
-
-        # Flush the remaining transcript features for the last gene
-        if transcript_features:
-            flush_transcript_features(outfile, transcript_info, transcript_features, exon_features, cds_features)
-
-def flush_transcript_features(outfile, transcript_info, transcript_features, exon_features, cds_features):
+def add_mrna_chunks(records):
+    """
+    Add mRNA records and fix exon boundaries in a stream of GFF3 records.
+
+    Output records are yielded in lists. A list is completed each time the
+    collected transcript features have been flushed, so with the AGAT layout
+    (all features of a gene follow its gene line) every gene in a list comes
+    with all of its features.
+    """
+    output = []
+    transcript_features = []
+    exon_features = {}
+    cds_features = {}
+
+    for record in records:
+        if record.is_comment:
+            output.append(record)
+            continue
+
+        if not record.is_feature:
+            continue  # Skip malformed lines
+
+        feature_type = record.type
+        start, end = record.start, record.end
+
+        if feature_type == "gene":
+            # Before writing a new gene, flush any collected transcript features
+            if transcript_features:
+                flush_transcript_features(output, transcript_features, exon_features, cds_features)
+                transcript_features = []
+                exon_features = {}
+                cds_features = {}
+                yield output
+                output = []
+
+            # Write the gene line immediately
+            output.append(record)
+
+        elif feature_type == "exon":
+            parent_transcript = record.get('Parent')
+            if parent_transcript:
+                if parent_transcript not in exon_features:
+                    exon_features[parent_transcript] = []
+                exon_features[parent_transcript].append((start, end, record))
+
+        elif feature_type == "CDS":
+            parent_transcript = record.get('Parent')
+            if parent_transcript:
+                if parent_transcript not in cds_features:
+                    cds_features[parent_transcript] = []
+                cds_features[parent_transcript].append((start, end, record))  # Store the CDS feature record
+
+        elif feature_type in ["start_codon", "stop_codon", "intron"]:
+            transcript_features.append(record)
+
+    # Flush the remaining transcript features for the last gene
+    if transcript_features:
+        flush_transcript_features(output, transcript_features, exon_features, cds_features)
+    if output:
+        yield output
+
+def add_mrna_lines(input_gff, output_gff, jobs=1):
+    global intron_counter
+    if jobs > 1:
+        with xopen(output_gff, 'w') as outfile:
+            for text, introns in map_shards(add_mrna_shard, input_gff, jobs, flushes_at_gene_line):
+                outfile.write(text)
+                # Keep the intron counter where the serial run would have left it
+                intron_counter += introns
+        return
+
+    with xopen(input_gff, 'r') as infile, xopen(output_gff, 'w') as outfile:
+        for chunk in add_mrna_chunks(read_gff3(infile)):
+            for record in chunk:
+                outfile.write(record.raw)
+
+def flushes_at_gene_line(previous_block, gene_line):
+    """
+    True if add_mrna_chunks() flushes all collected features at this gene line (see shard_ranges()).
+
+    That is the case if the gene line is well-formed and the previous gene
+    block contained a start_codon, stop_codon or intron; the file can then be
+    split here without changing the output.
+    """
+    if previous_block is None or len(gene_line.strip().split(b'\t')) != 9:
+        return False
+    for line in previous_block:
+        if not line.startswith(b'#'):
+            fields = line.strip().split(b'\t')
+            if len(fields) == 9 and fields[2] in (b'start_codon', b'stop_codon', b'intron'):
+                return True
+    return False
+
+def add_mrna_shard(path, start, end):
+    """Process one shard of the input in a worker process; returns the output text and the number of introns created."""
+    global intron_counter
+    intron_counter = 1
+    text = ''.join(record.raw for chunk in add_mrna_chunks(read_shard(path, start, end)) for record in chunk)
+    return text, intron_counter - 1
+
+def flush_transcript_features(output, transcript_features, exon_features, cds_features):
     # Write the mRNA feature for each transcript and adjust exon, CDS, and intron features
     for transcript_id, exons in exon_features.items():
         # Calculate mRNA boundaries from exons or CDS features
@@ -73,82 +121,114 @@ def flush_transcript_features(outfile, transcript_info, transcript_features, exo
             mrna_end = max(mrna_end, max(cds[1] for cds in cds_features[transcript_id]))
 
         # Write the mRNA feature before writing exons/CDS/introns
-        write_mrna(outfile, transcript_id, exons[0][2], mrna_start, mrna_end)
+        write_mrna(output, transcript_id, exons[0][2], mrna_start, mrna_end)
 
         # Now adjust exons based on CDS and write exons/introns
-        for exon_start, exon_end, exon_line in exons:
-            cds_regions = [(cds_start, cds_end) for cds_start, cds_end, _ in cds_features.get(transcript_id, [])]
-            adjusted_exon = adjust_exon_to_cds(exon_start, exon_end, cds_regions)
-
-            if adjusted_exon:
-                # Write the corrected exon
-                write_feature_with_new_coords(outfile, exon_line, adjusted_exon[0], adjusted_exon[1])
+        cds_regions = [(cds_start, cds_end) for cds_start, cds_end, _ in cds_features.get(transcript_id, [])]
+        adjusted_exons = reconcile_exons_with_cds([(exon_start, exon_end) for exon_start, exon_end, _ in exons], cds_regions)
+        for (exon_start, exon_end, exon_record), (new_start, new_end, introns) in zip(exons, adjusted_exons):
+            # Write the corrected exon
+            write_feature_with_new_coords(output, exon_record, new_start, new_end)
 
-                # If there's an intron part, write it
-                if adjusted_exon[2]:  # intron_start and intron_end exist
-                    create_and_write_intron(outfile, exon_line, adjusted_exon[2], adjusted_exon[3])
+            # If there's an intron part, write it
+            for intron_start, intron_end in introns:
+                create_and_write_intron(output, exon_record, intron_start, intron_end)
 
         # Write the CDS features for the transcript
         if transcript_id in cds_features:
-            for cds_start, cds_end, cds_line in cds_features[transcript_id]:
-                outfile.write(cds_line)
+            for cds_start, cds_end, cds_record in cds_features[transcript_id]:
+                output.append(cds_record)
 
     # Write all other features (start_codon, stop_codon, etc.)
     for feature in transcript_features:
-        outfile.write(feature)
+        output.append(feature)
 
-def write_mrna(outfile, transcript_id, example_line, start, end):
+def write_mrna(output, transcript_id, example_record, start, end):
     """
-    Write the mRNA feature to the output file, using the example line for the structure.
+    Append the mRNA feature to the output, using the example record for the structure.
     """
-    fields = example_line.strip().split('\t')
+    fields = list(example_record.fields)
     fields[2] = 'mRNA'  # Set the feature type to mRNA
     fields[3] = str(start)
     fields[4] = str(end)
-    attributes = f"ID={transcript_id};Parent={transcript_id.split('.')[0]}"  # Adjust for correct ID and Parent
-    fields[8] = attributes
-    outfile.write("\t".join(fields) + "\n")
+    fields[8] = f"ID={transcript_id};Parent={transcript_id.split('.')[0]}"  # Adjust for correct ID and Parent
+    output.append(GFF3Record.from_fields(fields))
 
-def adjust_exon_to_cds(exon_start, exon_end, cds_regions):
+def exon_overlaps_cds(exon_start, exon_end, cds_start, cds_end):
     """
-    Adjust exon coordinates to match the CDS coordinates. 
-    Return the adjusted exon coordinates and any leftover regions as introns.
+    True if the exon lies within the CDS, overlaps it on one side or surrounds it.
+
+    An exon that only touches the first or last base of a longer CDS from
+    outside does not count as overlapping.
     """
-    for cds_start, cds_end in cds_regions:
-        # Exon completely overlaps with CDS
-        if exon_start >= cds_start and exon_end <= cds_end:
-            return (exon_start, exon_end, None, None)  # No intron part
+    if exon_start >= cds_start:
+        return exon_end <= cds_end or exon_start < cds_end
+    return exon_end > cds_start
 
-        # Exon partially overlaps with CDS on the left side
-        elif exon_start < cds_start and exon_end <= cds_end and exon_end > cds_start:
-            return (cds_start, exon_end, exon_start, cds_start - 1)  # Intron on the left
+def reconcile_exons_with_cds(exons, cds_regions):
+    """
+    Adjust exon coordinates to match the CDS coordinates.
+
+    exons and cds_regions are lists of (start, end) in file order. For every
+    exon, return (start, end, introns): the part of the exon covered by the
+    first CDS (in file order) it overlaps, and the leftover parts of the exon
+    as a list of (start, end) introns, left and right of the CDS. An exon
+    without CDS keeps (None, None) as coordinates and becomes one intron.
+
+    Exons and CDS are sorted once and matched in a single sweep.
+    """
+    cds_order = sorted(range(len(cds_regions)), key=lambda i: cds_regions[i])
+    # Largest CDS end among the CDS sorted up to each position, so that the sweep can skip
+    # CDS lying completely before an exon even if CDS overlap each other
+    max_ends = []
+    max_end = None
+    for i in cds_order:
+        max_end = cds_regions[i][1] if max_end is None else max(max_end, cds_regions[i][1])
+        max_ends.append(max_end)
 
-        # Exon partially overlaps with CDS on the right side
-        elif exon_start >= cds_start and exon_start < cds_end and exon_end > cds_end:
-            return (exon_start, cds_end, cds_end + 1, exon_end)  # Intron on the right
+    adjusted = [None] * len(exons)
+    first = 0
+    for exon_index in sorted(range(len(exons)), key=lambda i: exons[i]):
+        exon_start, exon_end = exons[exon_index]
+        while first < len(cds_order) and max_ends[first] < exon_start:
+            first += 1
 
-        # Exon surrounds the CDS completely (creates two introns)
-        elif exon_start < cds_start and exon_end > cds_end:
-            return (cds_start, cds_end, exon_start, cds_start - 1)  # Intron left, and exon_end -> intron
+        match = None
+        position = first
+        while position < len(cds_order) and cds_regions[cds_order[position]][0] <= exon_end:
+            cds_index = cds_order[position]
+            if (match is None or cds_index < match) and exon_overlaps_cds(exon_start, exon_end, *cds_regions[cds_index]):
+                match = cds_index
+            position += 1
 
-    # If no match with CDS, return exon as intron
-    return (None, None, exon_start, exon_end)
+        if match is None:
+            # If no match with CDS, return exon as intron
+            adjusted[exon_index] = (None, None, [(exon_start, exon_end)])
+            continue
+        cds_start, cds_end = cds_regions[match]
+        introns = []
+        if exon_start < cds_start:
+            introns.append((exon_start, cds_start - 1))  # Intron on the left
+        if exon_end > cds_end:
+            introns.append((cds_end + 1, exon_end))  # Intron on the right
+        adjusted[exon_index] = (max(exon_start, cds_start), min(exon_end, cds_end), introns)
+    return adjusted
 
-def write_feature_with_new_coords(outfile, original_line, new_start, new_end):
+def write_feature_with_new_coords(output, original_record, new_start, new_end):
     """
-    Write the feature with adjusted coordinates.
+    Append the feature with adjusted coordinates to the output.
     """
-    fields = original_line.strip().split('\t')
+    fields = list(original_record.fields)
     fields[3] = str(new_start)
     fields[4] = str(new_end)
-    outfile.write("\t".join(fields) + "\n")
+    output.append(GFF3Record.from_fields(fields))
 
-def create_and_write_intron(outfile, original_line, intron_start, intron_end):
+def create_and_write_intron(output, original_record, intron_start, intron_end):
     """
-    Create a new intron feature with a unique ID and write it to the file.
+    Create a new intron feature with a unique ID and append it to the output.
     """
     global intron_counter
-    fields = original_line.strip().split('\t')
+    fields = list(original_record.fields)
     
     # Modify the ID attribute to replace agat-exon with fixed-intron and append a counter
     attributes = fields[8].replace("agat-exon", "fixed-intron")
@@ -158,7 +238,7 @@ def create_and_write_intron(outfile, original_line, intron_start, intron_end):
     fields[3] = str(intron_start)
     fields[4] = str(intron_end)
     
-    # outfile.write("\t".join(fields) + "\n") # realized the intron was in the file, already
+    # output.append(GFF3Record.from_fields(fields)) # realized the intron was in the file, already
     
     # Increment the intron counter for uniqueness
     intron_counter += 1
@@ -168,14 +248,20 @@ def main():
     parser = argparse.ArgumentParser(description='Add missing mRNA lines and fix exon boundaries in a GFF3 file, this script was written to fix an AGAT-created gff3 file; AGAT messed up partial genes.')
     parser.add_argument('-i', '--input', required=True, help='Input GFF3 file.')
     parser.add_argument('-o', '--output', required=True, help='Output GFF3 file.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes; the input is split at gene lines and the output is the same as with one process (default: 1)')
+    add_metrics_arguments(parser)
 
     # Parse arguments
     args = parser.parse_args()
+    metrics = RunMetrics.from_args('add_mRNA_line.py', args)
 
     # Check if input is a file
     if os.path.isfile(args.input):
         # Process the specified file
-        add_mrna_lines(args.input, args.output)
+        with metrics.stage('add_mrna_lines', args.input, hot=True):
+            add_mrna_lines(args.input, args.output, args.jobs)
+        metrics.count('introns', intron_counter - 1)
+        metrics.write()
         print(f"Processed: {args.input} -> {args.output}")
     else:
         print("Invalid input path. Please provide a valid GFF3 file.")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Transparent gzip/bgzip I/O for the postprocessing scripts and ncbi_gff.py.
+
+xopen() opens a file like open(). A gzip or bgzip file (recognized by its
+magic bytes, not by its name) is decompressed on a background thread while
+the script parses the previous blocks. An output file whose name ends in
+.gz or .bgz is written in the BGZF format of bgzip/samtools: the data is
+cut into 64 KiB blocks that are compressed in a pool of threads, so the
+output can be indexed with tabix and read with zcat, gzip or bgzip.
+
+plain_file() gives an uncompressed path for code that needs byte offsets
+(the --jobs shards of a GFF3 file).
+"""
+
+import io
+import os
+import zlib
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_MAGIC = b'\x1f\x8b'
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+# Bytes of compressed input read at a time, and decompressed blocks queued ahead of the reader
+READ_BLOCK_SIZE = 1 << 20
+READ_AHEAD_BLOCKS = 16
+BUFFER_SIZE = 1 << 20
+
+# Uncompressed bytes per BGZF block (as in bgzip), compression level and threads
+BGZF_BLOCK_SIZE = 0xff00
+COMPRESS_LEVEL = 6
+COMPRESS_THREADS = min(4, os.cpu_count() or 1)
+
+# Empty block that marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def is_gzip(path):
+    """True if the file starts with the gzip magic bytes (gzip and bgzip files)."""
+    with open(path, 'rb') as file:
+        return file.read(2) == GZIP_MAGIC
+
+def is_compressed_name(path):
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+def strip_compressed_suffix(path):
+    """The path without a .gz or .bgz extension, e.g. to derive the names of other files from it."""
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+class GzipReader(io.RawIOBase):
+    """
+    Reads a gzip file that is decompressed on a background thread.
+
+    zlib releases the GIL while it decompresses, so reading the file and
+    decompressing overlap with the work of the main thread. Files of several
+    gzip members (bgzip, or concatenated gzip files) are read to the end.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.file = open(path, 'rb')
+        self.name = path
+        self.blocks = queue.Queue(READ_AHEAD_BLOCKS)
+        self.pending = memoryview(b'')
+        self.at_end = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.decompress, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.stopped:
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def decompress(self):
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            member_started = False
+            for block in iter(lambda: self.file.read(READ_BLOCK_SIZE), b''):
+                if self.stopped:
+                    return
+                while block:
+                    member_started = True
+                    data = decompressor.decompress(block)
+                    if data:
+                        self.put(data)
+                    block = b''
+                    if decompressor.eof:
+                        # Next member (bgzip block or concatenated gzip file)
+                        block = decompressor.unused_data
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                        member_started = False
+            if member_started:
+                raise EOFError(f"{self.name}: compressed file ended before the end-of-stream marker was reached")
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            if self.at_end:
+                return 0
+            item = self.blocks.get()
+            if item is None:
+                self.at_end = True
+                return 0
+            if isinstance(item, Exception):
+                self.at_end = True
+                raise item
+            self.pending = memoryview(item)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            self.thread.join()
+            self.file.close()
+        super().close()
+
+def bgzf_block(data, level=COMPRESS_LEVEL):
+    """Compress up to 64 KiB into one BGZF block (a gzip member with the block size in its extra field)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+class BgzipWriter(io.RawIOBase):
+    """
+    Writes a BGZF file; the blocks are compressed by a pool of threads and
+    written in order. zlib releases the GIL while it compresses, so the
+    blocks are compressed in parallel with each other and with the script.
+    """
+
+    def __init__(self, path, threads=COMPRESS_THREADS, level=COMPRESS_LEVEL):
+        super().__init__()
+        self.file = open(path, 'wb')
+        self.name = path
+        self.level = level
+        self.buffer = bytearray()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.blocks = deque()
+        self.max_blocks = 4 * max(1, threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self.submit(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def submit(self, data):
+        self.blocks.append(self.executor.submit(bgzf_block, data, self.level))
+        while len(self.blocks) > self.max_blocks:
+            self.file.write(self.blocks.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.blocks:
+                self.file.write(self.blocks.popleft().result())
+            self.file.write(BGZF_EOF)
+        finally:
+            self.executor.shutdown()
+            self.file.close()
+            super().close()
+
+def xopen(path, mode='r', **kwargs):
+    """
+    Open a file like open(path, mode, **kwargs).
+
+    For reading, gzip and bgzip files are decompressed transparently. For
+    writing, a name ending in .gz or .bgz gives a bgzip-compressed file.
+    """
+    if mode.startswith('r'):
+        if not is_gzip(path):
+            return open(path, mode, **kwargs)
+        binary = io.BufferedReader(GzipReader(path), BUFFER_SIZE)
+    elif mode.startswith('w') and is_compressed_name(path):
+        binary = io.BufferedWriter(BgzipWriter(path), BUFFER_SIZE)
+    else:
+        return open(path, mode, **kwargs)
+    if 'b' in mode:
+        return binary
+    return io.TextIOWrapper(binary, **kwargs)
+
+@contextmanager
+def plain_file(path):
+    """Yield path if the file is not compressed, else the path of a decompressed temporary copy that is removed afterwards."""
+    if not is_gzip(path):
+        yield path
+        return
+    descriptor, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as plain, xopen(path, 'rb') as compressed:
+            shutil.copyfileobj(compressed, plain, BUFFER_SIZE)
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
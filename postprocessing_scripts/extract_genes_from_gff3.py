@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import mmap
+import argparse
+from run_metrics import RunMetrics, add_metrics_arguments
+from compressed_io import xopen, is_gzip, BUFFER_SIZE
+
+INDEX_SUFFIX = '.gidx'
+INDEX_VERSION = 'gidx1'
+
+def index_path(gff3_path):
+    return gff3_path + INDEX_SUFFIX
+
+def file_stamp(gff3_path):
+    """Size and modification time of the GFF3 file; the index is rebuilt when they change."""
+    stat = os.stat(gff3_path)
+    return f"{stat.st_size}\t{stat.st_mtime_ns}"
+
+def build_gene_index(gff3_path, output_path=None):
+    """
+    Record the byte range of every gene block of a GFF3 file in a sidecar file.
+
+    A gene block reaches from a gene line up to the next gene line, as in
+    AGAT/BRAKER output where all features of a gene follow its gene line.
+    Each row of the index holds gene ID, seqid, start, end, byte offset,
+    byte length and the comma-separated transcript IDs of the gene. The first
+    line of the index holds the size and modification time of the GFF3 file
+    and the length of the header (the bytes before the first gene). For a
+    compressed GFF3 file, the offsets are those of the decompressed data.
+    """
+    if output_path is None:
+        output_path = index_path(gff3_path)
+    rows = []
+    header_length = None
+    gene = None
+    offset = 0
+    with xopen(gff3_path, 'rb') as gff3_file:
+        for line in gff3_file:
+            if not line.startswith(b'#'):
+                fields = line.rstrip(b'\r\n').split(b'\t')
+                if len(fields) == 9 and fields[2] == b'gene':
+                    if gene is not None:
+                        gene[5] = offset - gene[4]
+                        rows.append(gene)
+                    elif header_length is None:
+                        header_length = offset
+                    gene = [attribute_value(fields[8], b'ID'), fields[0].decode(), int(fields[3]), int(fields[4]), offset, 0, []]
+                elif gene is not None and len(fields) == 9 and fields[2] in (b'mRNA', b'transcript'):
+                    transcript_id = attribute_value(fields[8], b'ID')
+                    if transcript_id:
+                        gene[6].append(transcript_id)
+            offset += len(line)
+    if gene is not None:
+        gene[5] = offset - gene[4]
+        rows.append(gene)
+    if header_length is None:
+        header_length = offset
+
+    # Write to a temporary file first, so a concurrent reader never sees a partial index
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as index_file:
+        index_file.write(f"#{INDEX_VERSION}\t{file_stamp(gff3_path)}\t{header_length}\n")
+        for gene_id, seqid, start, end, gene_offset, length, transcripts in rows:
+            index_file.write(f"{gene_id}\t{seqid}\t{start}\t{end}\t{gene_offset}\t{length}\t{','.join(transcripts)}\n")
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def attribute_value(attributes, key):
+    """Return the value of key in a GFF3 attributes column given as bytes, decoded."""
+    for attribute in attributes.split(b';'):
+        name, sep, value = attribute.partition(b'=')
+        if sep and name.strip() == key:
+            return value.decode()
+    return ''
+
+class GeneIndex:
+    """The gene blocks of a GFF3 file as read from its sidecar index."""
+
+    def __init__(self, path):
+        self.genes = []
+        self.header_length = 0
+        self.stamp = None
+        self.rebuilt = False
+        with open(path, 'r') as index_file:
+            first = index_file.readline().rstrip('\n').split('\t')
+            if first[0] != '#' + INDEX_VERSION:
+                raise ValueError(f"{path} is not a gene index")
+            self.stamp = f"{first[1]}\t{first[2]}"
+            self.header_length = int(first[3])
+            for line in index_file:
+                gene_id, seqid, start, end, offset, length, transcripts = line.rstrip('\n').split('\t')
+                self.genes.append((gene_id, seqid, int(start), int(end), int(offset), int(length),
+                                   transcripts.split(',') if transcripts else []))
+
+    def by_ids(self, ids):
+        """Return the genes whose gene ID or one of whose transcript IDs is in ids, and the IDs that were not found."""
+        genes_by_id = {}
+        for gene in self.genes:
+            genes_by_id[gene[0]] = gene
+            for transcript_id in gene[6]:
+                genes_by_id[transcript_id] = gene
+        genes = []
+        missing = set()
+        for feature_id in set(ids):
+            gene = genes_by_id.get(feature_id)
+            if gene is None:
+                missing.add(feature_id)
+            else:
+                genes.append(gene)
+        return genes, missing
+
+    def by_region(self, seqid, start, end):
+        """Return the genes on seqid that overlap start..end (1-based, inclusive)."""
+        return [gene for gene in self.genes if gene[1] == seqid and gene[2] <= end and gene[3] >= start]
+
+def load_gene_index(gff3_path, rebuild=False):
+    """Load the sidecar index of gff3_path, building it first if it is missing or out of date."""
+    path = index_path(gff3_path)
+    if not rebuild and os.path.exists(path):
+        try:
+            index = GeneIndex(path)
+            if index.stamp == file_stamp(gff3_path):
+                return index
+        except (ValueError, IndexError):
+            pass
+        print(f"Rebuilding out-of-date index {path}", file=sys.stderr)
+    build_gene_index(gff3_path, path)
+    index = GeneIndex(path)
+    index.rebuilt = True
+    return index
+
+def parse_region(region):
+    """Parse seqid:start-end (or just seqid) into (seqid, start, end)."""
+    seqid, sep, span = region.rpartition(':')
+    if not sep:
+        return region, 1, float('inf')
+    start, _, end = span.replace(',', '').partition('-')
+    return seqid, int(start), int(end) if end else float('inf')
+
+def copy_ranges(stream, output_file, ranges):
+    """Copy the sorted byte ranges (offset, length) of a stream that can only be read forwards."""
+    position = 0
+    for offset, length in ranges:
+        while position < offset:
+            skipped = len(stream.read(min(BUFFER_SIZE, offset - position)))
+            if not skipped:
+                return
+            position += skipped
+        while length > 0:
+            data = stream.read(min(BUFFER_SIZE, length))
+            if not data:
+                return
+            output_file.write(data)
+            position += len(data)
+            length -= len(data)
+
+def extract_genes(gff3_path, genes, output_path, header_length=0):
+    """Copy the header and the byte ranges of the given gene blocks from gff3_path to output_path, in file order."""
+    ranges = sorted(set((gene[4], gene[5]) for gene in genes))
+    if is_gzip(gff3_path):
+        # The decompressed data is streamed through once instead of being mapped
+        with xopen(gff3_path, 'rb') as gff3_file, xopen(output_path, 'wb') as output_file:
+            copy_ranges(gff3_file, output_file, [(0, header_length)] + ranges)
+        return
+    with open(gff3_path, 'rb') as gff3_file, xopen(output_path, 'wb') as output_file:
+        if os.fstat(gff3_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(gff3_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            output_file.write(data[:header_length])
+            for offset, length in ranges:
+                output_file.write(data[offset:offset + length])
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract gene blocks from a GFF3 file by gene/transcript ID or region, using a byte-offset index (<gff3>.gidx) that is built on first use and rebuilt when the GFF3 file changes.')
+    parser.add_argument('-g', '--gff3', required=True, help='GFF3 file (all features of a gene have to follow its gene line, as in AGAT output)')
+    parser.add_argument('-l', '--list', help='List of gene or transcript IDs to extract, one per line')
+    parser.add_argument('-r', '--region', action='append', default=[], help='Region seqid:start-end (or seqid) to extract all overlapping genes from (can be given several times)')
+    parser.add_argument('-o', '--output', help='Output GFF3 file')
+    parser.add_argument('--no-header', action='store_true', help='Do not copy the lines before the first gene (e.g. ##gff-version 3)')
+    parser.add_argument('--index-only', action='store_true', help='Only (re)build the index')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics = RunMetrics.from_args('extract_genes_from_gff3.py', args)
+
+    if args.index_only:
+        with metrics.stage('build_index', args.gff3, hot=True):
+            path = build_gene_index(args.gff3)
+        metrics.write()
+        print(f"Index written to {path}")
+        return
+    if not args.output or not (args.list or args.region):
+        parser.error('-o and at least one of -l or -r are required unless --index-only is given')
+
+    with metrics.stage('load_index') as stage:
+        index = load_gene_index(args.gff3)
+        stage['records'] = len(index.genes)
+    metrics.cache('gene_index', 0 if index.rebuilt else 1, 1 if index.rebuilt else 0)
+    genes = []
+    if args.list:
+        with xopen(args.list, 'r') as list_file:
+            ids = [line.strip() for line in list_file if line.strip()]
+        found, missing = index.by_ids(ids)
+        genes.extend(found)
+        if missing:
+            print(f"Warning: {len(missing)} IDs were not found in {args.gff3}", file=sys.stderr)
+    for region in args.region:
+        genes.extend(index.by_region(*parse_region(region)))
+
+    with metrics.stage('extract', hot=True) as stage:
+        extract_genes(args.gff3, genes, args.output, 0 if args.no_header else index.header_length)
+        stage['records'] = len(set(gene[4] for gene in genes))
+    metrics.write()
+    print(f"Extracted {len(set(gene[4] for gene in genes))} genes to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,345 @@
 #!/usr/bin/env python3
 
-import argparse
 import re
+import sys
+import argparse
+from collections import Counter
+from gff3_records import GFF3Record, read_gff3, iter_gene_blocks, read_plain_features, attribute_bytes
+from compressed_io import xopen
+from run_metrics import RunMetrics, add_metrics_arguments
+
+CHILD_FEATURE_TYPES = ('exon', 'CDS', 'start_codon', 'stop_codon', 'intron', 'five_prime_UTR', 'three_prime_UTR')
+CHILD_FEATURE_TYPE_BYTES = frozenset(feature_type.encode() for feature_type in CHILD_FEATURE_TYPES)
+
+def read_gene_list(list_path):
+    # open list file, chop trailing newline, store as key in dict (tx_dict), then split by dot and store first value in gene_dict
+    gene_dict = {}
+    tx_dict = {}
+    try:
+        with xopen(list_path, 'r') as list_file:
+            for line in list_file:
+                tx_dict[line.rstrip()] = 1
+                gene_dict[line.split('.')[0]] = 1
+    except IOError:
+        print('Cannot open', list_path)
+    return tx_dict, gene_dict
+
+def filter_records(records, tx_dict, gene_dict):
+    """Yield the comment records and the features of listed genes/transcripts, with trailing whitespace removed."""
+    gene_id = None
+    for record in records:
+        if record.is_comment:
+            yield record
+            continue
+        line = record.raw.rstrip()
+        if not record.is_feature:
+            print("Skipping line: ", line)
+        elif record.type == 'gene':
+            # last column has this format: ID=g1;Dbxref=GeneID:7204623;gene_biotype=protein_coding
+            gene_id = record.get('ID')
+            if gene_id in gene_dict:
+                yield GFF3Record(line + '\n', record.fields)
+        elif record.type == 'mRNA':
+            # last column has this format: ID=g1.t1;Parent=g1;Dbxref=GeneID:7204623,PFAM:PF04055;product=hypothetical protein;note=EggNOG:Radical SAM superfamily
+            # The mRNA is tested by its gene's ID, not by its own ID, as the original script did;
+            # changing this would change which mRNA lines are kept
+            if gene_id in tx_dict:
+                yield GFF3Record(line + '\n', record.fields)
+        elif record.type in CHILD_FEATURE_TYPES:
+            # last colun has this format: ID=agat-cds-1;Parent=g1.t1;gene_id=g1;transcript_id=g1.t1;Dbxref=GeneID:7204623,PFAM:PF04055;product=hypothetical protein;note=EggNOG:Radical SAM superfamily
+            tx_id = record.get('Parent')
+            if tx_id in tx_dict:
+                yield GFF3Record(line + '\n', record.fields)
+        else:
+            print("Skipping line: ", line)
+
+def filter_lines(lines, tx_dict, gene_dict):
+    """
+    Yield the lines (bytes) that filter_records() keeps, with trailing whitespace removed.
+
+    Plain feature lines are checked on their type column and ID or Parent
+    attribute as bytes and yielded as they were read; only the other lines
+    are decoded.
+    """
+    tx_ids = {tx_id.encode() for tx_id in tx_dict}
+    gene_ids = {gene_id.encode() for gene_id in gene_dict}
+    gene_id = None
+    for line, columns in read_plain_features(lines):
+        if columns is None:
+            record = line
+            if record.is_comment:
+                yield record.raw.encode()
+                continue
+            if not record.is_feature:
+                print("Skipping line: ", record.raw.rstrip())
+                continue
+            line = (record.raw.rstrip() + '\n').encode()
+            feature_type = record.type.encode()
+            attributes = record.attributes_text.encode()
+        else:
+            feature_type = columns[2]
+            attributes = columns[8]
+
+        if feature_type == b'gene':
+            gene_id = attribute_bytes(attributes, b'ID=')
+            if gene_id in gene_ids:
+                yield line
+        elif feature_type == b'mRNA':
+            # Tested by the gene's ID, as in filter_records()
+            if gene_id in tx_ids:
+                yield line
+        elif feature_type in CHILD_FEATURE_TYPE_BYTES:
+            if attribute_bytes(attributes, b'Parent=') in tx_ids:
+                yield line
+        else:
+            print("Skipping line: ", line.decode().rstrip())
+
+def filter_gff3(gff3_path, output_path, tx_dict, gene_dict):
+    # open output file with try/except
+    try:
+        with xopen(output_path, 'wb') as output_file:
+            try:
+                with xopen(gff3_path, 'rb') as gff3_file:
+                    output_file.writelines(filter_lines(gff3_file, tx_dict, gene_dict))
+            except IOError:
+                print('Cannot open', gff3_path)
+    except IOError:
+        print('Cannot open', output_path)
+
+def read_id_set(list_path):
+    """Read a list file (one gene or transcript ID per line) into a set."""
+    with xopen(list_path, 'r') as list_file:
+        return {line.strip() for line in list_file if line.strip()}
+
+EXPRESSION_TOKEN = re.compile(r'\s*(?:([()&|!~])|([^\s()&|!~]+))')
+
+def compile_expression(expression, set_names):
+    """
+    Compile a set expression like "single_exon & !orthofinder & no_entap".
+
+    Operators are & (and), | (or) and ! or ~ (not), with the usual
+    precedence (not > and > or), and parentheses; the words and, or and not
+    can be used instead. Returns a function that evaluates the expression on a
+    dict set name -> membership (bool).
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = EXPRESSION_TOKEN.match(expression, position)
+        if match is None:
+            raise ValueError(f"Cannot parse set expression: {expression}")
+        operator, name = match.groups()
+        if name is not None:
+            operator = {'and': '&', 'or': '|', 'not': '!'}.get(name.lower())
+        if operator is not None:
+            tokens.append(('~' if operator == '!' else operator, None))
+        else:
+            if name not in set_names:
+                raise ValueError(f"Unknown set '{name}' in expression: {expression}")
+            tokens.append(('name', name))
+        position = match.end()
+    tokens.append(('end', None))
+
+    def peek():
+        return tokens[0][0]
+
+    def parse_or():
+        terms = [parse_and()]
+        while peek() == '|':
+            tokens.pop(0)
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else (lambda member: any(term(member) for term in terms))
+
+    def parse_and():
+        terms = [parse_not()]
+        while peek() == '&':
+            tokens.pop(0)
+            terms.append(parse_not())
+        return terms[0] if len(terms) == 1 else (lambda member: all(term(member) for term in terms))
+
+    def parse_not():
+        if peek() == '~':
+            tokens.pop(0)
+            term = parse_not()
+            return lambda member: not term(member)
+        return parse_atom()
+
+    def parse_atom():
+        kind, name = tokens.pop(0)
+        if kind == 'name':
+            return lambda member: member[name]
+        if kind == '(':
+            term = parse_or()
+            if tokens.pop(0)[0] != ')':
+                raise ValueError(f"Missing ')' in set expression: {expression}")
+            return term
+        raise ValueError(f"Cannot parse set expression: {expression}")
+
+    evaluate = parse_or()
+    if peek() != 'end':
+        raise ValueError(f"Cannot parse set expression: {expression}")
+    return evaluate
+
+def gtf_value(attributes, key):
+    """Return the value of key in a GTF attributes column (key "value"; ...)."""
+    begin = attributes.find(key + ' "')
+    if begin == -1:
+        return None
+    begin += len(key) + 2
+    return attributes[begin:attributes.find('"', begin)]
+
+def record_ids(record):
+    """Return (gene ID, transcript ID) of a GFF3 or GTF feature; IDs that are not given are None."""
+    attributes = record.attributes_text
+    if '=' in attributes:
+        if record.type == 'gene':
+            return record.get('ID'), None
+        if record.type in ('mRNA', 'transcript'):
+            return record.get('Parent'), record.get('ID')
+        return record.get('gene_id'), record.get('Parent')
+    if '"' in attributes:
+        return gtf_value(attributes, 'gene_id'), gtf_value(attributes, 'transcript_id')
+    # The gene and transcript lines of braker.gtf only hold the bare ID
+    if record.type == 'gene':
+        return attributes.strip(), None
+    return None, attributes.strip()
+
+class SetFilter:
+    """
+    Keep or drop transcripts by set expressions over named ID lists.
+
+    A transcript is a member of a set if its transcript ID or its gene ID is
+    listed. It is kept if all keep expressions are true and no drop
+    expression is true; a gene is kept if any of its transcripts is kept.
+    The number of transcripts is counted for every combination of set
+    memberships, like overlapStat.pl does. A gene without transcripts is
+    decided by its gene ID and is not counted.
+    """
+
+    def __init__(self, sets, keep=(), drop=()):
+        self.sets = sets
+        self.keep = [compile_expression(expression, sets) for expression in keep]
+        self.drop = [compile_expression(expression, sets) for expression in drop]
+        self.combinations = Counter()
+        self.kept = Counter()
+
+    def membership(self, gene_id, transcript_id):
+        return tuple(transcript_id in ids or gene_id in ids for ids in self.sets.values())
+
+    def is_kept(self, membership):
+        member = dict(zip(self.sets, membership))
+        return all(keep(member) for keep in self.keep) and not any(drop(member) for drop in self.drop)
+
+    def transcript_is_kept(self, gene_id, transcript_id):
+        """Decide on a transcript and count it in the report."""
+        membership = self.membership(gene_id, transcript_id)
+        kept = self.is_kept(membership)
+        self.combinations[membership] += 1
+        if kept:
+            self.kept[membership] += 1
+        return kept
+
+    def filter_records(self, records):
+        """Yield the records of kept genes and transcripts, one gene block at a time."""
+        for block in iter_gene_blocks(records):
+            block_gene_id = record_ids(block.gene)[0] if block.gene is not None else None
+            ids = []
+            decisions = {}
+            for record in block.records:
+                if not record.is_feature:
+                    ids.append(None)
+                    continue
+                gene_id, transcript_id = record_ids(record)
+                gene_id = gene_id or block_gene_id
+                ids.append((gene_id, transcript_id))
+                if transcript_id is not None and transcript_id not in decisions:
+                    decisions[transcript_id] = self.transcript_is_kept(gene_id, transcript_id)
+
+            if decisions:
+                gene_kept = any(decisions.values())
+            elif block_gene_id is not None:
+                # A gene without transcripts is decided on its own ID, but not counted as a transcript
+                gene_kept = self.is_kept(self.membership(block_gene_id, None))
+            else:
+                gene_kept = True
+
+            for record, record_id in zip(block.records, ids):
+                if record_id is None:
+                    yield record
+                elif record_id[1] is None:
+                    if gene_kept:
+                        yield record
+                elif decisions[record_id[1]]:
+                    yield record
+
+    def report(self):
+        """Return the counts per combination of set memberships as TSV lines."""
+        names = list(self.sets)
+        lines = ['\t'.join(names + ['transcripts', 'kept'])]
+        for membership in sorted(self.combinations, reverse=True):
+            lines.append('\t'.join(['1' if member else '0' for member in membership]
+                                   + [str(self.combinations[membership]), str(self.kept[membership])]))
+        lines.append('\t'.join(['total'] + [''] * (len(names) - 1)
+                               + [str(sum(self.combinations.values())), str(sum(self.kept.values()))]))
+        return '\n'.join(lines) + '\n'
+
+def parse_named_set(value):
+    name, sep, path = value.partition('=')
+    if not sep or not name or not path:
+        raise argparse.ArgumentTypeError(f"expected NAME=FILE, got '{value}'")
+    return name, path
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter genes from a gff3 file based on a list of gene names. Alternatively, keep or drop transcripts of a GFF3 or GTF file by set expressions over several named ID lists (--set, --keep, --drop).')
+    parser.add_argument('-g', '--gff3', help='GFF3 file to filter (or GTF file with --set)', required=True)
+    parser.add_argument('-l', '--list', help='List of gene names to keep')
+    parser.add_argument('-o', '--output', help='Output file name', required=True)
+    parser.add_argument('-s', '--set', action='append', type=parse_named_set, default=[], metavar='NAME=FILE', help='Named list of gene or transcript IDs, one per line (can be given several times)')
+    parser.add_argument('-k', '--keep', action='append', default=[], metavar='EXPR', help='Keep only transcripts for which this set expression is true, e.g. "good_tx" (can be given several times)')
+    parser.add_argument('-d', '--drop', action='append', default=[], metavar='EXPR', help='Drop transcripts for which this set expression is true, e.g. "single_exon & !orthofinder & no_entap" (can be given several times)')
+    parser.add_argument('-c', '--counts', help='Write the number of transcripts per combination of set memberships to this TSV file (default: print them)')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics = RunMetrics.from_args('filter_genes_from_uconn_gff3.py', args)
+
+    if args.list and args.set:
+        parser.error('-l/--list cannot be combined with --set; use --set list=FILE --keep list instead')
+    if not args.list and not args.set:
+        parser.error('either -l/--list or --set is required')
+
+    if args.list:
+        with metrics.stage('read_list', args.list):
+            tx_dict, gene_dict = read_gene_list(args.list)
+        with metrics.stage('filter', args.gff3, hot=True):
+            filter_gff3(args.gff3, args.output, tx_dict, gene_dict)
+        metrics.write()
+        return
+
+    sets = {}
+    with metrics.stage('read_sets') as stage:
+        for name, path in args.set:
+            try:
+                sets[name] = read_id_set(path)
+            except IOError:
+                parser.error(f"cannot open {path}")
+        stage['records'] = sum(len(ids) for ids in sets.values())
+    try:
+        set_filter = SetFilter(sets, args.keep, args.drop)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with metrics.stage('filter', args.gff3, hot=True):
+        with xopen(args.gff3, 'r') as infile, xopen(args.output, 'w') as outfile:
+            for record in set_filter.filter_records(read_gff3(infile)):
+                outfile.write(record.raw)
+
+    if args.counts:
+        with open(args.counts, 'w') as counts_file:
+            counts_file.write(set_filter.report())
+    else:
+        sys.stdout.write(set_filter.report())
+    metrics.write()
 
-parser = argparse.ArgumentParser(description='Filter genes from a gff3 file based on a list of gene names')
-parser.add_argument('-g', '--gff3', help='GFF3 file to filter', required=True)
-parser.add_argument('-l', '--list', help='List of gene names to keep', required=True)
-parser.add_argument('-o', '--output', help='Output file name', required=True)
-args = parser.parse_args()
-
-# open list file, chop trailing newline, store as key in dict (tx_dict), then split by dot and store first value in gene_dict
-gene_dict = {}
-tx_dict = {}
-try:
-    with open(args.list, 'r') as list_file:
-        for line in list_file:
-            tx_dict[line.rstrip()] = 1
-            gene_dict[line.split('.')[0]] = 1
-except IOError:
-    print('Cannot open', args.list)
-
-# open output file with try/except
-try:
-    with open(args.output, 'w') as output_file:
-        try:
-            with open(args.gff3, 'r') as gff3_file:
-                for line in gff3_file:
-                    if line.startswith('#'):
-                        output_file.write(line)
-                        continue
-                    line = line.rstrip()
-                    fields = line.split('\t')
-                    if fields[2] == 'gene':
-                        # last column has this format: ID=g1;Dbxref=GeneID:7204623;gene_biotype=protein_coding
-                        # extract the value between ID= and ;
-                        # Last column has format: ID=g1;Dbxref=GeneID:7204623;gene_biotype=protein_coding
-                        attributes = fields[8]  # Last column is fields[8]
-                        # Extract ID between ID= and ;
-                        gene_id = None
-                        for attribute in attributes.split(';'):
-                            if attribute.startswith('ID='):
-                                gene_id = attribute.split('=')[1]
-                                break
-                        if gene_id in gene_dict:
-                            output_file.write(line + '\n')
-                    elif fields[2] == 'mRNA':
-                        # last column has this format: ID=g1.t1;Parent=g1;Dbxref=GeneID:7204623,PFAM:PF04055;product=hypothetical protein;note=EggNOG:Radical SAM superfamily
-                        # extract the value between ID= and ;
-                        attributes = fields[8]  # Last column is fields[8]
-                        # Extract ID between ID= and ;
-                        tx_id = None
-                        for attribute in attributes.split(';'):
-                            if attribute.startswith('ID='):
-                                tx_id = attribute.split('=')[1]
-                                break
-                        if gene_id in tx_dict:
-                            output_file.write(line + '\n')
-                    elif fields[2] == 'exon' or fields[2] == 'CDS' or fields[2] == 'start_codon' or fields[2] == 'stop_codon' or fields[2] == 'intron' or fields[2] == 'five_prime_UTR' or fields[2] == 'three_prime_UTR':
-                        # last colun has this format: ID=agat-cds-1;Parent=g1.t1;gene_id=g1;transcript_id=g1.t1;Dbxref=GeneID:7204623,PFAM:PF04055;product=hypothetical protein;note=EggNOG:Radical SAM superfamily
-                        # extract the value between Parent= and ;
-                        attributes = fields[8]
-                        tx_id = None
-                        for attribute in attributes.split(';'):
-                            if attribute.startswith('Parent='):
-                                tx_id = attribute.split('=')[1]
-                                break
-                        if tx_id in tx_dict:
-                            output_file.write(line + '\n')
-                    else:
-                        print("Skipping line: ", line)
-        except IOError:
-            print('Cannot open', args.gff3)
-except IOError:
-    print('Cannot open', args.output)
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,417 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import json
+import time
+import queue
+import random
+import sqlite3
+import asyncio
+import hashlib
 import argparse
-import requests
+import http.client
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from gff3_records import read_gff3
+from compressed_io import xopen
 
 # Note: LLAMA does a very poor job on this, GPT-4o is much better. You have to buy credit and generate a token.
-def message_llm (message_user,                 
+MODEL_SOURCES = {
+    'GPT': ("https://api.openai.com/v1/chat/completions", "gpt-4o-mini"),
+    'LLAMA': ("https://apphubai.wolke.uni-greifswald.de/v1/chat/completions", 'gpt-3.5-turbo'),
+}
+
+SYSTEM_MESSAGE = "You are a professional English linguist and a biochemist specialized on protein names. You will find all product names in a numbered list that contain nouns in plural or repetitions of words. You know that subunit or complex are not indicators for plural. Your responses will not contain arguments why plurals are contained. You simply return a JSON object {\"suspicious\": [...]} with the numbers of the suspicious product names, or an empty list if there are none. Here are examples of terms that do not contain plurals: 20 kDA chaperonin chloroplastic, 20S proteasome subunit, acyltransferase. You will not return the numbers of unsuspicious product names."
+
+# HTTP status codes after which a request is retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Features whose product name is counted once per transcript; other features (CDS, exon) count for their parent transcript
+TRANSCRIPT_TYPES = {'mRNA', 'transcript'}
+
+# Rough number of characters per token of English text, used to size the batches
+CHARS_PER_TOKEN = 4
+
+def species_label(path):
+    """Species of a GFF3 file: the file name without .gff3/.gff (and .gz)."""
+    name = os.path.basename(path)
+    for extension in ('.gz', '.gff3', '.gff'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
+def count_product_names(gff_file):
+    """Count the transcripts of every product name in a GFF3 file (mRNA and CDS lines of one transcript count once)."""
+    counts = Counter()
+    counted = set()
+    with xopen(gff_file, 'r') as gff:
+        for record in read_gff3(gff):
+            if not record.is_feature:
+                continue
+            product = record.get('product')
+            if not product:
+                continue
+            transcript = record.get('ID') if record.type in TRANSCRIPT_TYPES else record.get('Parent')
+            if transcript is not None:
+                if transcript in counted:
+                    continue
+                counted.add(transcript)
+            counts[product] += 1
+    return counts
+
+def extract_product_names(gff_files):
+    """
+    Collect the distinct product names of several GFF3 files.
+
+    Returns a dict name -> {species: number of transcripts}, in the order in
+    which the names were first seen, and the list of species.
+    """
+    names = {}
+    species_list = []
+    for gff_file in gff_files:
+        species = species_label(gff_file)
+        if species in species_list:
+            species = gff_file
+        species_list.append(species)
+        for name, count in count_product_names(gff_file).items():
+            names.setdefault(name, {})[species] = count
+    return names, species_list
+
+def write_name_table(path, names, species_list):
+    """Write one line per product name with its total number of transcripts and the number per species."""
+    with xopen(path, 'w') as table:
+        table.write('\t'.join(['product_name', 'total'] + species_list) + '\n')
+        for name, counts in names.items():
+            row = [name, str(sum(counts.values()))] + [str(counts.get(species, 0)) for species in species_list]
+            table.write('\t'.join(row) + '\n')
+
+def prompt_hash(message_system):
+    return hashlib.sha256(message_system.encode()).hexdigest()
+
+class VerdictCache:
+    """
+    Verdicts of the LLM on product names, stored in an SQLite file.
+
+    A verdict is kept per (name, URL of the server, model, hash of the
+    system prompt), so a re-run or a newly added species only sends names
+    that were never screened with this server, model and prompt; the same
+    model name on another server does not share verdicts. Without a path,
+    nothing is cached.
+    """
+
+    def __init__(self, path, url, model, message_system=SYSTEM_MESSAGE):
+        self.url = url
+        self.model = model
+        self.prompt_hash = prompt_hash(message_system)
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=60)
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(verdicts)")]
+            if columns and 'url' not in columns:
+                # Verdicts of older versions do not record the server they came from
+                self.db.execute("DROP TABLE verdicts")
+            self.db.execute("CREATE TABLE IF NOT EXISTS verdicts (name TEXT, url TEXT, model TEXT, prompt_hash TEXT, suspicious INTEGER, "
+                            "PRIMARY KEY (name, url, model, prompt_hash))")
+            self.db.commit()
+
+    def lookup(self):
+        """Return a dict name -> suspicious (bool) of all names screened with this server, model and prompt."""
+        if self.db is None:
+            return {}
+        rows = self.db.execute("SELECT name, suspicious FROM verdicts WHERE url = ? AND model = ? AND prompt_hash = ?",
+                               (self.url, self.model, self.prompt_hash))
+        return {name: bool(suspicious) for name, suspicious in rows}
+
+    def store(self, verdicts):
+        """Store a dict name -> suspicious."""
+        if self.db is None:
+            return
+        self.db.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                            ((name, self.url, self.model, self.prompt_hash, int(suspicious)) for name, suspicious in verdicts.items()))
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def numbered_item(number, name):
+    return f"{number}. {name}\n"
+
+def token_batches(names, max_tokens, max_names):
+    """Split names into batches of at most max_tokens (estimated, as numbered items) and max_names names."""
+    batches = []
+    batch = []
+    tokens = 0
+    for name in names:
+        item_tokens = estimate_tokens(numbered_item(len(batch) + 1, name))
+        if batch and (tokens + item_tokens > max_tokens or len(batch) >= max_names):
+            batches.append(batch)
+            batch = []
+            tokens = 0
+            item_tokens = estimate_tokens(numbered_item(1, name))
+        batch.append(name)
+        tokens += item_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def batch_message(batch):
+    return "Product names:\n" + ''.join(numbered_item(number, name) for number, name in enumerate(batch, 1))
+
+class FlaggedWriter:
+    """Writes every suspicious name once, as soon as it is known."""
+
+    def __init__(self, output):
+        self.output = output
+        self.written = set()
+
+    def write(self, name):
+        if name not in self.written:
+            self.written.add(name)
+            self.output.write(name + '\n')
+            self.output.flush()
+
+class BatchReply:
+    """
+    Checks the reply to one batch.
+
+    The whole reply must be valid JSON; otherwise finish() raises ValueError
+    and the batch is requested again. The names are only written once
+    finish() has accepted the reply, so a rejected or broken attempt leaves
+    nothing in the output that the verdict cache does not hold.
+    """
+
+    def __init__(self, batch, writer):
+        self.batch = batch
+        self.writer = writer
+
+    def finish(self, content):
+        """Write and return the set of suspicious names of the batch; content is the whole reply."""
+        content = content.strip()
+        if content.startswith('```'):
+            content = content.strip('`').removeprefix('json')
+        numbers = json.loads(content)['suspicious']
+        if not isinstance(numbers, list) or not all(isinstance(number, int) for number in numbers):
+            raise ValueError(f"not a list of item numbers: {numbers!r}")
+        flagged = [self.batch[number - 1] for number in numbers if 1 <= number <= len(self.batch)]
+        for name in flagged:
+            self.writer.write(name)
+        return set(flagged)
+
+class LLMRequestError(Exception):
+    """A request to the LLM failed and will not be retried (any more)."""
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one URL, shared by the worker threads.
+
+    A connection is taken out of the pool for a request and put back when the
+    server keeps it open, so the TCP/TLS handshake is not repeated for every
+    request.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def post(self, body, headers, read=None):
+        """
+        Send a POST request; returns (status, Retry-After header, response body).
+        The body of a 200 response is read with read(response) if given.
+        """
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request('POST', self.path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = read(response) if read and response.status == 200 else response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.idle.put(connection)
+        return response.status, response.getheader('Retry-After'), data
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+class RateLimiter:
+    """Spread requests evenly so that no more than requests_per_minute are started per minute (None: no limit)."""
+
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class LLMClient:
+    """
+    Asynchronous client for an OpenAI-compatible chat completions endpoint.
+
+    At most concurrency requests are in flight at the same time, and no more
+    than requests_per_minute are started per minute. Requests that fail with
+    429 or 5xx, or on the connection, are retried up to retries times with
+    exponential backoff (or after the time the server asks for in Retry-After).
+    With stream, replies are received as server-sent events, so data keeps
+    arriving while a long reply is generated and the timeout, which applies
+    to every read, is not reached.
+    """
+
+    def __init__(self, url, model, api_key='', concurrency=4, requests_per_minute=None, retries=5, timeout=300, backoff=2.0, stream=False):
+        self.url = url
+        self.model = model
+        self.stream = stream
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(url, timeout)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+    def retry_delay(self, attempt, retry_after):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def read_events(response):
+        """Read a streamed reply; returns the whole content."""
+        content = []
+        for line in response:
+            line = line.strip()
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                continue
+            delta = json.loads(payload)['choices'][0]['delta'].get('content')
+            if delta:
+                content.append(delta)
+        return ''.join(content).encode()
+
+    async def chat(self, message_user, message_system=SYSTEM_MESSAGE, reply=None):
+        """
+        Send one conversation and return the content of the reply.
+
+        If a reply checker (BatchReply) is given, a JSON object is requested
+        and the result of reply.finish() is returned. A reply it rejects is
+        requested again.
+        """
+        data = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": message_system
+                },
+                {
+                    "role": "user",
+                    "content": message_user
+                }
+            ]
+        }
+        if reply is not None:
+            data["response_format"] = {"type": "json_object"}
+        if self.stream:
+            data["stream"] = True
+        body = json.dumps(data).encode()
+        loop = asyncio.get_running_loop()
+        read = self.read_events if self.stream else None
+        for attempt in range(self.retries + 1):
+            async with self.semaphore:
+                await self.rate_limiter.wait()
+                try:
+                    status, retry_after, response = await loop.run_in_executor(self.executor, self.pool.post, body, self.headers(), read)
+                except (OSError, http.client.HTTPException, ValueError, KeyError, IndexError, TypeError) as e:
+                    status, retry_after, response = None, None, f"{type(e).__name__}: {e}".encode()
+            if status == 200:
+                try:
+                    content = response.decode() if self.stream else json.loads(response)['choices'][0]['message']['content']
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    # Truncated body or error page of a proxy: retried like a connection error
+                    status, retry_after, response = None, None, f"unexpected response ({type(e).__name__}): {response[:200].decode(errors='replace')}".encode()
+            if status == 200:
+                if reply is None:
+                    return content
+                try:
+                    return reply.finish(content)
+                except (ValueError, KeyError, TypeError) as e:
+                    # Invalid reply: retried like a failed request
+                    status, retry_after, response = None, None, f"invalid reply ({e}): {content[:200]}".encode()
+            if status is not None and status not in RETRY_STATUS:
+                raise LLMRequestError(f"Request failed with status code {status}: {response.decode(errors='replace')}")
+            if attempt == self.retries:
+                break
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+        reason = f"status code {status}" if status is not None else "connection error or invalid reply"
+        raise LLMRequestError(f"Request failed with {reason} after {self.retries} retries: {response.decode(errors='replace')}")
+
+    async def chat_all(self, messages, message_system=SYSTEM_MESSAGE, replies=None):
+        """
+        Send all messages concurrently; returns the replies (or the results
+        of the reply checkers) in the order of the messages. A message that
+        failed gives its LLMRequestError instead of a reply.
+        """
+        replies = replies or [None] * len(messages)
+        tasks = [self.chat(message, message_system, reply) for message, reply in zip(messages, replies)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pool.close()
+
+def model_endpoint(model_source):
+    if model_source not in MODEL_SOURCES:
+        raise ValueError(f'Variable {model_source=} must either be "GPT" or "LLAMA"')
+    return MODEL_SOURCES[model_source]
+
+async def query_llm(messages, url, model, api_key='', message_system=SYSTEM_MESSAGE, replies=None, **client_options):
+    client = LLMClient(url, model, api_key, **client_options)
+    try:
+        return await client.chat_all(messages, message_system, replies)
+    finally:
+        client.close()
+
+def message_llm (message_user,
                 model_source = 'GPT',
-                message_system="You are a professional English linguist and a biochemist specialized on protein names. You will return an exhaustive list of product names that contain nouns in plural or repetitions of words. You know that subunit or complex are not indicators for plural. Your responses will not contain enumerations or arguments why plurals are contains. You simply return a newline-separated list of product names. Here are examples of terms that do not contain plurals: 20 kDA chaperonin chloroplastic, 20S proteasome subunit, acyltransferase. You will not return unsuspicious product names.",
+                message_system=SYSTEM_MESSAGE,
                 api_key = '', # insert token
                ):
     """
@@ -15,24 +420,26 @@ def message_llm (message_user,
 
     Sends a message to a Language Model (LLM) via an API and retrieves the response.
 
-    This function supports communication with either the GPT3.5 Turbo or the 
-    LLAMA model from University Greifswald, depending on the specified `model_source`. 
+    This function supports communication with either the GPT-4o mini or the
+    LLAMA model from University Greifswald, depending on the specified `model_source`.
+    It sends a single message through LLMClient; use query_llm() to send many
+    messages concurrently.
 
     Parameters:
     -----------
     message_user : str
         The message content from the user that will be sent to the LLM.
-    
+
     model_source : str, optional
-        The source model to use for the request, either 'GPT' or 'LLAMA'. 
-        Default is 'LLAMA'.
-    
+        The source model to use for the request, either 'GPT' or 'LLAMA'.
+        Default is 'GPT'.
+
     message_system : str, optional
         The system message to set the context for the conversation with the LLM.
-        Default is "You are a matchmaker for scientists.".
-    
+        Default is SYSTEM_MESSAGE.
+
     api_key : str, optional
-        The API key used for authentication when making the request. 
+        The API key used for authentication when making the request.
         Default is an empty string, which requires the user to provide a valid API key.
 
     Raises:
@@ -40,87 +447,122 @@ def message_llm (message_user,
     ValueError
         If the `model_source` is not 'GPT' or 'LLAMA'.
     """
-    
-    if model_source == 'GPT':
-        url = "https://api.openai.com/v1/chat/completions"
-        model = "gpt-4o-mini"
-    elif model_source == 'LLAMA':    
-        url = "https://apphubai.wolke.uni-greifswald.de/v1/chat/completions"
-        model = 'gpt-3.5-turbo'
-    else:
-        raise ValueError(f'Variable {model_source=} must either be "GPT" or "LLAMA"')
-
-    # Define the headers
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-
-    data = {
-        "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": message_system
-            },
-            {
-                "role": "user",
-                "content": message_user
-            }
-        ]
-    }
-
-    # Send the POST request
-    response = requests.post(url, headers=headers, json=data)
-    llm_response =''
-    # Check if the request was successful
-    if response.status_code == 200:
-        response_data = response.json()
-        # Print the response content
-        llm_response = response_data['choices'][0]['message']['content']
+    url, model = model_endpoint(model_source)
+    llm_response = asyncio.run(query_llm([message_user], url, model, api_key, message_system))[0]
+    if isinstance(llm_response, LLMRequestError):
         print(llm_response)
-        print("I delivered!")
-    else:
-        print(f"Request failed with status code {response.status_code}: {response.text}")
-
+        return ''
     return llm_response
 
+async def screen_batches(client, batches, writer, cache, failed_output=None):
+    """
+    Screen all batches concurrently. Suspicious names are written as they
+    arrive, and the verdicts of a batch are stored as soon as it is
+    complete. The names of a batch that failed after all retries are written
+    to failed_output. Returns the number of failed batches.
+    """
+    async def screen(batch):
+        try:
+            flagged = await client.chat(batch_message(batch), SYSTEM_MESSAGE, BatchReply(batch, writer))
+        except LLMRequestError as e:
+            print(e, file=sys.stderr)
+            if failed_output:
+                failed_output.writelines(name + '\n' for name in batch)
+            return False
+        cache.store({name: name in flagged for name in batch})
+        return True
+
+    try:
+        done = await asyncio.gather(*(screen(batch) for batch in batches))
+    finally:
+        client.close()
+    return done.count(False)
+
 def main():
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser(description='Query LLM to identify product names that contain plurals or repetitions of words. LLAMA only works with active VPN connection. Note that LLAMA performs very poorly. gpt4o-mini overcalls plurals, but it is feasible to through the output.')
 
-    # Add the input file argument
-    parser.add_argument('--input', '-i', type=str, required=True,
+    # Add the input file arguments
+    parser.add_argument('--input', '-i', type=str,
                         help='Path to the input text file with one product name per line.')
+    parser.add_argument('--gff3', '-g', nargs='+', default=[],
+                        help='GFF3 files (one per species) to take the distinct product names from')
+    parser.add_argument('--cache', '-c',
+                        help='SQLite file to keep the verdicts across runs and species, per server URL, model and system prompt (created if missing)')
+    parser.add_argument('--names-table',
+                        help='Write the distinct product names with their number of transcripts per species (from --gff3) to this TSV file')
+    parser.add_argument('--output', '-o',
+                        help='Write the suspicious product names to this file (default: print them)')
+    parser.add_argument('--model-source', choices=MODEL_SOURCES, default='GPT',
+                        help='LLM to query (default: GPT)')
+    parser.add_argument('--url', help='Chat completions URL of another OpenAI-compatible server (overrides the URL of --model-source)')
+    parser.add_argument('--model', help='Model name (overrides the model of --model-source)')
+    parser.add_argument('--api-key', default=os.environ.get('OPENAI_API_KEY', ''),
+                        help='API key (default: $OPENAI_API_KEY)')
+    parser.add_argument('--failed',
+                        help='Write the names of batches that failed after all retries to this file (can be screened again with -i)')
+    parser.add_argument('--batch-tokens', type=int, default=4000,
+                        help='Estimated number of tokens of the product names of a request (default: 4000)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Maximum number of product names per request (default: 1000)')
+    parser.add_argument('--no-stream', dest='stream', action='store_false',
+                        help='Receive every reply in one piece, for servers that do not support streaming')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of requests in flight at the same time (default: 4)')
+    parser.add_argument('--rpm', type=int, help='Maximum number of requests started per minute (default: no limit)')
+    parser.add_argument('--retries', type=int, default=5,
+                        help='Number of retries of a request that failed with 429, 5xx or a connection error (default: 5)')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='Timeout of a request in seconds (default: 300)')
 
     # Parse the arguments
     args = parser.parse_args()
+    if not args.input and not args.gff3:
+        parser.error('give product names with --input and/or --gff3')
+
+    url, model = model_endpoint(args.model_source)
+    url, model = args.url or url, args.model or model
+
+    # Distinct product names in the order in which they were first seen
+    names, species_list = extract_product_names(args.gff3)
+    if args.names_table:
+        write_name_table(args.names_table, names, species_list)
+    product_names = list(names)
+    if args.input:
+        with xopen(args.input, 'r') as file:
+            product_names.extend(name.strip() for name in file)
+    product_names = [name for name in dict.fromkeys(product_names) if name]
+
+    # Only names without a verdict for this server, model and prompt are sent
+    cache = VerdictCache(args.cache, url, model)
+    verdicts = cache.lookup()
+    new_names = [name for name in product_names if name not in verdicts]
+    print(f"{len(product_names)} distinct product names from {len(species_list)} GFF3 files{' and ' + args.input if args.input else ''}, "
+          f"{len(product_names) - len(new_names)} with a cached verdict, {len(new_names)} to screen.", file=sys.stderr)
+
+    # Suspicious names with a cached verdict are written first, new ones as they arrive
+    output = xopen(args.output, 'w') if args.output else sys.stdout
+    writer = FlaggedWriter(output)
+    for name in product_names:
+        if verdicts.get(name):
+            writer.write(name)
 
-    # Get the input file path
-    input_file = args.input
-
-    # Process the input file (placeholder for the actual functionality)
-    with open(input_file, 'r') as file:
-        product_names = file.readlines()
-        # remove newline characters
-        product_names = [name.strip() for name in product_names]
-    
-    # Particion product names in batches
-    nproducts = 5000
-    product_names = [', '.join(product_names[i:i+nproducts]) for i in range(0, len(product_names), nproducts)]
-
-    # Placeholder: Code to query LLAMA at the University of Greifswald
-    for product in product_names:
-        product = product.strip()
-        #print("Trying to send query to LLM.")
-        response = message_llm(product)
-        print(response)
-        # ask for pressing enter to continue
-        #input("Press Enter to continue...")
-        #print("Continuing...")
-    print("Finished processing all product names.")
+    # Numbered product names in batches of an estimated number of tokens
+    batches = token_batches(new_names, args.batch_tokens, args.batch_size)
 
+    # All batches are sent concurrently; the verdicts of a batch are only stored if its request succeeded
+    start = time.perf_counter()
+    client = LLMClient(url, model, args.api_key, concurrency=args.concurrency, requests_per_minute=args.rpm,
+                       retries=args.retries, timeout=args.timeout, stream=args.stream)
+    failed_output = xopen(args.failed, 'w') if args.failed else None
+    failed = asyncio.run(screen_batches(client, batches, writer, cache, failed_output))
+    cache.close()
+    if failed_output:
+        failed_output.close()
+    if args.output:
+        output.close()
+    print(f"Finished processing all product names ({len(batches)} batches, {failed} failed, {time.perf_counter() - start:.1f} s). "
+          f"{len(writer.written)} suspicious product names.", file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -1,101 +1,145 @@
 #!/usr/bin/env python3
 
-import re
 import argparse
 from collections import defaultdict
+from gff3_records import GFF3Record, decode_records, line_spans, read_blocks, open_shard, map_shards
+from compressed_io import xopen
+from run_metrics import RunMetrics, add_metrics_arguments
 
-def parse_attributes(attributes_str):
-    """Parse the attributes column of a GFF3 line into a dictionary."""
-    attributes = {}
-    for attribute in attributes_str.split(";"):
-        if "=" in attribute:
-            key, value = attribute.split("=")
-            attributes[key] = value
-    return attributes
+def collect_gene_dbxrefs(records):
+    """Collect the GeneID Dbxrefs of CDS records per gene_id, as comma-separated strings."""
+    gene_id_to_geneid = defaultdict(list)  # Dict to store gene_id -> list of GeneID:...
 
-def attributes_to_str(attributes):
-    """Convert the attribute dictionary back to a GFF3 string."""
-    return ";".join([f"{key}={value}" for key, value in attributes.items()])
+    # Step 1 (a): Parse the records to collect GeneIDs from CDS lines
+    for record in records:
+        if not record.is_feature:
+            continue  # Skip comments and malformed lines
 
-def process_gff3(input_file, output_file):
-    gene_id_to_geneid = defaultdict(list)  # Dict to store gene_id -> list of GeneID:...
-    
-    # Step 1 (a): Parse the input file to collect GeneIDs from CDS lines
-    with open(input_file, 'r') as infile:
-        for line in infile:
-            if line.startswith("#"):
-                continue  # Skip comments
-
-            fields = line.strip().split('\t')
-            if len(fields) != 9:
-                continue  # Skip malformed lines
-
-            feature_type = fields[2]
-            if feature_type == "CDS":
-                attributes = parse_attributes(fields[8])
+        if record.type == "CDS":
+            # Extract Dbxref and gene_id
+            dbxref_value = record.get("Dbxref")
+            gene_id = record.get("gene_id")
+            if dbxref_value is not None and gene_id is not None:
+                dbxrefs = dbxref_value.split(",")
                 
-                # Extract Dbxref and gene_id
-                if "Dbxref" in attributes and "gene_id" in attributes:
-                    dbxrefs = attributes["Dbxref"].split(",")
-                    gene_id = attributes["gene_id"]
-                    
-                    # Filter only GeneID entries and add to dict
-                    for dbxref in dbxrefs:
-                        if dbxref.startswith("GeneID:"):
-                            if dbxref not in gene_id_to_geneid[gene_id]:
-                                gene_id_to_geneid[gene_id].append(dbxref)
+                # Filter only GeneID entries and add to dict
+                for dbxref in dbxrefs:
+                    if dbxref.startswith("GeneID:"):
+                        if dbxref not in gene_id_to_geneid[gene_id]:
+                            gene_id_to_geneid[gene_id].append(dbxref)
 
     # Step 2 (b): Ensure lists in the dict are unique and convert to comma-separated strings
     for gene_id, geneid_list in gene_id_to_geneid.items():
         gene_id_to_geneid[gene_id] = ",".join(sorted(set(geneid_list)))  # Remove duplicates and sort
+    return gene_id_to_geneid
 
-    # Step 3 (c): Re-read the input file and modify gene feature lines
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            if line.startswith("#"):
-                outfile.write(line)  # Write comments as is
-                continue
+def fix_gene_dbxref_records(records, gene_id_to_geneid):
+    """Yield the records with the Dbxref of gene lines replaced by the collected GeneIDs."""
+    # Step 3 (c): Modify gene feature lines
+    for record in records:
+        if not record.is_feature:
+            yield record  # Write comments and malformed lines as is
+            continue
 
-            fields = line.strip().split('\t')
-            if len(fields) != 9:
-                outfile.write(line)  # Write malformed lines as is
-                continue
-
-            feature_type = fields[2]
-            attributes = parse_attributes(fields[8])
+        if record.type == "gene":
+            gene_id = record.get("ID")
             
-            if feature_type == "gene":
-                gene_id = attributes.get("ID")
+            # If the gene_id has corresponding GeneID entries
+            if gene_id in gene_id_to_geneid and gene_id_to_geneid[gene_id].strip(","):
+                # Update existing Dbxref or add a new one
+                record.set("Dbxref", gene_id_to_geneid[gene_id])
                 
-                # If the gene_id has corresponding GeneID entries
-                if gene_id in gene_id_to_geneid and gene_id_to_geneid[gene_id].strip(","):
-                    dbxref_value = gene_id_to_geneid[gene_id]
-                    
-                    if "Dbxref" in attributes:
-                        # Update existing Dbxref
-                        attributes["Dbxref"] = dbxref_value
-                    else:
-                        # Add new Dbxref
-                        attributes["Dbxref"] = dbxref_value
-                    
-                    # Write the updated gene feature line
-                    fields[8] = attributes_to_str(attributes)
-                    outfile.write("\t".join(fields) + "\n")
-                else:
-                    # Write the gene feature line as is if no GeneID found
-                    outfile.write(line)
+                # Write the updated gene feature line
+                yield GFF3Record.from_fields(record.fields)
             else:
-                # Write non-gene lines as is
-                outfile.write(line)
+                # Write the gene feature line as is if no GeneID found
+                yield record
+        else:
+            # Write non-gene lines as is
+            yield record
+
+def cds_dbxref_records(blocks):
+    """
+    Yield the GFF3Records of the lines of blocks (bytes, see read_blocks())
+    that can hold a GeneID Dbxref of a CDS; all other lines are not decoded.
+    """
+    for block in blocks:
+        for start, end in line_spans(block, b"\tCDS\t"):
+            line = block[start:end]
+            if b"GeneID:" in line:
+                yield from decode_records(line)
+
+def fix_gene_dbxref_blocks(blocks, gene_id_to_geneid):
+    """
+    Yield the output of fix_gene_dbxref_records() for blocks of GFF3 lines
+    (bytes, see read_blocks()), as bytes.
+
+    Only the lines that contain a gene type column are decoded; the data
+    between them is passed on as memoryview slices of the block. A block
+    with a '\r' is decoded as a whole, as text mode ends lines there, too.
+    """
+    for block in blocks:
+        if b"\r" in block:
+            for record in fix_gene_dbxref_records(decode_records(block), gene_id_to_geneid):
+                yield record.raw.encode()
+            continue
+        view = memoryview(block)
+        position = 0
+        for start, end in line_spans(block, b"\tgene\t"):
+            yield view[position:start]
+            for record in fix_gene_dbxref_records(decode_records(block[start:end]), gene_id_to_geneid):
+                yield record.raw.encode()
+            position = end
+        yield view[position:]
+
+def merge_gene_dbxrefs(gene_id_to_geneid, shard_gene_id_to_geneid):
+    """Add the GeneIDs collected from one shard to gene_id_to_geneid."""
+    for gene_id, geneids in shard_gene_id_to_geneid.items():
+        if gene_id in gene_id_to_geneid:
+            geneids = ",".join(sorted(set(gene_id_to_geneid[gene_id].split(",")) | set(geneids.split(","))))
+        gene_id_to_geneid[gene_id] = geneids
+
+# GeneIDs of all genes, set before the worker processes of the second pass are forked
+shared_gene_id_to_geneid = {}
+
+def collect_gene_dbxrefs_shard(path, start, end):
+    return dict(collect_gene_dbxrefs(cds_dbxref_records(read_blocks(open_shard(path, start, end)))))
+
+def fix_gene_dbxref_shard(path, start, end):
+    return b''.join(fix_gene_dbxref_blocks(read_blocks(open_shard(path, start, end)), shared_gene_id_to_geneid))
+
+def process_gff3(input_file, output_file, jobs=1):
+    if jobs > 1:
+        # Both passes run on shards; the GeneIDs are merged in between, so genes
+        # whose CDS lines end up in another shard are handled as well
+        shared_gene_id_to_geneid.clear()
+        for shard_gene_id_to_geneid in map_shards(collect_gene_dbxrefs_shard, input_file, jobs):
+            merge_gene_dbxrefs(shared_gene_id_to_geneid, shard_gene_id_to_geneid)
+        with xopen(output_file, 'wb') as outfile:
+            for text in map_shards(fix_gene_dbxref_shard, input_file, jobs):
+                outfile.write(text)
+        return
+
+    with xopen(input_file, 'rb') as infile:
+        gene_id_to_geneid = collect_gene_dbxrefs(cds_dbxref_records(read_blocks(infile)))
+
+    # Re-read the input file and modify gene feature lines
+    with xopen(input_file, 'rb') as infile, xopen(output_file, 'wb') as outfile:
+        outfile.writelines(fix_gene_dbxref_blocks(read_blocks(infile), gene_id_to_geneid))
 
 def main():
     parser = argparse.ArgumentParser(description="Fix the Dbxref= field in GFF3 gene models using CDS feature data.")
     parser.add_argument('-i', '--input', required=True, help='Input GFF3 file')
     parser.add_argument('-o', '--output', required=True, help='Output GFF3 file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes; the input is split at gene lines and the output is the same as with one process (default: 1)')
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
+    metrics = RunMetrics.from_args('fix_Dbxref_attributes_in_genes.py', args)
 
-    process_gff3(args.input, args.output)
+    with metrics.stage('fix_gene_dbxrefs', args.input, hot=True):
+        process_gff3(args.input, args.output, args.jobs)
+    metrics.write()
 
 if __name__ == "__main__":
     main()
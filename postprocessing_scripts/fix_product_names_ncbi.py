@@ -1,227 +1,417 @@
 #!/usr/bin/env python3
 
 import re
+import hashlib
+import inspect
+import sqlite3
 import argparse
-
-def fix_product_name(product_name):
+from collections import namedtuple
+from gff3_records import GFF3Record, attribute_bytes, read_plain_features, open_shard, map_shards
+from compressed_io import xopen
+from run_metrics import RunMetrics, add_metrics_arguments
+
+# One substitution rule: re.sub(pattern, replacement, text, flags=flags).
+# scope is 'product' for rules applied to the product name by fix_product_name()
+# and 'attributes' for rules applied to the whole attributes column of every
+# feature line. If only_if (or unless) is set, the rule is only applied if that
+# pattern is found (or not found) in the text at this point; only_if also serves
+# as a cheap pre-check for patterns that are slow to search.
+# Rules are applied in table order.
+Rule = namedtuple('Rule', ['pattern', 'replacement', 'flags', 'scope', 'only_if', 'unless'], defaults=(0, 'product', None, None))
+
+def shorten_product_name(match):
+    # Find the last space before the 100th character and cut the name there
+    product_name = match.group(0)
+    last_space = product_name[:100].rfind(' ')
+    return product_name[:last_space].rstrip()
+
+def title_if_upper(match):
+    product_name = match.group(0)
+    return product_name.title() if product_name.isupper() else product_name
+
+# Plural forms that are made singular in a single pass
+PLURALS = {
+    'ases': 'ase',
+    'proteins': 'protein',
+    'units': 'unit',
+    'ac-diamides': 'ac-diamide',
+    'chaperonins': 'chaperonin',
+    'complexes': 'complex',
+    'condensins': 'condensin',
+    'copines': 'copine',
+    'biotransformers': 'biotransformer',
+    'enzymes': 'enzyme',
+    'cyclins': 'cyclin',
+    'cylophilins': 'cylophilin',
+    'channels': 'channel',
+    'mutants': 'mutant',
+    'receptors': 'receptor',
+    'retroposons': 'retroposon',
+    'factors': 'factor',
+    'members': 'member',
+    'antigens': 'antigen',
+}
+
+def singular(match):
+    return PLURALS[match.group(0)]
+
+PRODUCT_NAME_RULES = [
     # Fix uncharacterized protein
-    if product_name.startswith("uncharacterized protein"):
-        product_name = "putative protein"
-    import re
-
-    # Check if 'putative' is the last word
-    if re.search(r'\bputative\b\s*$', product_name, flags=re.IGNORECASE):
-        #print("Trying to move putative in ", product_name)
-        # Remove 'putative' from the end and strip any extra spaces
-        product_name = re.sub(r'\bputative\b\s*$', '', product_name, flags=re.IGNORECASE).strip()
-        # Add 'putative' to the front
-        product_name = 'putative ' + product_name
-        #print(product_name)
-
-    
+    Rule(r'^uncharacterized protein.*', 'putative protein', re.DOTALL),
+    # If 'putative' is the last word, move it to the front
+    Rule(r'\A\s*(.*?)\s*\bputative\b\s*\Z', r'putative \1', re.IGNORECASE | re.DOTALL, only_if=r'(?i)putative'),
     # if a product name ends in uncharacterised, remove that
-    product_name = re.sub(r'\buncharacterised\b\s*$', '', product_name, flags=re.IGNORECASE)
-    # remove trailing whitespace
-    product_name = product_name.strip()
-
-    # Fix hypothetical protein only if followed by additional text, keeping the rest of the text
-    if product_name.startswith("hypothetical protein\s"):
-        product_name = product_name.replace("hypothetical protein", "putative protein", 1)
-    
+    Rule(r'\buncharacterised\b\s*$', '', re.IGNORECASE),
+    # remove leading/trailing whitespace
+    Rule(r'\A\s+|\s+\Z', ''),
+    # Fix hypothetical protein only if followed by additional text (literal '\s', as in the original rule)
+    Rule(r'^hypothetical protein\\s', r'putative protein\\s'),
     # Fix proteins protein
-    product_name = re.sub(r'proteins protein', 'protein', product_name)
-
+    Rule(r'proteins protein', 'protein'),
     # Fix plural forms (simple heuristic)
-    product_name = re.sub(r'proteins', 'protein', product_name)
-
+    Rule(r'proteins', 'protein'),
     # Remove suspicious phrases
-    product_name = re.sub(r'truncat(ed|ion)?', '', product_name)
-    product_name = re.sub(r'Truncated ', r'Nonfunctional ', product_name)
-    product_name = re.sub(r'Fragment', r'', product_name, flags=re.IGNORECASE)
-    product_name = re.sub(r'partial', r'', product_name, flags=re.IGNORECASE)
-
+    Rule(r'truncat(ed|ion)?', ''),
+    Rule(r'Truncated ', r'Nonfunctional '),
+    Rule(r'Fragment', r'', re.IGNORECASE),
+    Rule(r'partial', r'', re.IGNORECASE),
     # Remove strings containing three or more consecutive digits (may be part of a larger string)
-    product_name = re.sub(r'\S*\d{3,}\S*', r'', product_name)
-
-    product_name = product_name.replace('_', ' ')  # Replace underscores with spaces
-
-    # Change homologs/paralogs to '-like protein'
-    if not(re.search(r'-like', product_name)):
-        product_name = re.sub(r'\b(Homolog|paralog)\b', r'-like protein', product_name)
-        product_name = re.sub(r'\shomolog', r'-like protein', product_name)
-    else:
-        product_name = re.sub(r'\b(Homolog|paralog)\b', r'', product_name)
-        product_name = re.sub(r'\shomolog', r'', product_name)
+    Rule(r'\S*\d{3,}\S*', r'', only_if=r'\d{3}'),
+    # Replace underscores with spaces
+    Rule(r'_', ' '),
+    # Change homologs/paralogs to '-like protein', or drop them if the name has -like already
+    Rule(r'\b(?:Homolog|paralog)\b|\shomolog', r'-like protein', unless=r'-like'),
+    Rule(r'\b(?:Homolog|paralog)\b|\shomolog', r'', only_if=r'-like'),
     # also remove like from chloroplastic-like and mitochondrial-like
-    product_name = re.sub(r'chloroplastic-like', r'chloroplastic', product_name)
-    product_name = re.sub(r'mitochondrial-like', r'mitochondrial', product_name)
-    product_name = re.sub(r'chloroplasticchromoplastic-like', r'chloroplasticchromoplastic', product_name)
-
+    Rule(r'chloroplastic-like', r'chloroplastic'),
+    Rule(r'mitochondrial-like', r'mitochondrial'),
+    Rule(r'chloroplasticchromoplastic-like', r'chloroplasticchromoplastic'),
     # remove -like proteins from protein -like protein
-    product_name = re.sub(r'protein -like protein', r'protein', product_name)
-
+    Rule(r'protein -like protein', r'protein'),
     # if a product name contains --, make it one -
-    product_name = re.sub(r'--', '-', product_name)
-
+    Rule(r'--', '-'),
     # someone seriously submitted a homeolog, replace by nothing
-    product_name = re.sub(r'homeolog', '', product_name)
-
+    Rule(r'homeolog', ''),
     # make forms singular
-    product_name = re.sub(r'forms', 'form', product_name)
-
+    Rule(r'forms', 'form'),
     # if a product name contains two times -like, remove the last -like
-    product_name = re.sub(r'-like(.*)-like', r'\1-like', product_name)
-
+    Rule(r'-like(.*)-like', r'\1-like', only_if=r'-like.*-like'),
     # if a product name contains -like putative, remove putative
-    if re.search(r'-like', product_name) and re.search(r'putative', product_name):
-        product_name = re.sub(r'putative', r'', product_name)
-
+    Rule(r'putative', r'', only_if=r'-like'),
     # make yippee-like uniformal, if there is no dash, introduce it
-    product_name = re.sub(r'yippee like', r'yippee-like', product_name)
-
+    Rule(r'yippee like', r'yippee-like'),
     # if a product name ends in like \d+, remove the digits
-    product_name = re.sub(r'like \d+$', r'like', product_name)
+    Rule(r'like \d+$', r'like'),
     # if a product name ends in containing \d+ remove digits
-    product_name = re.sub(r'containing \d+$', r'containing', product_name)
-
+    Rule(r'containing \d+$', r'containing'),
     # Shorten long product names to 100 characters
-    if len(product_name) > 100:
-        # Find the last space before the 100th character
-        last_space = product_name[:100].rfind(' ')
-        # replace product_name with the first 100 characters up to the last space
-        product_name = product_name[:last_space].rstrip()
-
+    Rule(r'\A.{101,}\Z', shorten_product_name, re.DOTALL),
     # Replace 'gene' with 'protein'
-    product_name = re.sub(r'\bgene\b', r'protein', product_name)
-
-    # Fix product names starting with "and"
-    if re.match(r'\s?and\s', product_name):
-        product_name = product_name[4:].strip()
-
-    # Fix product names starting with "a"
-    if re.match(r'\s?a\s', product_name):
-        product_name = product_name[2:].strip()
-
+    Rule(r'\bgene\b', r'protein'),
+    # Fix product names starting with "and" or "a"
+    Rule(r'\A\s?and\s\s*(.*?)\s*\Z', r'\1', re.DOTALL),
+    Rule(r'\A\s?a\s\s*(.*?)\s*\Z', r'\1', re.DOTALL),
     # Remove "FOG" from product names
-    product_name = product_name.replace("FOG", "")
-
-    # If a product name contains gp, replace the entire product name with "Hypothetical protein"
-    if re.search(r'gp', product_name):
-        product_name = "hypothetical protein"
-
+    Rule(r'FOG', ''),
+    # If a product name contains gp, replace the entire product name with "hypothetical protein"
+    Rule(r'.*gp.*', 'hypothetical protein', re.DOTALL, only_if=r'gp'),
     # Replace "possibly", "residue", and "unnamed" with empty strings or replacements
-    product_name = re.sub(r'\bpossibly\b', r'', product_name, flags=re.IGNORECASE)
-    product_name = re.sub(r'\bresidue\b', r'', product_name, flags=re.IGNORECASE)
-    product_name = re.sub(r'\bunnamed\b', r'putative protein', product_name, flags=re.IGNORECASE)
-
+    Rule(r'\bpossibly\b', r'', re.IGNORECASE),
+    Rule(r'\bresidue\b', r'', re.IGNORECASE),
+    Rule(r'\bunnamed\b', r'putative protein', re.IGNORECASE),
     # if product ends in family, replace with family member
-    product_name = re.sub(r'family$', r'family member', product_name, flags=re.IGNORECASE)
-
+    Rule(r'family$', r'family member', re.IGNORECASE),
     # fix plurals
-    product_name = re.sub(r'ases', r'ase', product_name)
-    product_name = re.sub(r'proteins', r'protein', product_name)
-    product_name = re.sub(r'units', r'unit', product_name)
-    product_name = re.sub(r'ac-diamides', r'ac-diamide', product_name)
-    product_name = re.sub(r'chaperonins', r'chaperonin', product_name)
-    product_name = re.sub(r'complexes', r'complex', product_name)
-    product_name = re.sub(r'condensins', r'condensin', product_name)
-    product_name = re.sub(r'copines', r'copine', product_name)
-    product_name = re.sub(r'biotransformers', r'biotransformer', product_name)
-    product_name = re.sub(r'enzymes', r'enzyme', product_name)
-    product_name = re.sub(r'cyclins', r'cyclin', product_name)
-    product_name = re.sub(r'cylophilins', r'cylophilin', product_name)
-    product_name = re.sub(r'channels', r'channel', product_name)
-    product_name = re.sub(r'mutants', r'mutant', product_name)
-    product_name = re.sub(r'receptors', r'receptor', product_name)
-    product_name = re.sub(r'retroposons', r'retroposon', product_name)
-    product_name = re.sub(r'factors', r'factor', product_name)
-    product_name = re.sub(r'members', r'member', product_name)
-    product_name = re.sub(r'antigens', r'antigen', product_name)
-
+    Rule('|'.join(re.escape(plural) for plural in PLURALS), singular),
     # if something comes afte -like, move the -like to the end of the string
-    product_name = re.sub(r'(.*)-like(.*)', r'\1\2-like', product_name)
-
+    Rule(r'(.*)-like(.*)', r'\1\2-like', only_if=r'-like'),
     # if manganese-dependent
-    product_name = re.sub(r'manganese-dependent', r'manganese dependent', product_name)
+    Rule(r'manganese-dependent', r'manganese dependent'),
     # if it contains dependent but neither protein nor enzyme nor complex, append protein
-    if re.search(r'dependent', product_name) and not re.search(r'protein|enzyme|complex', product_name):
-        product_name = product_name + ' protein'
-
-    if re.search(r'^\s*1-like$', product_name) or re.search(r'^\s*1 protein-like$', product_name):
-        product_name = re.sub(r'^\s*1-like$', r'hypothetical protein', product_name)
-        product_name = re.sub(r'^\s*1 protein-like$', r'hypothetical protein', product_name)
-
+    Rule(r'\Z', ' protein', only_if=r'dependent', unless=r'protein|enzyme|complex'),
+    # names that consist of a number and -like only
+    Rule(r'^\s*1(?: protein)?-like$', r'hypothetical protein'),
     # residue Fragilaria_radians.dr # this should be ignored, it's valuable information
     # conserved protein Thalassiosira_delicatula.dr I think this should also be ignored
-
     # Convert all-caps product names to title case
-    if product_name.isupper():
-        product_name = product_name.title()
-
+    Rule(r'\A.+\Z', title_if_upper, re.DOTALL),
     # Collapse multiple spaces into a single space and strip leading/trailing whitespace
-    product_name = re.sub(r'\s+', ' ', product_name).strip()
-
-    return product_name.strip()
-
-def process_gff3(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            if line.startswith('#'):
-                outfile.write(line)
-                continue
-
-            fields = line.strip().split('\t')
-            if len(fields) == 9:
-                attributes = fields[8]
-                
-                # Check for "product=" in the attributes column
-                if 'product=' in attributes:
-                    product_match = re.search(r'product=([^;]+)', attributes)
-                    if product_match:
-                        product_name = product_match.group(1)
-                        
-                        # Fix the product name
-                        fixed_product_name = fix_product_name(product_name)
-
-                        # Replace the old product name with the fixed one
-                        attributes = attributes.replace(product_name, fixed_product_name)
-                        fields[8] = attributes
-
-                # Remove "fragment" from product descriptions or comments
-                attributes = re.sub(r'fragment', '', attributes, flags=re.IGNORECASE)
-
-                # in attributes, replace 'Homologous to' with 'Similar to'
-                attributes = re.sub(r'Homologous to', 'Similar to', attributes)
-                # replace Homology with an empty string
-                attributes = re.sub(r'Homology', '', attributes)
-                # fix product names that start with a
-                attributes = re.sub(r'product=a ', 'product=', attributes)
-                # replace Homologues of by Similar to
-                attributes = re.sub(r'Homologues of', 'Similar to', attributes)
-                # replace product=Uncharacterised protein family by product=Hypothetical protein
-                attributes = re.sub(r'product=Uncharacterised protein family', 'product=Hypothetical protein', attributes)
-                # if a product name ends in rRNA, extend by -modifying protein
-                attributes = re.sub(r'rRNA;', 'rRNA-modifying protein;', attributes)
-                # delete the phrase "and related protein" from attributes
-                attributes = re.sub(r' and related protein', '', attributes)
-                # replace "Conserved hypothetical protein" with "Conserved protein"
-                attributes = re.sub(r'Conserved hypothetical protein', 'Conserved protein', attributes)
-                # replace " and related enzymes" with empty string
-                attributes = re.sub(r' and related enzymes', '', attributes)
-                # replace "Shiftless antiviral inhibitor of ribosomal frameshifting protein homolog;note=EggNOG:UPF0515 protein C19orf66 homolog" by "Similar to shiftless antiviral inhibitor of ribosomal frameshifting protein"
-                attributes = re.sub(r'Shiftless antiviral inhibitor of ribosomal frameshifting protein homolog;note=EggNOG:UPF0515 protein C19orf66 homolog', 'Similar to shiftless antiviral inhibitor of ribosomal frameshifting protein', attributes)
-                fields[8] = attributes
-                # Write the fixed line
-                outfile.write('\t'.join(fields) + '\n')
+    Rule(r'\s+', ' '),
+    Rule(r'\A\s+|\s+\Z', ''),
+
+    # Rules for the whole attributes column, applied after the product name was fixed
+    # Remove "fragment" from product descriptions or comments
+    Rule(r'fragment', '', re.IGNORECASE, 'attributes'),
+    # in attributes, replace 'Homologous to' with 'Similar to'
+    Rule(r'Homologous to', 'Similar to', scope='attributes'),
+    # replace Homology with an empty string
+    Rule(r'Homology', '', scope='attributes'),
+    # fix product names that start with a
+    Rule(r'product=a ', 'product=', scope='attributes'),
+    # replace Homologues of by Similar to
+    Rule(r'Homologues of', 'Similar to', scope='attributes'),
+    # replace product=Uncharacterised protein family by product=Hypothetical protein
+    Rule(r'product=Uncharacterised protein family', 'product=Hypothetical protein', scope='attributes'),
+    # if a product name ends in rRNA, extend by -modifying protein
+    Rule(r'rRNA;', 'rRNA-modifying protein;', scope='attributes'),
+    # delete the phrase "and related protein" from attributes
+    Rule(r' and related protein', '', scope='attributes'),
+    # replace "Conserved hypothetical protein" with "Conserved protein"
+    Rule(r'Conserved hypothetical protein', 'Conserved protein', scope='attributes'),
+    # replace " and related enzymes" with empty string
+    Rule(r' and related enzymes', '', scope='attributes'),
+    # replace "Shiftless antiviral inhibitor of ribosomal frameshifting protein homolog;note=EggNOG:UPF0515 protein C19orf66 homolog" by "Similar to shiftless antiviral inhibitor of ribosomal frameshifting protein"
+    Rule(r'Shiftless antiviral inhibitor of ribosomal frameshifting protein homolog;note=EggNOG:UPF0515 protein C19orf66 homolog', 'Similar to shiftless antiviral inhibitor of ribosomal frameshifting protein', scope='attributes'),
+]
+
+def compile_rules(rules, scope):
+    """Compile the rules of one scope into (pattern, replacement, only_if, unless) tuples."""
+    compiled = []
+    for rule in rules:
+        if rule.scope == scope:
+            compiled.append((re.compile(rule.pattern, rule.flags),
+                             rule.replacement,
+                             re.compile(rule.only_if) if rule.only_if else None,
+                             re.compile(rule.unless) if rule.unless else None))
+    return compiled
+
+def compile_rule_filter(rules, scope):
+    """Compile one pattern that matches wherever any rule of the scope could apply."""
+    alternatives = []
+    for rule in rules:
+        if rule.scope == scope:
+            flags = 'i' if rule.flags & re.IGNORECASE else ''
+            flags += 's' if rule.flags & re.DOTALL else ''
+            alternatives.append(f"(?{flags}:{rule.pattern})" if flags else f"(?:{rule.pattern})")
+    return re.compile('|'.join(alternatives))
+
+# Characters that make a rule pattern a regular expression rather than a plain string
+REGEX_SYNTAX = re.compile(r'[\\.^$*+?{}\[\]|()]')
+
+def compile_bytes_rule_filter(rules, scope):
+    """
+    Return a function that tells whether any rule of the scope could apply
+    to ASCII text given as bytes, like the pattern of compile_rule_filter().
+
+    Plain string patterns are searched as one bytes pattern, or with 'in' in
+    the lowercased text if they are case-insensitive; a pattern with a (?i:)
+    group cannot skip ahead to the first characters of its alternatives and
+    is much slower. Other patterns are searched in the decoded text.
+    """
+    literals, folded, others = [], [], []
+    for rule in rules:
+        if rule.scope != scope:
+            continue
+        if REGEX_SYNTAX.search(rule.pattern) or not rule.pattern.isascii():
+            others.append(rule)
+        elif rule.flags & re.IGNORECASE:
+            folded.append(rule.pattern.lower().encode())
+        else:
+            literals.append(re.escape(rule.pattern.encode()))
+    literal_pattern = re.compile(b'|'.join(literals)) if literals else None
+    pattern = compile_rule_filter(others, scope) if others else None
+
+    def may_apply(text):
+        if literal_pattern is not None and literal_pattern.search(text):
+            return True
+        if folded:
+            lowered = text.lower()
+            for literal in folded:
+                if literal in lowered:
+                    return True
+        return pattern is not None and pattern.search(text.decode()) is not None
+    return may_apply
+
+def apply_rules(text, compiled_rules):
+    for pattern, replacement, only_if, unless in compiled_rules:
+        if only_if is not None and not only_if.search(text):
+            continue
+        if unless is not None and unless.search(text):
+            continue
+        text = pattern.sub(replacement, text)
+    return text
+
+PRODUCT_RULES = compile_rules(PRODUCT_NAME_RULES, 'product')
+ATTRIBUTE_RULES = compile_rules(PRODUCT_NAME_RULES, 'attributes')
+ATTRIBUTE_RULE_FILTER = compile_rule_filter(PRODUCT_NAME_RULES, 'attributes')
+ATTRIBUTE_RULES_MAY_APPLY = compile_bytes_rule_filter(PRODUCT_NAME_RULES, 'attributes')
+
+def fix_product_name(product_name):
+    return apply_rules(product_name, PRODUCT_RULES)
+
+def rules_hash():
+    """Hash of the product name rules; a cache built with other rules is discarded."""
+    table = []
+    for rule in PRODUCT_NAME_RULES:
+        replacement = inspect.getsource(rule.replacement) if callable(rule.replacement) else rule.replacement
+        table.append((rule.pattern, replacement, int(rule.flags), rule.scope, rule.only_if, rule.unless))
+    table.append(sorted(PLURALS.items()))
+    return hashlib.sha256(repr(table).encode()).hexdigest()
+
+class ProductNameCache:
+    """
+    Memoizes fix_product_name() by the raw product name.
+
+    The same product name occurs on every mRNA and CDS line of a transcript
+    and in many genes and species. If a path is given, fixed names are also
+    stored in an SQLite file. That file can be shared by all species, so a
+    re-run only evaluates names that were never seen before. The file is
+    emptied when the rule table changes.
+    """
+
+    def __init__(self, path=None):
+        self.memo = {}
+        self.new_names = []
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS product_names (raw TEXT PRIMARY KEY, fixed TEXT)")
+            current_hash = rules_hash()
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'rules_hash'").fetchone()
+            if row is None or row[0] != current_hash:
+                self.db.execute("DELETE FROM product_names")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('rules_hash', ?)", (current_hash,))
+            self.db.commit()
+
+    def fix(self, product_name):
+        """Return fix_product_name(product_name), evaluating each name only once."""
+        fixed = self.memo.get(product_name)
+        if fixed is not None:
+            self.hits += 1
+            return fixed
+        if self.db is not None:
+            row = self.db.execute("SELECT fixed FROM product_names WHERE raw = ?", (product_name,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                self.memo[product_name] = row[0]
+                return row[0]
+        self.misses += 1
+        fixed = fix_product_name(product_name)
+        self.memo[product_name] = fixed
+        self.new_names.append((product_name, fixed))
+        return fixed
+
+    def close(self):
+        """Store newly evaluated names in the SQLite file."""
+        if self.db is not None:
+            self.db.executemany("INSERT OR IGNORE INTO product_names VALUES (?, ?)", self.new_names)
+            self.db.commit()
+            self.db.close()
+            self.db = None
+        self.new_names = []
+
+    def report(self):
+        return f"Product name cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses"
+
+def fix_attributes(attributes, product_name, fixed_product_name):
+    """Return column 9 with the product name replaced by the fixed one and the attribute-wide rules applied."""
+    if product_name:
+        # Replace the old product name with the fixed one
+        attributes = attributes.replace(product_name, fixed_product_name)
+
+    # Apply the attribute-wide rules, unless none of them can match
+    if attributes.isascii():
+        may_apply = ATTRIBUTE_RULES_MAY_APPLY(attributes.encode())
+    else:
+        may_apply = ATTRIBUTE_RULE_FILTER.search(attributes)
+    if may_apply:
+        attributes = apply_rules(attributes, ATTRIBUTE_RULES)
+    return attributes
+
+def fix_product_records(records, cache=None):
+    """Yield the GFF3 records with fixed product names; malformed lines are dropped."""
+    if cache is None:
+        cache = ProductNameCache()
+    for record in records:
+        if record.is_comment:
+            yield record
+            continue
+
+        if record.is_feature:
+            # Check for "product=" in the attributes column and fix the product name
+            product_name = record.get('product')
+            fixed_product_name = cache.fix(product_name) if product_name else None
+
+            fields = list(record.fields)
+            fields[8] = fix_attributes(record.attributes_text, product_name, fixed_product_name)
+            # Write the fixed line
+            yield GFF3Record.from_fields(fields)
+
+def fix_product_lines(lines, cache=None):
+    """
+    Yield the output of fix_product_records() for the lines (bytes) of a
+    GFF3 file, as bytes.
+
+    A plain feature line whose product name stays the same and to whose
+    attributes no attribute-wide rule applies is yielded as it was read;
+    only the lines that change (and lines that are not plain) are decoded.
+    """
+    if cache is None:
+        cache = ProductNameCache()
+    fix = cache.fix
+    for line, columns in read_plain_features(lines):
+        if columns is None:
+            for record in fix_product_records((line,), cache):
+                yield record.raw.encode()
+            continue
+        attributes = columns[8]
+        product = attribute_bytes(attributes, b'product=')
+        if product:
+            product_name = product.decode()
+            fixed_product_name = fix(product_name)
+            unchanged = fixed_product_name == product_name
+        else:
+            product_name = fixed_product_name = None
+            unchanged = True
+        if unchanged and not ATTRIBUTE_RULES_MAY_APPLY(attributes):
+            yield line
+            continue
+        fields = line.decode()[:-1].split('\t')
+        fields[8] = fix_attributes(fields[8], product_name, fixed_product_name)
+        yield GFF3Record.from_fields(fields).raw.encode()
+
+def fix_product_shard(path, start, end, cache_file):
+    """Process one shard of the input in a worker process; returns the output and the cache counters."""
+    cache = ProductNameCache(cache_file)
+    data = b''.join(fix_product_lines(open_shard(path, start, end), cache))
+    cache.close()
+    return data, (cache.hits, cache.disk_hits, cache.misses)
+
+def process_gff3(input_file, output_file, cache_file=None, jobs=1):
+    cache = ProductNameCache(cache_file if jobs == 1 else None)
+    if jobs > 1:
+        with xopen(output_file, 'wb') as outfile:
+            for text, (hits, disk_hits, misses) in map_shards(fix_product_shard, input_file, jobs, args=(cache_file,)):
+                outfile.write(text)
+                cache.hits += hits
+                cache.disk_hits += disk_hits
+                cache.misses += misses
+    else:
+        with xopen(input_file, 'rb') as infile, xopen(output_file, 'wb') as outfile:
+            outfile.writelines(fix_product_lines(infile, cache))
+        cache.close()
+    print(cache.report())
+    return cache
 
 def main():
     parser = argparse.ArgumentParser(description="Fix suspect product names in a GFF3 file.")
     parser.add_argument('-i', '--input', required=True, help='Input GFF3 file')
     parser.add_argument('-o', '--output', required=True, help='Output GFF3 file')
+    parser.add_argument('-c', '--cache', help='SQLite file to keep fixed product names across runs and species (created if missing)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes; the input is split at gene lines and the output is the same as with one process (default: 1)')
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
+    metrics = RunMetrics.from_args('fix_product_names_ncbi.py', args)
 
-    process_gff3(args.input, args.output)
+    with metrics.stage('fix_product_names', args.input, hot=True):
+        cache = process_gff3(args.input, args.output, args.cache, args.jobs)
+    metrics.cache('product_names', cache.hits + cache.disk_hits, cache.misses, memory_hits=cache.hits, disk_hits=cache.disk_hits)
+    metrics.write()
 
 if __name__ == "__main__":
     main()
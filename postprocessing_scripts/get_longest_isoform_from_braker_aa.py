@@ -1,43 +1,80 @@
 #!/usr/bin/env python3
 
+import os
+import mmap
 import argparse
-from Bio import SeqIO
+from contextlib import nullcontext
+from run_metrics import RunMetrics, add_metrics_arguments
+from compressed_io import xopen, is_gzip
+
+WHITESPACE = b' \t\r\n'
+
+def scan_fasta(data):
+    """
+    Yield (gene name, byte offset, byte length, sequence length) for every record of a FASTA file.
+
+    data is the content of the file (e.g. an mmap); a record reaches from its
+    '>' up to the next record. The gene name is the sequence ID (the first
+    word of the header) up to the first dot.
+    """
+    start = data.find(b'>')
+    while start != -1:
+        next_start = data.find(b'\n>', start)
+        end = len(data) if next_start == -1 else next_start + 1
+        header_end = data.find(b'\n', start, end)
+        if header_end == -1:
+            header_end = end
+        header = data[start + 1:header_end].split(None, 1)
+        gene_name = header[0].split(b'.')[0] if header else b''
+        sequence_length = len(data[header_end:end].translate(None, WHITESPACE))
+        yield gene_name, start, end - start, sequence_length
+        start = -1 if next_start == -1 else end
 
 def get_longest_isoforms(fasta_file, output_file):
-    # Dictionary to store the longest sequence for each gene
+    """Write the longest isoform of every gene; returns the number of sequences read and written."""
+    # Dictionary to store the longest sequence (offset, byte length, sequence length) for each gene
     gene_dict = {}
+    sequence_count = 0
 
-    # Parse the FASTA file
-    for record in SeqIO.parse(fasta_file, "fasta"):
-        # Extract gene name (everything before the first dot)
-        gene_name = record.id.split('.')[0]
+    compressed = is_gzip(fasta_file)
+    with xopen(fasta_file, 'rb') as fasta, xopen(output_file, 'wb') as output_handle:
+        if not compressed and os.fstat(fasta.fileno()).st_size == 0:
+            return 0, 0
+        # A compressed proteome is decompressed into memory instead of being mapped
+        with nullcontext(fasta.read()) if compressed else mmap.mmap(fasta.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # First pass: only remember where the longest isoform of every gene is
+            for gene_name, offset, length, sequence_length in scan_fasta(data):
+                sequence_count += 1
+                # If the current sequence is longer, replace the existing one
+                if gene_name not in gene_dict or sequence_length > gene_dict[gene_name][2]:
+                    gene_dict[gene_name] = (offset, length, sequence_length)
 
-        # Check if this gene is already in the dictionary
-        if gene_name in gene_dict:
-            # If the current sequence is longer, replace the existing one
-            if len(record.seq) > len(gene_dict[gene_name].seq):
-                gene_dict[gene_name] = record
-        else:
-            # If the gene is not in the dictionary, add it
-            gene_dict[gene_name] = record
-
-    # Write the longest isoforms to the output file
-    with open(output_file, "w") as output_handle:
-        SeqIO.write(gene_dict.values(), output_handle, "fasta")
+            # Copy the longest isoforms unchanged (including the line wrapping) to the output file
+            for offset, length, _ in gene_dict.values():
+                record = data[offset:offset + length]
+                output_handle.write(record)
+                if not record.endswith(b'\n'):
+                    output_handle.write(b'\n')
+    return sequence_count, len(gene_dict)
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Extract longest isoforms from protein FASTA.")
-    
+
     # Define arguments
     parser.add_argument("-i", "--input", required=True, help="Input protein FASTA file")
     parser.add_argument("-o", "--output", required=True, help="Output FASTA file with longest isoforms")
-    
+    add_metrics_arguments(parser)
+
     # Parse arguments
     args = parser.parse_args()
+    metrics = RunMetrics.from_args('get_longest_isoform_from_braker_aa.py', args)
 
     # Call the function with the provided arguments
-    get_longest_isoforms(args.input, args.output)
+    with metrics.stage('longest_isoforms', hot=True) as stage:
+        stage['records'], genes = get_longest_isoforms(args.input, args.output)
+    metrics.count('genes', genes)
+    metrics.write()
 
 if __name__ == "__main__":
     main()
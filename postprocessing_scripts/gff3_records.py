@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Shared streaming GFF3 reader for the postprocessing scripts and ncbi_gff.py.
+
+Every line of a GFF3 file becomes a GFF3Record. The nine columns are split
+once, the attributes column (column 9) is only parsed into a dictionary when
+a script asks for it, and records that were never modified keep their
+original column 9 text when they are written back.
+
+iter_gene_blocks() groups the record stream into gene blocks
+(gene -> mRNA -> exon/CDS/...), relying on the usual AGAT/BRAKER layout in
+which all features of a gene follow its gene line.
+
+read_plain_features() and read_blocks() are the binary fast path: lines
+that a script passes through unchanged are copied as bytes without being
+decoded, and only the lines it changes are parsed as GFF3Records.
+
+shard_ranges(), read_shard() and map_shards() split a file at gene lines
+into byte ranges and process them in a pool of worker processes (the
+--jobs option of the scripts). A compressed file is decompressed to a
+temporary file first.
+"""
+
+import io
+import os
+import multiprocessing
+from compressed_io import plain_file
+
+FEATURE_COLUMNS = 9
+
+
+class GFF3Record:
+    """
+    One line of a GFF3 file.
+
+    Comment lines (starting with '#') have fields set to None. For all other
+    lines fields holds the tab-separated columns of the stripped line, even if
+    there are not exactly nine of them; use is_feature to skip malformed
+    lines. Attribute tags are assumed to be unique, as required by GFF3.
+    """
+
+    __slots__ = ('raw', 'fields', '_attrs')
+
+    def __init__(self, raw, fields=None):
+        self.raw = raw
+        self._attrs = None
+        if fields is None and not raw.startswith('#'):
+            fields = raw.strip().split('\t')
+        self.fields = fields
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Create a record from a list of nine columns."""
+        return cls('\t'.join(fields) + '\n', fields)
+
+    @property
+    def is_comment(self):
+        return self.fields is None
+
+    @property
+    def is_feature(self):
+        return self.fields is not None and len(self.fields) == FEATURE_COLUMNS
+
+    @property
+    def seqid(self):
+        return self.fields[0]
+
+    @property
+    def source(self):
+        return self.fields[1]
+
+    @property
+    def type(self):
+        return self.fields[2]
+
+    @type.setter
+    def type(self, value):
+        self.fields[2] = value
+
+    @property
+    def start(self):
+        return int(self.fields[3])
+
+    @start.setter
+    def start(self, value):
+        self.fields[3] = str(value)
+
+    @property
+    def end(self):
+        return int(self.fields[4])
+
+    @end.setter
+    def end(self, value):
+        self.fields[4] = str(value)
+
+    @property
+    def strand(self):
+        return self.fields[6]
+
+    @property
+    def attributes_text(self):
+        return self.fields[8]
+
+    @attributes_text.setter
+    def attributes_text(self, value):
+        self.fields[8] = value
+        self._attrs = None
+
+    @property
+    def attributes(self):
+        """Column 9 as a dictionary, parsed on first access."""
+        if self._attrs is None:
+            self._attrs = parse_attributes(self.fields[8])
+        return self._attrs
+
+    def get(self, key, default=None):
+        """
+        Return the value of attribute key.
+
+        Until the attributes have been parsed, the column 9 text is scanned
+        directly instead of building the whole dictionary.
+        """
+        if self._attrs is not None:
+            return self._attrs.get(key, default)
+        text = self.fields[8]
+        prefix = key + '='
+        if text.startswith(prefix):
+            begin = len(prefix)
+        else:
+            begin = text.find(';' + prefix)
+            if begin == -1:
+                return default
+            begin += len(prefix) + 1
+        end = text.find(';', begin)
+        return text[begin:] if end == -1 else text[begin:end]
+
+    def set(self, key, value):
+        """Set attribute key and re-render column 9."""
+        attributes = self.attributes
+        attributes[key] = value
+        self.fields[8] = attributes_to_str(attributes)
+
+    def line(self):
+        """Return the record as a GFF3 line, columns re-joined with tabs."""
+        if self.fields is None:
+            return self.raw
+        return '\t'.join(self.fields) + '\n'
+
+
+# Bytes (as ints) that str.strip() removes from an ASCII line
+ASCII_WHITESPACE = frozenset(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')
+
+# Bytes read at a time by read_blocks(); small enough to stay in the CPU caches
+BLOCK_SIZE = 1 << 18
+
+
+def attribute_bytes(attributes, prefix):
+    """
+    Return the value of an attribute in column 9 given as bytes, found as
+    GFF3Record.get() finds it; prefix is the key with '=' (e.g. b'ID=').
+    """
+    if attributes.startswith(prefix):
+        begin = len(prefix)
+    else:
+        begin = attributes.find(b';' + prefix)
+        if begin == -1:
+            return None
+        begin += len(prefix) + 1
+    end = attributes.find(b';', begin)
+    return attributes[begin:] if end == -1 else attributes[begin:end]
+
+
+def decode_records(data):
+    """Return the GFF3Records of data (bytes), split into lines as in text mode, where '\r\n' and '\r' end lines, too."""
+    text = data.decode()
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = text.split('\n')
+    records = [GFF3Record(line + '\n') for line in lines[:-1]]
+    if lines[-1]:
+        records.append(GFF3Record(lines[-1]))
+    return records
+
+
+def read_plain_features(lines):
+    """
+    Yield (line, columns) for the lines (bytes) of a GFF3 file.
+
+    A plain feature line is an ASCII line of exactly nine tab-separated
+    columns that ends in '\n' and has no other leading or trailing
+    whitespace and no '\r'. It is what text mode reads and what its
+    GFF3Record writes back, so it can be copied as it is; columns are its
+    nine columns as bytes, the last one without '\n'. Every other line is
+    decoded and yielded as (GFF3Record, None).
+    """
+    whitespace = ASCII_WHITESPACE
+    for line in lines:
+        if (len(line) > 1 and line[-1] == 10 and line[0] != 35
+                and line[0] not in whitespace and line[-2] not in whitespace
+                and line.count(b'\t') == 8 and b'\r' not in line and line.isascii()):
+            yield line, line[:-1].split(b'\t')
+        else:
+            for record in decode_records(line):
+                yield record, None
+
+
+def line_spans(block, needle):
+    """Yield (start, end) of every line of block (bytes) that contains needle; end is past the '\n'."""
+    position = block.find(needle)
+    while position != -1:
+        start = block.rfind(b'\n', 0, position) + 1
+        end = block.find(b'\n', position)
+        end = len(block) if end == -1 else end + 1
+        yield start, end
+        position = block.find(needle, end)
+
+
+def read_blocks(handle, size=BLOCK_SIZE):
+    """
+    Yield the data of a binary file in blocks (bytearrays) of about size
+    bytes that end at the end of a line.
+
+    The data is read into the block, and the rest of its last line is
+    appended in place, so the block is not copied.
+    """
+    while True:
+        block = bytearray(size)
+        length = handle.readinto(block)
+        if not length:
+            return
+        del block[length:]
+        if not block.endswith(b'\n'):
+            block += handle.readline()
+        yield block
+
+
+def parse_attributes(attributes_str):
+    """Parse the attributes column of a GFF3 line into a dictionary."""
+    attributes = {}
+    for attribute in attributes_str.split(';'):
+        if '=' in attribute:
+            key, value = attribute.split('=', 1)
+            attributes[key] = value
+    return attributes
+
+
+def attributes_to_str(attributes):
+    """Convert the attribute dictionary back to a GFF3 string."""
+    return ';'.join([f"{key}={value}" for key, value in attributes.items()])
+
+
+def read_gff3(handle):
+    """Yield a GFF3Record for every line of an open GFF3 file."""
+    for line in handle:
+        yield GFF3Record(line)
+
+
+class GeneBlock:
+    """
+    A gene line together with all records that follow it up to the next gene.
+
+    records holds the block in file order, starting with the gene record.
+    Records preceding the first gene of a file form a block with gene None.
+    """
+
+    __slots__ = ('gene', 'records')
+
+    def __init__(self, gene, records):
+        self.gene = gene
+        self.records = records
+
+    @property
+    def gene_id(self):
+        return self.gene.get('ID') if self.gene is not None else None
+
+    def transcripts(self):
+        """Return the mRNA/transcript records of this block in file order."""
+        return [record for record in self.records
+                if record.is_feature and record.type in ('mRNA', 'transcript')]
+
+    def children(self, transcript_id):
+        """Return the records whose Parent is transcript_id, in file order."""
+        return [record for record in self.records
+                if record.is_feature and record.get('Parent') == transcript_id]
+
+
+def iter_gene_blocks(records):
+    """Group a record stream into GeneBlocks, one per gene line."""
+    gene = None
+    block = []
+    for record in records:
+        if record.fields is not None and len(record.fields) > 2 and record.fields[2] == 'gene':
+            if block:
+                yield GeneBlock(gene, block)
+            gene = record
+            block = [record]
+        else:
+            block.append(record)
+    if block:
+        yield GeneBlock(gene, block)
+
+
+# Shards per worker process, so that fast and slow shards even out
+SHARDS_PER_JOB = 4
+
+
+def is_gene_line(line):
+    """True if a line (bytes) is a gene feature line."""
+    if line.startswith(b'#'):
+        return False
+    fields = line.split(b'\t', 3)
+    return len(fields) > 2 and fields[2] == b'gene'
+
+
+def shard_ranges(path, shards, is_boundary=None):
+    """
+    Split a GFF3 file into at most shards byte ranges (start, end) that begin at gene lines.
+
+    The file is cut near equally spaced offsets, at the next gene line for
+    which is_boundary(previous_block, gene_line) is true. previous_block
+    holds the lines (bytes) from the preceding gene line up to this one, or
+    is None if the preceding gene line was not seen. Without is_boundary,
+    every gene line is a possible cut.
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as handle:
+        for shard in range(1, shards):
+            target = max(size * shard // shards, offsets[-1])
+            handle.seek(target)
+            offset = target
+            if target > 0:
+                offset += len(handle.readline())  # skip the partial line
+            previous_block = None
+            for line in iter(handle.readline, b''):
+                if is_gene_line(line):
+                    if is_boundary is None or is_boundary(previous_block, line):
+                        break
+                    previous_block = []
+                if previous_block is not None:
+                    previous_block.append(line)
+                offset += len(line)
+            if offset >= size:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+    return list(zip(offsets, offsets[1:] + [size]))
+
+
+def read_shard(path, start, end):
+    """Return the records of the byte range start..end of a GFF3 file, read as with open(path, 'r')."""
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    return read_gff3(io.TextIOWrapper(io.BytesIO(data)))
+
+
+def open_shard(path, start, end):
+    """Return the byte range start..end of a GFF3 file as a binary file object."""
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    return io.BytesIO(data)
+
+
+def map_shards(worker, path, jobs, is_boundary=None, args=()):
+    """
+    Run worker(path, start, end, *args) on the shards of a GFF3 file in jobs processes.
+
+    Yields the results in file order as they become available. Worker
+    processes are forked, so they see module-level tables set before the
+    call. A gzip/bgzip file is decompressed to a temporary file, which the
+    workers get as path.
+    """
+    with plain_file(path) as plain_path:
+        tasks = [(plain_path, start, end) + tuple(args) for start, end in shard_ranges(plain_path, jobs * SHARDS_PER_JOB, is_boundary)]
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            yield from pool.imap(call_worker, [(worker, task) for task in tasks])
+
+
+def call_worker(job):
+    worker, task = job
+    return worker(*task)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+from gff3_records import read_gff3
+from filter_genes_from_uconn_gff3 import read_gene_list, filter_records
+from add_mRNA_line import add_mrna_chunks
+from fix_product_names_ncbi import ProductNameCache, fix_product_records
+from fix_Dbxref_attributes_in_genes import collect_gene_dbxrefs, fix_gene_dbxref_records
+from compressed_io import xopen
+from run_metrics import RunMetrics, add_metrics_arguments
+
+def drop_agat_records(records):
+    """Drop all lines that contain a tab-delimited AGAT column (same as grep -v -P "\\tAGAT\\t")."""
+    for record in records:
+        if '\tAGAT\t' not in record.raw:
+            yield record
+
+def postprocess_records(records, keep_list=None, cache=None):
+    """
+    Run the postprocessing stages on a stream of GFF3 records.
+
+    With a keep list, genes/transcripts that are not listed and AGAT lines are
+    removed first (filter_genes_from_uconn_gff3.py | grep -v AGAT). The
+    remaining stages are add_mRNA_line.py -> fix_product_names_ncbi.py ->
+    fix_Dbxref_attributes_in_genes.py. They run on the chunks produced by
+    add_mrna_chunks(), which hold complete genes, so the Dbxref fix can be
+    done without a second pass over the file.
+    """
+    if keep_list:
+        tx_dict, gene_dict = read_gene_list(keep_list)
+        records = drop_agat_records(filter_records(records, tx_dict, gene_dict))
+
+    for chunk in add_mrna_chunks(records):
+        chunk = list(fix_product_records(chunk, cache))
+        gene_id_to_geneid = collect_gene_dbxrefs(chunk)
+        yield from fix_gene_dbxref_records(chunk, gene_id_to_geneid)
+
+def postprocess(input_gff, output_gff, keep_list=None, cache_file=None):
+    cache = ProductNameCache(cache_file)
+    with xopen(input_gff, 'r') as infile, xopen(output_gff, 'w') as outfile:
+        for record in postprocess_records(read_gff3(infile), keep_list, cache):
+            outfile.write(record.raw)
+    cache.close()
+    print(cache.report())
+    return cache
+
+def main():
+    parser = argparse.ArgumentParser(description='Postprocess a functionally decorated GFF3 file in a single pass: optionally keep only listed transcripts and drop AGAT lines, then add mRNA lines, fix product names and fix Dbxref attributes of genes. Produces the same output as running the individual scripts one after another.')
+    parser.add_argument('-i', '--input', required=True, help='Input (decorated) GFF3 file.')
+    parser.add_argument('-o', '--output', required=True, help='Output GFF3 file.')
+    parser.add_argument('-l', '--list', help='Optional list of transcript names to keep (as for filter_genes_from_uconn_gff3.py). If given, AGAT lines are removed, too.')
+    parser.add_argument('-c', '--cache', help='SQLite file to keep fixed product names across runs and species (created if missing)')
+    add_metrics_arguments(parser)
+
+    args = parser.parse_args()
+    metrics = RunMetrics.from_args('postprocess.py', args)
+
+    if os.path.isfile(args.input):
+        with metrics.stage('postprocess', args.input, hot=True):
+            cache = postprocess(args.input, args.output, args.list, args.cache)
+        metrics.cache('product_names', cache.hits + cache.disk_hits, cache.misses, memory_hits=cache.hits, disk_hits=cache.disk_hits)
+        metrics.write()
+        print(f"Processed: {args.input} -> {args.output}")
+    else:
+        print("Invalid input path. Please provide a valid GFF3 file.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Run metrics shared by the GFF3 scripts and ncbi_gff.py (--metrics-json, --profile).
+
+A script wraps each of its stages in RunMetrics.stage(); for every stage the
+wall time and the number of records (input lines for GFF3 files) and with it
+the lines per second are recorded. Cache statistics, other counts and the
+peak RSS of the script and of its worker processes are added, and the whole
+run is written as one JSON object. With --profile, the stage marked as the
+hot loop runs under cProfile and the statistics are dumped for pstats or
+snakeviz.
+
+Run as a script, it aggregates the JSON files of several runs (e.g. one per
+species) into a table per script and stage.
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import argparse
+import resource
+from contextlib import contextmanager
+from compressed_io import xopen
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-json', help='Write stage timings, records per second, peak RSS and cache hit rates of this run to a JSON file')
+    parser.add_argument('--profile', help='Write cProfile statistics of the main processing loop to this file (with -j, only the main process is profiled)')
+
+def count_lines(path):
+    """Number of lines of a file, counted in binary blocks."""
+    lines = 0
+    with xopen(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return lines
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(resource.getrusage(who).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class RunMetrics:
+    """Collects the metrics of one run; does nothing but time the stages unless metrics or a profile were requested."""
+
+    def __init__(self, script, metrics_file=None, profile_file=None):
+        self.script = script
+        self.metrics_file = metrics_file
+        self.profile_file = profile_file
+        self.enabled = bool(metrics_file or profile_file)
+        self.stages = []
+        self.counts = {}
+        self.caches = {}
+        self.started = time.perf_counter()
+
+    @classmethod
+    def from_args(cls, script, args):
+        return cls(script, args.metrics_json, args.profile)
+
+    @contextmanager
+    def stage(self, name, input_file=None, hot=False):
+        """
+        Time the stage name; the number of lines of input_file is counted
+        afterwards (outside the timing) if metrics were requested. The stage
+        yields a dict, in which the caller can set 'records' itself.
+        """
+        stage = {'name': name, 'records': None}
+        profiler = cProfile.Profile() if hot and self.profile_file else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+            stage['wall_s'] = round(time.perf_counter() - start, 4)
+            if profiler:
+                profiler.dump_stats(self.profile_file)
+            if self.enabled and input_file and stage['records'] is None and os.path.isfile(input_file):
+                stage['records'] = count_lines(input_file)
+            if stage['records'] is not None and stage['wall_s'] > 0:
+                stage['records_per_s'] = round(stage['records'] / stage['wall_s'], 1)
+            self.stages.append(stage)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def cache(self, name, hits, misses, **details):
+        """Record the statistics of a cache; hits and misses give the hit rate."""
+        lookups = hits + misses
+        self.caches[name] = dict(hits=hits, misses=misses, hit_rate=round(hits / lookups, 4) if lookups else None, **details)
+
+    def as_dict(self):
+        return {
+            'script': self.script,
+            'wall_s': round(time.perf_counter() - self.started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'stages': self.stages,
+            'counts': self.counts,
+            'caches': self.caches,
+        }
+
+    def write(self):
+        """Write the metrics file if one was requested."""
+        if not self.metrics_file:
+            return
+        with open(self.metrics_file, 'w') as metrics_file:
+            json.dump(self.as_dict(), metrics_file, indent=2)
+            metrics_file.write('\n')
+
+AGGREGATE_COLUMNS = ['script', 'stage', 'runs', 'wall_s', 'records', 'records_per_s', 'max_peak_rss_mb']
+
+def aggregate_metrics(runs):
+    """Sum wall time and records of every (script, stage) over the runs; returns table rows."""
+    totals = {}
+    for run in runs:
+        for stage in run.get('stages', []):
+            key = (run.get('script'), stage['name'])
+            total = totals.setdefault(key, {'script': key[0], 'stage': key[1], 'runs': 0, 'wall_s': 0.0, 'records': 0, 'max_peak_rss_mb': 0.0})
+            total['runs'] += 1
+            total['wall_s'] += stage.get('wall_s', 0.0)
+            total['records'] += stage.get('records') or 0
+            total['max_peak_rss_mb'] = max(total['max_peak_rss_mb'], run.get('peak_rss_mb', 0.0), run.get('children_peak_rss_mb', 0.0))
+    rows = []
+    for total in totals.values():
+        total['records_per_s'] = round(total['records'] / total['wall_s'], 1) if total['wall_s'] > 0 else ''
+        total['wall_s'] = round(total['wall_s'], 3)
+        rows.append(total)
+    return rows
+
+def read_runs(paths):
+    """Read metrics files; runs nested under 'runs' (the species of ncbi_gff_all.py) are read, too."""
+    runs = []
+    for path in paths:
+        with open(path, 'r') as metrics_file:
+            metrics = json.load(metrics_file)
+        runs.append(metrics)
+        runs.extend(metrics.get('runs', []))
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate --metrics-json files of several runs (e.g. one per species) into a table of total wall time and records per script and stage.')
+    parser.add_argument('metrics_files', nargs='+', help='JSON files written with --metrics-json')
+    parser.add_argument('-o', '--output', help='Output TSV file (default: print the table)')
+    args = parser.parse_args()
+
+    rows = aggregate_metrics(read_runs(args.metrics_files))
+    output = open(args.output, 'w') if args.output else sys.stdout
+    output.write('\t'.join(AGGREGATE_COLUMNS) + '\n')
+    for row in rows:
+        output.write('\t'.join(str(row[column]) for column in AGGREGATE_COLUMNS) + '\n')
+    if args.output:
+        output.close()
+
+if __name__ == "__main__":
+    main()